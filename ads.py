@@ -1,98 +1,262 @@
-import sqlite3
-import locale
+import re
+
+import db
+import jobs
+import listing_index
+import page_cache
+import formatting
+import pagination
+import writer
+
+PAGE_SIZE = 12         # Advertisements shown per page of the home
+MAX_PAGE_SIZE = 48
+MAX_RENT = 1000000      # Euros. Keeps the rents in cents within the 31 bits of the listing index and the 64 bit integers of the SQL labels
+
+RENT_BANDS = ((None, 500), (500, 800), (800, 1200), (1200, 2000), (2000, None))    # Rent filters of the home, (min, max) in euros, max excluded. Mirrored in migration 0010
+
+# Values of each facet of the home, by column of LISTING_FACET. A rent band is its position in RENT_BANDS
+FACETS = {
+    'type': tuple(formatting.TYPES),
+    'rooms': (1, 2, 3, 4, 5, 6),
+    'furniture': (True, False),
+    'rent_band': tuple(range(len(RENT_BANDS))),
+}
+
+# Columns of LISTING_CARD read by the listings, under the names of the format_card() output. The raw sort keys are kept in 'rent_num' and 'rooms_num'
+CARD_COLUMNS = """
+    C.ADVERTISEMENT_id AS id, C.adress, C.title, C.description, C.landlord_name, C.landlord_username, C.image,
+    C.rooms_label AS rooms, C.type_label AS type, C.furniture_label AS furniture, C.rent_label AS rent, C.rent AS rent_num, C.rooms AS rooms_num
+"""
+
+def get_public_ads(sort_price, page_size=PAGE_SIZE, page_cursor=None, filters=None):
+    """
+    Returns a page of advertisements, using keyset pagination. Without filters sorting and paging are done by the database,
+    walking the index of the ordering. With filters they are done by the in-memory listing index (see listing_index.py),
+    which scans the matching advertisements faster than the database can
+
+    :param sort_price: whether the list should be sort by price, descending (if false sorts by number of rooms, ascending)
+    :param page_size: the number of advertisements in the page
+    :param page_cursor: an opaque cursor, as returned by a previous call with the same ordering and filters. If None the first page is returned
+    :param filters: a dict of filters, named like the keyword arguments of listing_index.query() (rent_min, rent_max, rooms, house_type, furniture).
+        Filters set to None are ignored
+    :returns: a (advertisements, next_cursor, prev_cursor) tuple. The cursors are None if there is no next/previous page
+    :raise ValueError: exception raised when the cursor is not valid
+    """
+    sort = 'price' if sort_price else 'rooms'
+    column = 'C.rent' if sort_price else 'C.rooms'
+    descending = sort_price
+    filters = {name: value for name, value in (filters or {}).items() if value is not None}
+
+    direction = pagination.NEXT
+    params = []
+    where = ''
+
+    if page_cursor is not None:
+        key, id, direction = pagination.decode_cursor(page_cursor, sort)
+        if direction == pagination.PREV:
+            descending = not descending     # Walk backwards from the cursor, the page is flipped back by paginate()
+
+        where = f'AND ({column}, C.ADVERTISEMENT_id) {"<" if descending else ">"} (?, ?)'
+        params = [key, id]
+
+    if filters:
+        while True:
+            ids = listing_index.query(sort, descending, page_size + 1, after=(key, id) if page_cursor is not None else None, **filters)   # One extra id tells whether there is a following page
+            rows = get_cards(ids)
+            if len(rows) == len(ids):
+                break
+
+            # The index lags behind the changes of other processes: the advertisements no longer listed are removed from it,
+            # and the page is queried again so that it is still full
+            listed = {row['id'] for row in rows}
+            for stale in ids:
+                if stale not in listed:
+                    listing_index.update(stale)
+    else:
+        order = 'DESC' if descending else 'ASC'
+
+        conn = db.get_db()
+        cursor = conn.cursor()
+
+        # The cards are read formatted from LISTING_CARD, walking the partial index of the ordering (the WHERE clause must match the index one)
+        cursor.execute(f"""
+            SELECT {CARD_COLUMNS}
+            FROM LISTING_CARD C
+            WHERE C.available AND C.has_pictures
+                {where}
+            ORDER BY {column} {order}, C.ADVERTISEMENT_id {order}
+            LIMIT ?;
+        """, (*params, page_size + 1))  # One extra row tells whether there is a following page
+        rows = [dict(row) for row in cursor.fetchall()]
 
-def get_public_ads(sort_price):
+        cursor.close()
+
+    def make_cursor(ad, direction):
+        return pagination.encode_cursor(sort, ad['rent_num'] if sort_price else ad['rooms_num'], ad['id'], direction)
+
+    return pagination.paginate(rows, page_size, direction, has_cursor=page_cursor is not None, make_cursor=make_cursor)
+
+def get_cards(ids):
     """
-    Queries the database and returns a list of advertisements
+    Reads the cards of the given listed advertisements
 
-    :param sort_price: whether the list should be sort by price (if false sorts by number of rooms)
-    :returns: a list of all advertisements on the site, sorted according to the parameter
-    """ 
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    :param ids: the advertisement ids, as returned by listing_index.query()
+    :returns: the cards, in the order of ids. The index may lag behind the changes of other processes: advertisements no longer listed are skipped
+    """
+    conn = db.get_db()
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT A.id, A.adress, A.title, A.rooms, A.type, A.description, A.rent, A.furniture, P.name as landlord_name, P.username as landlord_username, PI.path as image
-        FROM ADVERTISEMENT A
-        INNER JOIN PERSON P ON P.username = A.landlord_username
-        INNER JOIN PICTURES PI ON PI.ADVERTISEMENT_id = A.id
-        WHERE A.available = TRUE
-        GROUP BY A.id;
-    """)
-    rows = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT {CARD_COLUMNS}
+        FROM LISTING_CARD C
+        WHERE C.ADVERTISEMENT_id IN ({', '.join('?' * len(ids))}) AND C.available AND C.has_pictures;
+    """, ids)
+    cards = {row['id']: dict(row) for row in cursor.fetchall()}
 
     cursor.close()
-    conn.close()
 
-    result = []
-    for row in rows:
-        ad = dict(row)
-        ad['rooms'] = get_rooms(ad['rooms'])
-        ad['furniture'] = get_furniture(ad['furniture'], ad['type'])
-        ad['type'] = get_type(ad['type'])
-        ad['rent_num'] =ad['rent']
-        ad['rent'] = get_rent(ad['rent'])
+    return [cards[id] for id in ids if id in cards]
 
-        result.append(ad)
+def get_facet_filters(selected):
+    """
+    Translates the selected facet values into the filters of get_public_ads()
 
-    if sort_price:
-        return sorted(result, key=lambda x: x['rent_num'], reverse=True)
-    else:
-        return sorted(result, key=lambda x: x['rooms'], reverse=False)
+    :param selected: a dict with the selected value of each facet, by column of LISTING_FACET. None or missing if not filtered
+    :returns: the filters dict
+    """
+    rent_min, rent_max = RENT_BANDS[selected['rent_band']] if selected.get('rent_band') is not None else (None, None)
+
+    return {
+        'house_type': selected.get('type'),
+        'rooms': selected.get('rooms'),
+        'furniture': selected.get('furniture'),
+        'rent_min': rent_min,
+        'rent_max': rent_max - 0.01 if rent_max is not None else None,     # Rents are in whole cents, the band excludes its max
+    }
+
+def get_facet_counts(selected):
+    """
+    Counts the listed advertisements for each value of each facet, with a single query over the aggregates in LISTING_FACET.
+    The count of a value applies the filters of the other facets but not its own, so it is the number of advertisements shown when switching to it
+
+    :param selected: a dict with the selected value of each facet, by column of LISTING_FACET. None or missing if not filtered
+    :returns: a (counts, total) tuple. counts maps each facet of FACETS to a dict value -> count, total is the number of advertisements matching all the filters
+    """
+    filtered = [facet for facet in FACETS if selected.get(facet) is not None]
+    params = {facet: selected[facet] for facet in filtered}
 
-def get_ad_by_id(id):
+    def matching(excluded=None):
+        conditions = [f'F.{facet} = :{facet}' for facet in filtered if facet != excluded]
+        return ' AND '.join(conditions) or 'TRUE'
+
+    columns = []
+    for facet, values in FACETS.items():
+        for i, value in enumerate(values):
+            params[f'{facet}_{i}'] = value
+            columns.append(f'SUM(CASE WHEN {matching(facet)} AND F.{facet} = :{facet}_{i} THEN F.listed ELSE 0 END)')
+    columns.append(f'SUM(CASE WHEN {matching()} THEN F.listed ELSE 0 END)')
+
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    cursor.execute(f'SELECT {", ".join(columns)} FROM LISTING_FACET F;', params)
+    row = iter(cursor.fetchone())
+
+    cursor.close()
+
+    counts = {facet: {value: next(row) or 0 for value in values} for facet, values in FACETS.items()}   # SUM() is NULL without rows
+
+    return counts, next(row) or 0
+
+def search_ads(query, page=1, page_size=PAGE_SIZE):
+    """
+    Runs a full-text search over the title, description and adress of the available advertisements.
+    Results are ranked with bm25, matches in the title weigh the most, followed by the adress and the description
+
+    :param query: the text typed by the user. Every word must appear in the advertisement, words are matched as prefixes
+    :param page: the number of the page to be returned, starting from 1
+    :param page_size: the number of advertisements in the page
+    :returns: a (advertisements, has_next) tuple. The advertisements have the same format as the ones returned by get_public_ads()
+    """
+    match = get_match_query(query)
+    if match is None:
+        return [], False
+
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    cursor.execute(f"""
+        SELECT {CARD_COLUMNS}
+        FROM ADVERTISEMENT_FTS F
+        INNER JOIN LISTING_CARD C ON C.ADVERTISEMENT_id = F.rowid
+        WHERE ADVERTISEMENT_FTS MATCH ?
+            AND C.available AND C.has_pictures
+        ORDER BY bm25(ADVERTISEMENT_FTS, 10.0, 1.0, 5.0), C.ADVERTISEMENT_id
+        LIMIT ? OFFSET ?;
+    """, (match, page_size + 1, (page - 1) * page_size))   # One extra row tells whether there is a following page
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    cursor.close()
+
+    return rows[:page_size], len(rows) > page_size
+
+def get_ad_by_id(id, visitor_username=None):
     """
     Queries the database and returns a matching advertisement
 
     :param id: the id of the advertisement to be searched
+    :param visitor_username: the user whose visits to the house are looked up, see get_ad_by_id_raw()
     :returns: the advertisement
     """ 
-    advert = get_ad_by_id_raw(id)
+    advert = get_ad_by_id_raw(id, visitor_username)
 
     if advert is None:
         return None
 
-    advert['rooms'] = get_rooms(advert['rooms'])
-    advert['furniture'] = get_furniture(advert['furniture'], advert['type'])
-    advert['type'] = get_type(advert['type'])
-    advert['rent_num'] = advert['rent']
-    advert['rent'] = get_rent(advert['rent'])
-
-    return advert
+    return format_card(advert)
 
-def get_ad_by_id_raw(id):
+def get_ad_by_id_raw(id, visitor_username=None):
     """
     Queries the database and returns a matching advertisement. 
-    Same as get_ad_by_id() but returns the data in the SQLite raw format, without any processing applied to it
+    Same as get_ad_by_id() but returns the data in the SQLite raw format, without any processing applied to it.
+    The state of the visits of a user to the house is fetched in the same query, in the 'visit_state' attribute:
+    'accepted' if the user has visited the house, 'pending' if a visit awaits confirmation, 'rejected' if all of them were rejected, 'none' otherwise
 
+    :param visitor_username: the user whose visits are looked up. None for anonymous users, whose state is always 'none'
     :returns: the advertisement or None
     """
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    conn = db.get_db()
     cursor = conn.cursor()
 
+    # The visit state is read from the (ADVERTISEMENT_id, visitor_username, status) index
     sql = """
         SELECT A.id, A.adress, A.title, A.rooms, A.type, A.description, A.rent, A.furniture, A.available,
             P.name as landlord_name, P.username as landlord_username, 
-            GROUP_CONCAT(PI.path) AS images
+            (SELECT GROUP_CONCAT(path) FROM (SELECT PI.path FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id AND PI.ready ORDER BY PI.position)) AS images,
+            (
+                SELECT CASE
+                    WHEN MAX(V.status = 'accepted') THEN 'accepted'
+                    WHEN MAX(V.status = 'pending') THEN 'pending'
+                    WHEN COUNT(*) > 0 THEN 'rejected'
+                    ELSE 'none'
+                END
+                FROM VISIT V
+                WHERE V.ADVERTISEMENT_id = A.id AND V.visitor_username = ?
+            ) AS visit_state
         FROM ADVERTISEMENT A
         INNER JOIN PERSON P ON P.username = A.landlord_username
-        INNER JOIN PICTURES PI ON PI.ADVERTISEMENT_id = A.id
-        WHERE A.id = ?
-        LIMIT 1;
+        WHERE A.id = ?;
     """
-    cursor.execute(sql, (id,))
+    cursor.execute(sql, (visitor_username, id))
     res = cursor.fetchone()
 
     cursor.close()
-    conn.close()
 
-    if res is None or res[0] is None:
+    if res is None:
         return None
 
     advert = dict(res)
-    advert['images'] = advert['images'].split(',')
+    advert['images'] = advert['images'].split(',') if advert['images'] is not None else []     # No pictures while they are being processed
 
     return advert
 
@@ -102,131 +266,143 @@ def get_landlord_ads(username):
 
     :returns: a list of all advertisements on the site
     """ 
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    conn = db.get_db()
     cursor = conn.cursor()
 
     cursor.execute("""
-        SELECT A.id, A.adress, A.title, A.description, A.available,
-            PI.path as image
-        FROM ADVERTISEMENT A
-        INNER JOIN PICTURES PI ON PI.ADVERTISEMENT_id = A.id
-        WHERE A.landlord_username = ?
-        GROUP BY A.id;
+        SELECT ADVERTISEMENT_id AS id, adress, title, description, available, image
+        FROM LISTING_CARD
+        WHERE landlord_username = ? AND has_pictures
+        ORDER BY ADVERTISEMENT_id;
     """, (username,))
-    rows = cursor.fetchall()
+    rows = [dict(row) for row in cursor.fetchall()]
 
     cursor.close()
-    conn.close()
-
-    result = []
-    for row in rows:
-        ad = dict(row)
-        ad['available'] = ad['available'] == True
 
-        result.append(ad)
+    return rows
 
-    return result
+def is_valid_rent(rent):
+    """
+    :param rent: the rent, as a number or as a string from a form
+    :returns: whether the rent is a number between 0 and MAX_RENT
+    """
+    try:
+        return 0 <= float(rent) <= MAX_RENT    # False for NaN too
+    except (TypeError, ValueError):
+        return False
 
 def insert_ad(title, adress, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username):
     """
-    Inserts a new advertisement and its pictures into the database
+    Inserts a new advertisement and its pictures into the database. The pictures are enqueued for processing, they show up once processed
 
+    :param pictures: a list of (filename, upload) tuples, as returned by image_handler.store_upload()
     :returns: True if the insertion was succesful, False in case of errors
     """
     try:
         # Cast non string types
         rooms = int(rooms)
         rent = int(rent)
+        if not is_valid_rent(rent):
+            raise ValueError(f'Rent out of range: {rent}')
         furniture = furniture == 'true'
         available = available == 'true'
 
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("BEGIN TRANSACTION")
-
-        sql = 'INSERT INTO ADVERTISEMENT(adress, title, rooms, type, description, rent, furniture, available, landlord_username) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        pictures = list(dict.fromkeys(pictures))    # The same image uploaded twice is only stored once
 
-        cursor.execute(sql, (adress, title, rooms, ad_type, description, rent, furniture, available, landlord_username))
-        id = cursor.lastrowid   # ID of the inserted advertisement
+        id = writer.execute(_insert_ad, title, adress, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username)
+        listing_index.update(id)
+        page_cache.invalidate()     # The home page shows the advertisements
+        jobs.wake()
 
-        pictures = [(picture_path, id) for picture_path in pictures]    # Map list of paths to list of tuples
-        sql_picture = 'INSERT INTO PICTURES(path, ADVERTISEMENT_id) VALUES(?, ?)'
-        cursor.executemany(sql_picture, pictures)   # This is ran as a signle INSERT statement
-
-        conn.commit()
         return True
     except Exception as e:
         print('ERROR', str(e))
-        conn.rollback()
         
         return False
-    finally:
-        cursor.close()
-        conn.close()
+
+def _insert_ad(conn, title, adress, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username):
+    # Runs in the writer thread, see writer.execute()
+    cursor = conn.cursor()
+
+    sql = 'INSERT INTO ADVERTISEMENT(adress, title, rooms, type, description, rent, furniture, available, landlord_username) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+    cursor.execute(sql, (adress, title, rooms, ad_type, description, rent, furniture, available, landlord_username))
+    id = cursor.lastrowid   # ID of the inserted advertisement
+
+    rows = [(picture_path, id, upload is None, position) for position, (picture_path, upload) in enumerate(pictures)]    # Map list of paths to list of tuples. Already existing images are ready, the first one is the cover
+    sql_picture = 'INSERT INTO PICTURES(path, ADVERTISEMENT_id, ready, position) VALUES(?, ?, ?, ?)'
+    cursor.executemany(sql_picture, rows)   # This is ran as a signle INSERT statement
+
+    jobs.insert_jobs(cursor, pictures)
+
+    return id
 
 def edit_ad(title, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username, advertisement_id):
     """
-    Edits an existing advertisement. If any pictures were provided it deletes the existing ones and replaces them with the new ones
+    Edits an existing advertisement. If any pictures were provided it deletes the existing ones and replaces them with the new ones.
+    The new pictures are enqueued for processing, they show up once processed
 
+    :param pictures: a list of (filename, upload) tuples, as returned by image_handler.store_upload()
     :returns: True if the edit was succesful, False in case of errors
     """
     try:
         # Cast non string types
         rooms = int(rooms)
-        rent = float(rent)
+        rent = round(float(rent), 2)   # Whole cents, the listings format the rent in SQL (see migration 0009)
+        if not is_valid_rent(rent):
+            raise ValueError(f'Rent out of range: {rent}')
         furniture = furniture == 'true'
         available = available == 'true'
 
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("BEGIN TRANSACTION")
+        pictures = list(dict.fromkeys(pictures))    # The same image uploaded twice is only stored once
 
-        sql = """
-            UPDATE ADVERTISEMENT
-            SET title = ?, rooms = ?, type = ?, description = ?, rent = ?, furniture = ?, available = ?
-            WHERE id = ? AND landlord_username = ?
-        """
-
-        cursor.execute(sql, (title, rooms, ad_type, description, rent, furniture, available, advertisement_id, landlord_username))
-
-        # Update pictures
-        if len(pictures) > 0:
-            # Delete previously saved pictures
-            sql_delete = 'DELETE FROM PICTURES WHERE ADVERTISEMENT_id = ?'
-            cursor.execute(sql_delete, (advertisement_id,))
+        writer.execute(_edit_ad, title, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username, advertisement_id)
+        listing_index.update(advertisement_id)
+        page_cache.invalidate()     # The home page shows the advertisements
+        jobs.wake()
 
-            # Insert new pictures
-            pictures = [(picture_path, advertisement_id) for picture_path in pictures]    # Map list of paths to list of tuples
-            sql_insert = 'INSERT INTO PICTURES(path, ADVERTISEMENT_id) VALUES(?, ?)'
-            cursor.executemany(sql_insert, pictures)   # This is ran as a signle INSERT statement
-
-        conn.commit()
         return True
     except Exception as e:
         print('ERROR', str(e))
-        conn.rollback()
         
         return False
-    finally:
-        cursor.close()
-        conn.close()
+
+def _edit_ad(conn, title, description, rooms, rent, ad_type, furniture, available, pictures, landlord_username, advertisement_id):
+    # Runs in the writer thread, see writer.execute()
+    cursor = conn.cursor()
+
+    sql = """
+        UPDATE ADVERTISEMENT
+        SET title = ?, rooms = ?, type = ?, description = ?, rent = ?, furniture = ?, available = ?
+        WHERE id = ? AND landlord_username = ?
+    """
+
+    cursor.execute(sql, (title, rooms, ad_type, description, rent, furniture, available, advertisement_id, landlord_username))
+
+    # Update pictures
+    if len(pictures) > 0:
+        # Delete previously saved pictures
+        sql_delete = 'DELETE FROM PICTURES WHERE ADVERTISEMENT_id = ?'
+        cursor.execute(sql_delete, (advertisement_id,))
+
+        # Insert new pictures
+        rows = [(picture_path, advertisement_id, upload is None, position) for position, (picture_path, upload) in enumerate(pictures)]    # Map list of paths to list of tuples. Already existing images are ready, the first one is the cover
+        sql_insert = 'INSERT INTO PICTURES(path, ADVERTISEMENT_id, ready, position) VALUES(?, ?, ?, ?)'
+        cursor.executemany(sql_insert, rows)   # This is ran as a signle INSERT statement
+
+        jobs.insert_jobs(cursor, pictures)
 
 def get_ad_images(advertisement_id):
     """
     Fetches a list of image paths from the database
     """
     try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
+        conn = db.get_db()
         cursor = conn.cursor()
 
         sql = """
             SELECT GROUP_CONCAT(path) AS images
-            FROM PICTURES
-            WHERE ADVERTISEMENT_id = ?
+            FROM (SELECT path FROM PICTURES WHERE ADVERTISEMENT_id = ? ORDER BY position)
         """
         cursor.execute(sql, (advertisement_id,))
         res = cursor.fetchone()
@@ -241,7 +417,6 @@ def get_ad_images(advertisement_id):
         return []
     finally:
         cursor.close()
-        conn.close()
 
 def get_ad_landlord(advertisement_id):
     """
@@ -250,8 +425,7 @@ def get_ad_landlord(advertisement_id):
     :returns: the landlord's username
     """
     try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
+        conn = db.get_db()
         cursor = conn.cursor()
 
         sql = """
@@ -273,67 +447,33 @@ def get_ad_landlord(advertisement_id):
         return None
     finally:
         cursor.close()
-        conn.close()
 
 # HELPER FUNCTIONS
 
-def get_rooms(num):
+def format_card(ad):
     """
-    Pretty prints the number of rooms in a house. Returns '5+' if the house has more than 5 rooms
-
-    :param num: the number of rooms
-    :returns: a string representation of the number of rooms
-    """ 
+    Replaces the raw DB attributes of an advertisement with their human readable version, the raw rent is kept in 'rent_num'
 
-    if num > 5:
-        return '5+'
-    else:
-        return str(num)
-
-def get_type(house_type):
+    :param ad: the advertisement, as a dict
+    :returns: the same dict
     """
-    Translates the "type" DB row format into plain Italian
+    ad['rooms'] = formatting.get_rooms(ad['rooms'])
+    ad['furniture'] = formatting.get_furniture(ad['furniture'], ad['type'])
+    ad['type'] = formatting.get_type(ad['type'])
+    ad['rent_num'] = ad['rent']
+    ad['rent'] = formatting.get_rent(ad['rent'])
 
-    :param house_type: house type in the DB format
-    :returns: a string representation of the house type
-    """
+    return ad
 
-    match house_type:
-        case 'detached':
-            return 'Casa indipendente'
-        case 'flat':
-            return 'Appartamento'
-        case 'loft':
-            return 'Loft'
-        case 'villa':
-            return 'Villa'
-        case _: # Default case if no other cases are matched, this should never happen
-            return house_type
-
-def get_furniture(furniture, house_type):
+def get_match_query(query):
     """
-    :param furniture: furniture boolean attribute, from the DB
-    :param house_type: the type of house in the DB format
-    :returns: a string representation of the furniture status
-    """
-
-    result = ''
+    Turns the text typed by the user into an FTS5 query. Each word is quoted, so FTS5 operators and special characters are matched literally
 
-    if furniture == False:
-        result = 'non'
-    
-    if house_type == 'detached' or house_type == 'villa':
-        result += ' arredata'
-    else:
-        result += ' arredato'
-
-    return result
-
-def get_rent(num):
-    """
-    :param num: rent attribute, from the DB
-    :returns: a string representation of the rent parameter with the Italian number formatting (point as a thousand separator, comma as a decimal separator)
+    :param query: the search text
+    :returns: the FTS5 query, or None if the text contains no words
     """
-    
-    locale.setlocale(locale.LC_ALL, 'it_IT.UTF-8')
-    return locale.format("%.2f", num, grouping=True)
\ No newline at end of file
+    words = re.findall(r'\w+', query)
+    if len(words) == 0:
+        return None
+
+    return ' '.join(f'"{word}"*' for word in words)
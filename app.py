@@ -1,98 +1,261 @@
-import uuid
+import os
 import re
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, Blueprint, render_template, redirect, url_for, request, flash, session, make_response
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.exceptions import HTTPException, BadRequest, Unauthorized, NotFound, Forbidden, InternalServerError
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from werkzeug.exceptions import HTTPException, BadRequest, Unauthorized, NotFound, Forbidden, Conflict, InternalServerError, RequestEntityTooLarge, ServiceUnavailable
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime
 
+import config
+import db
+import migrations
 import ads
+import formatting
 import visits
 import user_db
+import page_cache
 from models import User
 import image_handler
+import jobs
+import passwords
+import ratelimit
+import writer
+import listing_index
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = uuid.uuid4().hex
-
+bp = Blueprint('main', __name__)
 login_manager = LoginManager()
-login_manager.init_app(app)
+
+def create_app(settings=None):
+    """
+    Creates the Flask app. Used by "flask run" and by the production server (see gunicorn.conf.py)
+
+    :param settings: dict of settings overriding the defaults of config.py
+    :returns: the app
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    if settings is not None:
+        app.config.update(settings)
+
+    if app.config['SECRET_KEY'] is None:
+        app.config['SECRET_KEY'] = config.load_secret_key(os.path.join(app.instance_path, 'secret_key'))
+
+    if app.config['PROXY_COUNT'] > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'], x_proto=app.config['PROXY_COUNT'])
+
+    db.init_app(app)
+    migrations.init_app(app)
+    image_handler.init_app(app)
+    jobs.init_app(app)
+    passwords.init_app(app)
+    ratelimit.init_app(app)
+    migrations.upgrade()    # Bring the database schema up to date on startup, once before forking the workers if PREFORK
+
+    app.register_blueprint(bp)
+    login_manager.init_app(app)
+
+    if not app.config['PREFORK']:
+        init_worker(app)
+
+    return app
+
+def init_worker(app):
+    """
+    Starts what each process serving the app owns: database connections and writer thread, the listing index, the rate limiting store,
+    the password hashing pool and the image job dispatcher. None of them survives a fork, so with PREFORK the server runs this in each worker instead of create_app()
+
+    :param app: the app created by create_app()
+    """
+    db.init_worker()
+    writer.init_worker()
+    listing_index.init_worker()
+    ratelimit.init_worker()
+    passwords.init_worker()
+    jobs.start()    # create_app() has already upgraded the database: the dispatcher reads the job table right away
 
 @login_manager.user_loader
 def login(username):
-    db_user = user_db.get_user(username)
+    profile = user_db.get_profile(username)     # Cached, this runs on every request of a logged in user
 
-    if db_user is not None:
-        user = User(username=db_user['username'], email=db_user['email'], landlord=db_user['landlord'], name=db_user['name'], password=db_user['password'])
+    if profile is not None:
+        user = User(**profile)
     else:
         user = None
 
     return user
 
-@app.errorhandler(Exception)
+@bp.app_errorhandler(Exception)
 def handle_exception(e):
     # HTTP error
     if isinstance(e, HTTPException):
-        return render_template("error.html", code=f'{e.code} - {e.name}', message=e.description)
+        response = make_response(render_template("error.html", code=f'{e.code} - {e.name}', message=e.description), e.code)
+
+        # Keep the headers the error carries, e.g. Retry-After on a 429 or 503
+        for name, value in e.get_headers():
+            if name.lower() != 'content-type':
+                response.headers[name] = value
+
+        return response
 
     # Non HTTP error. To avoid leaking internal data they are masked as 500s and printed to the console
     print(str(e))
-    return render_template("error.html", code='500 - Internal Server Error', message="Errore interno.")
+    return render_template("error.html", code='500 - Internal Server Error', message="Errore interno."), 500
 
-@app.route('/')
+@bp.route('/')
 def get_home():
     try:
-        sort_price_str = request.args.get('sort_price', default='true', type=str)
-        sort_price = sort_price_str.lower() == 'true'
+        # The page is the same for every anonymous visitor, so it is served from the cache. Flashed messages are rendered in the page, skip the cache when there are any
+        if current_user.is_anonymous and '_flashes' not in session:
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            body, etag = page_cache.get_or_render(key, render_home)
 
-        advertisements = ads.get_public_ads(sort_price)
+            response = make_response(body)
+            response.set_etag(etag)
+            response.cache_control.no_cache = True  # Browsers may keep the page, but have to revalidate it with the ETag
+            return response.make_conditional(request)
 
-        return render_template('home.html', advertisements=advertisements, sort_price=sort_price)
+        return render_home()
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_home'))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_home'))
+
+def render_home():
+    """
+    Renders the home page for the current request arguments
+
+    :returns: the page body
+    :raise BadRequest: exception raised when the arguments aren't valid
+    """
+    sort_price_str = request.args.get('sort_price', default='true', type=str)
+    sort_price = sort_price_str.lower() == 'true'
+    page_size = request.args.get('page_size', default=ads.PAGE_SIZE, type=int)
+    page_cursor = request.args.get('cursor', default=None, type=str)
+
+    # Facet filters, as they appear in the URL
+    filter_args = {
+        'type': request.args.get('type', default=None, type=str),
+        'rooms': request.args.get('rooms', default=None, type=str),
+        'furniture': request.args.get('furniture', default=None, type=str),
+        'rent': request.args.get('rent', default=None, type=str),
+    }
+
+    if page_size < 1 or page_size > ads.MAX_PAGE_SIZE:
+        raise BadRequest("Errore di formattazione nel campo 'page_size'")
+    if filter_args['type'] is not None and filter_args['type'] not in ads.FACETS['type']:
+        raise BadRequest("Errore di formattazione nel campo 'type'")
+    if filter_args['rooms'] is not None and not re.match(r'^[123456]$', filter_args['rooms']):
+        raise BadRequest("Errore di formattazione nel campo 'rooms'")
+    if filter_args['furniture'] is not None and filter_args['furniture'] not in ['true', 'false']:
+        raise BadRequest("Errore di formattazione nel campo 'furniture'")
+    if filter_args['rent'] is not None and filter_args['rent'] not in [str(band) for band in ads.FACETS['rent_band']]:
+        raise BadRequest("Errore di formattazione nel campo 'rent'")
+
+    # Selected values by facet, see ads.FACETS
+    selected = {
+        'type': filter_args['type'],
+        'rooms': int(filter_args['rooms']) if filter_args['rooms'] is not None else None,
+        'furniture': filter_args['furniture'] == 'true' if filter_args['furniture'] is not None else None,
+        'rent_band': int(filter_args['rent']) if filter_args['rent'] is not None else None,
+    }
+
+    try:
+        advertisements, next_cursor, prev_cursor = ads.get_public_ads(sort_price, page_size=page_size, page_cursor=page_cursor, filters=ads.get_facet_filters(selected))
+    except ValueError:
+        raise BadRequest("Errore di formattazione nel campo 'cursor'")
+
+    counts, total = ads.get_facet_counts(selected)
+
+    # Only carry the page size in the links if it isn't the default one
+    page_size = page_size if page_size != ads.PAGE_SIZE else None
+
+    # Each value links to the first page with the value selected, or with the facet cleared if already selected
+    facets = []
+    for facet, arg, title, get_label in (
+        ('type', 'type', 'Tipologia', formatting.get_type),
+        ('rooms', 'rooms', 'Locali', formatting.get_rooms),
+        ('furniture', 'furniture', 'Arredamento', lambda furniture: 'Arredato' if furniture else 'Non arredato'),
+        ('rent_band', 'rent', 'Affitto', lambda band: formatting.get_rent_band(*ads.RENT_BANDS[band])),
+    ):
+        options = []
+        for value in ads.FACETS[facet]:
+            url_value = str(value).lower()  # 'true'/'false' for the booleans
+            is_selected = filter_args[arg] == url_value
+            link_args = dict(filter_args, **{arg: None if is_selected else url_value})
+
+            options.append({
+                'label': get_label(value),
+                'count': counts[facet][value],
+                'selected': is_selected,
+                'url': url_for('main.get_home', sort_price='true' if sort_price else 'false', page_size=page_size, **link_args),
+            })
+
+        facets.append({'title': title, 'options': options})
+
+    return render_template('home.html', advertisements=advertisements, sort_price=sort_price, page_size=page_size, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                           filter_args=filter_args, facets=facets, total=total)
+
+@bp.route('/search')
+def get_search():
+    try:
+        query = request.args.get('q', default='', type=str)
+        page = request.args.get('page', default=1, type=int)
+
+        if not re.match(r'.+', query):
+            raise BadRequest("Errore di formattazione nel campo 'q'")
+        if page < 1:
+            raise BadRequest("Errore di formattazione nel campo 'page'")
+
+        advertisements, has_next = ads.search_ads(query, page=page)
+
+        return render_template('search.html', advertisements=advertisements, query=query, page=page, has_next=has_next)
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_home'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
 
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
 
-@app.route('/advertisement/<int:id>')
+@bp.route('/advertisement/<int:id>')
 def get_advertisement(id):
     try:
-        advertisement = ads.get_ad_by_id(id=id)
+        username = current_user.username if current_user.is_authenticated else None
+
+        advertisement = ads.get_ad_by_id(id=id, visitor_username=username)
         if advertisement is None:
             raise NotFound('Nessun annuncio corrispondente trovato')
 
-        if not advertisement['available'] and (not current_user.is_authenticated or advertisement['landlord_username'] != current_user.username):
+        if not advertisement['available'] and advertisement['landlord_username'] != username:
             raise NotFound('Nessun annuncio corrispondente trovato')    # Using 404 rather than 401 for security reasons: avoid leaking info on hidden houses
 
-        already_seen = False
-        pending_visit = False
-
-        if current_user.is_authenticated:
-            already_seen = visits.has_user_visited(username=current_user.username, advertisement_id=id)
-            pending_visit = visits.is_user_waiting_visit(username=current_user.username, advertisement_id=id)
-
-        return render_template('advertisement.html', ad=advertisement, seen=already_seen, pending=pending_visit)
+        return render_template('advertisement.html', ad=advertisement)
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
 
-@app.route('/advertisement/<int:id>/visit')
+@bp.route('/advertisement/<int:id>/visit')
 @login_required 
 def get_visit(id):
     try:
-        advertisement = ads.get_ad_by_id(id=id)
+        advertisement = ads.get_ad_by_id(id=id, visitor_username=current_user.username)
         if advertisement is None:
             raise NotFound('Nessun annuncio corrispondente trovato')
 
-        if visits.has_user_visited(username=current_user.username, advertisement_id=id):
+        if advertisement['visit_state'] == 'accepted':
             raise Forbidden('Non è possibile visitare più volte la stessa casa')
         
-        if visits.is_user_waiting_visit(username=current_user.username, advertisement_id=id):
+        if advertisement['visit_state'] == 'pending':
             raise Forbidden('Hai già prenotato una visita a questa casa. Attendi la conferma')
 
         if current_user.username == advertisement['landlord_username']:
@@ -103,26 +266,27 @@ def get_visit(id):
         return render_template('visit.html', ad=advertisement, visit=visit_list)
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
 
-@app.route('/advertisement/<int:id>/visit', methods=['POST'])
+@bp.route('/advertisement/<int:id>/visit', methods=['POST'])
 @login_required 
+@ratelimit.limit('visit', per_ip=(30, 3600), per_user=(10, 3600))
 def post_visit(id):
     try:
         # Check if url is correct and user permissions
-        advertisement = ads.get_ad_by_id(id=id)
+        advertisement = ads.get_ad_by_id(id=id, visitor_username=current_user.username)
         if advertisement is None:
             raise NotFound('Nessun annuncio corrispondente trovato')
 
-        if visits.has_user_visited(username=current_user.username, advertisement_id=id):
+        if advertisement['visit_state'] == 'accepted':
             raise Forbidden('Non è possibile visitare più volte la stessa casa')
         
-        if visits.is_user_waiting_visit(username=current_user.username, advertisement_id=id):
+        if advertisement['visit_state'] == 'pending':
             raise Forbidden('Hai già prenotato una visita a questa casa. Attendi la conferma')
 
         if current_user.username == advertisement['landlord_username']:
@@ -141,25 +305,152 @@ def post_visit(id):
         visit_date = datetime.strptime(visit_date_time[0], '%d/%m/%Y')
         visit_time = int(visit_date_time[1])
 
+        # Reject slots the landlord doesn't offer or already taken, before they reach the landlord as requests
+        if not visits.is_slot_free(advertisement_id=id, day=visit_date.date(), time=visit_time):
+            raise BadRequest('La fascia oraria scelta non è disponibile')
+
         visit_virtual = False
         if req['type'] == 'virtual':
             visit_virtual = True
 
-        # Insert the visit in the database
-        if not visits.insert_visit(username=current_user.username, advertisement_id=id, date=visit_date, time=visit_time, virtual=visit_virtual):
+        # Insert the visit in the database. The checks above may be outdated by concurrent requests, the insert repeats them atomically
+        result = visits.insert_visit(username=current_user.username, advertisement_id=id, date=visit_date, time=visit_time, virtual=visit_virtual)
+        if result is None:
             raise InternalServerError('Errore durante l\'aggiunta della visita. Riprova più tardi')
+        elif result == 'taken':
+            raise Conflict('La fascia oraria scelta non è più disponibile')
+        elif result == 'duplicate':
+            raise Conflict('Hai già prenotato una visita a questa casa. Attendi la conferma')
 
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
+
+@bp.route('/advertisement/<int:id>/availability')
+@login_required
+def get_availability(id):
+    try:
+        advertisement = ads.get_ad_by_id(id=id)
+        if advertisement is None:
+            raise NotFound('Nessun annuncio corrispondente trovato')
+        elif current_user.username != advertisement['landlord_username']:
+            raise Forbidden("Non puoi modificare l'annuncio di un altro locatore")
+
+        weekly, exceptions = visits.get_availability(advertisement_id=id)
+
+        return render_template('availability.html', ad=advertisement, weekly=weekly, exceptions=exceptions, weekdays=visits.WEEKDAYS, slots=visits.SLOT_NAMES)
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_personal'))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_personal'))
+
+@bp.route('/advertisement/<int:id>/availability', methods=['POST'])
+@login_required
+def post_availability(id):
+    try:
+        landlord_db = ads.get_ad_landlord(advertisement_id=id)
+        if landlord_db is None:
+            raise NotFound('Nessun annuncio corrispondente trovato')
+        elif current_user.username != landlord_db:
+            raise Forbidden("Non puoi modificare l'annuncio di un altro locatore")
+
+        # Each weekday is a group of checkboxes, one per offered slot
+        try:
+            weekly = [visits.parse_slots(request.form.getlist(f'day{weekday}')) for weekday in range(7)]
+        except ValueError:
+            raise BadRequest("Errore di formattazione nel campo 'day'")
+
+        if not visits.set_availability(landlord_username=current_user.username, advertisement_id=id, weekly=weekly):
+            raise InternalServerError('Errore durante il salvataggio della disponibilità')
+
+        flash('Disponibilità aggiornata con successo', 'success')
+        return redirect(url_for('main.get_availability', id=id))
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_availability', id=id))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_availability', id=id))
+
+@bp.route('/advertisement/<int:id>/availability/exception', methods=['POST'])
+@login_required
+def post_availability_exception(id):
+    try:
+        landlord_db = ads.get_ad_landlord(advertisement_id=id)
+        if landlord_db is None:
+            raise NotFound('Nessun annuncio corrispondente trovato')
+        elif current_user.username != landlord_db:
+            raise Forbidden("Non puoi modificare l'annuncio di un altro locatore")
+
+        req = request.form.to_dict()
+
+        # Check if form is valid
+        if not re.match(r'^\d{4}-\d{2}-\d{2}$', req.get('date', '')):
+            raise BadRequest("Errore di formattazione nel campo 'date'")
+        try:
+            exception_date = date.fromisoformat(req['date'])
+            slots = visits.parse_slots(request.form.getlist('slots'))
+        except ValueError:
+            raise BadRequest("Errore di formattazione nel campo 'slots'")
+        if exception_date <= date.today():
+            raise BadRequest('Puoi modificare la disponibilità solo per i giorni futuri')
+
+        if not visits.set_availability_exception(landlord_username=current_user.username, advertisement_id=id, day=exception_date.isoformat(), slots=slots):
+            raise InternalServerError('Errore durante il salvataggio della disponibilità')
+
+        flash('Disponibilità aggiornata con successo', 'success')
+        return redirect(url_for('main.get_availability', id=id))
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_availability', id=id))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_availability', id=id))
+
+@bp.route('/advertisement/<int:id>/availability/exception/delete', methods=['POST'])
+@login_required
+def post_delete_availability_exception(id):
+    try:
+        landlord_db = ads.get_ad_landlord(advertisement_id=id)
+        if landlord_db is None:
+            raise NotFound('Nessun annuncio corrispondente trovato')
+        elif current_user.username != landlord_db:
+            raise Forbidden("Non puoi modificare l'annuncio di un altro locatore")
+
+        req = request.form.to_dict()
+
+        if not re.match(r'^\d{4}-\d{2}-\d{2}$', req.get('date', '')):
+            raise BadRequest("Errore di formattazione nel campo 'date'")
 
-@app.route('/advertisement/<int:id>/edit')
+        if not visits.delete_availability_exception(landlord_username=current_user.username, advertisement_id=id, day=req['date']):
+            raise InternalServerError('Errore durante il salvataggio della disponibilità')
+
+        flash('Disponibilità aggiornata con successo', 'success')
+        return redirect(url_for('main.get_availability', id=id))
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_availability', id=id))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_availability', id=id))
+
+@bp.route('/advertisement/<int:id>/edit')
 @login_required 
 def get_edit_advertisement(id):
     try:
@@ -177,14 +468,14 @@ def get_edit_advertisement(id):
         return render_template('edit_ad.html', ad=advertisement)
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
 
-@app.route('/advertisement/<int:id>/edit', methods=['post'])
+@bp.route('/advertisement/<int:id>/edit', methods=['post'])
 @login_required 
 def post_edit_advertisement(id):
     try:
@@ -200,6 +491,8 @@ def post_edit_advertisement(id):
             raise BadRequest("Errore di formattazione nel campo 'rooms'")
         if not re.match(r'\d+', req['rent']):
             raise BadRequest("Errore di formattazione nel campo 'rent'")
+        if not ads.is_valid_rent(req['rent']):
+            raise BadRequest(f"L'affitto deve essere un numero compreso tra 0 e {formatting.get_rent(ads.MAX_RENT)} €")
         if req['type'] not in ['detached', 'flat', 'loft', 'villa']:
             raise BadRequest("Errore di formattazione nel campo 'type'")
         if req['furniture'] not in ['true', 'false']:
@@ -214,35 +507,38 @@ def post_edit_advertisement(id):
         elif current_user.username != landlord_db:
             raise Forbidden("Non puoi modificare l'annuncio di un altro locatore")
 
-        paths = []  # If no images were uploaded this remains empty. If it is empty, the images in the DB aren't udpated
+        uploads = []    # If no images were uploaded this remains empty. If it is empty, the images in the DB aren't udpated
 
         # Check if any images were uploaded
         if not any(file.filename == '' for file in files):
-            # Delete the existing images
-            images = ads.get_ad_images(advertisement_id=id)
-            if len(images) == 0:
+            # The existing images are replaced. Their files are left to the background sweeper (see jobs.sweep()), which deletes them
+            # once no advertisement uses them and they haven't been touched for a while: deleting them here could race with another
+            # advertisement uploading the same image, whose reference isn't committed yet
+            old_images = ads.get_ad_images(advertisement_id=id)
+            if len(old_images) == 0:
                 raise InternalServerError("Erorre durante la modifica delle immagini")
 
-            image_handler.delete_images(path_list=images)
-
-            # Save the new images. Only parse the first 5 images (imposing upload cap, can't do it on client)
-            for file in files[:5]:
-                paths.append(image_handler.save_image(image_form=file))
+            # Store the new images, they are processed in background. Only parse the first MAX_IMAGES images (imposing upload cap, can't do it on client)
+            uploads = image_handler.store_uploads(files[:image_handler.MAX_IMAGES])
 
         # Update the advertisement in the database
-        if not ads.edit_ad(title=req['title'], available=req['available'], description=req['description'], furniture=req['furniture'], rent=req['rent'], rooms=req['rooms'], ad_type=req['type'], pictures=paths, landlord_username=current_user.username, advertisement_id=id):
+        if not ads.edit_ad(title=req['title'], available=req['available'], description=req['description'], furniture=req['furniture'], rent=req['rent'], rooms=req['rooms'], ad_type=req['type'], pictures=uploads, landlord_username=current_user.username, advertisement_id=id):
+            image_handler.delete_uploads(uploads)
             raise InternalServerError('Errore durante la modifica dell\'inserzione')
 
         flash('Inserzione modificata con successo', 'success')
-        return redirect(url_for('get_advertisement', id=id))
+        return redirect(url_for('main.get_advertisement', id=id))
     except image_handler.ImageException as e:
         flash("Errore durante il salvataggio dell'immagine: "+e.file, 'warning')
-        return redirect(url_for('get_new_advertisement'))
+        return redirect(url_for('main.get_new_advertisement'))
+    except RequestEntityTooLarge:
+        flash(f"Le immagini caricate superano la dimensione massima consentita ({image_handler.MAX_IMAGE_BYTES // 1024**2} MB per immagine)", 'warning')
+        return redirect(url_for('main.get_edit_advertisement', id=id))
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
 
-@app.route('/advertisement/new')
+@bp.route('/advertisement/new')
 @login_required
 def get_new_advertisement():
     try:
@@ -252,9 +548,9 @@ def get_new_advertisement():
         return render_template('new_ad.html')
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
 
-@app.route('/advertisement/new', methods=['post'])
+@bp.route('/advertisement/new', methods=['post'])
 @login_required 
 def post_new_advertisement():
     try:
@@ -272,6 +568,8 @@ def post_new_advertisement():
             raise BadRequest("Errore di formattazione nel campo 'rooms'")
         if not re.match(r'\d+', req['rent']):
             raise BadRequest("Errore di formattazione nel campo 'rent'")
+        if not ads.is_valid_rent(req['rent']):
+            raise BadRequest(f"L'affitto deve essere un numero compreso tra 0 e {formatting.get_rent(ads.MAX_RENT)} €")
         if req['type'] not in ['detached', 'flat', 'loft', 'villa']:
             raise BadRequest("Errore di formattazione nel campo 'type'")
         if req['furniture'] not in ['true', 'false']:
@@ -279,32 +577,35 @@ def post_new_advertisement():
         if req['available'] not in ['true', 'false']:
             raise BadRequest("Errore di formattazione nel campo 'available'")
 
-        # Only parse the first 5 images (imposing upload cap, can't do it on client)
-        paths = []
-        for file in files[:5]:
-            paths.append(image_handler.save_image(image_form=file))
+        # Store the images, they are processed in background. Only parse the first MAX_IMAGES images (imposing upload cap, can't do it on client)
+        uploads = image_handler.store_uploads(files[:image_handler.MAX_IMAGES])
 
-        if not ads.insert_ad(title=req['title'], adress=req['adress'], available=req['available'], description=req['description'], furniture=req['furniture'], rent=req['rent'], rooms=req['rooms'], ad_type=req['type'], pictures=paths, landlord_username=current_user.username):
+        if not ads.insert_ad(title=req['title'], adress=req['adress'], available=req['available'], description=req['description'], furniture=req['furniture'], rent=req['rent'], rooms=req['rooms'], ad_type=req['type'], pictures=uploads, landlord_username=current_user.username):
+            image_handler.delete_uploads(uploads)
             raise InternalServerError('Errore durante il salvataggio dell\'inserzione')
 
         flash('Inserzione creata con successo', 'success')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except image_handler.ImageException as e:
         flash("Errore durante il salvataggio dell'immagine: "+e.file, 'warning')
-        return redirect(url_for('get_new_advertisement'))
+        return redirect(url_for('main.get_new_advertisement'))
+    except RequestEntityTooLarge:
+        flash(f"Le immagini caricate superano la dimensione massima consentita ({image_handler.MAX_IMAGE_BYTES // 1024**2} MB per immagine)", 'warning')
+        return redirect(url_for('main.get_new_advertisement'))
     except HTTPException as e:
         flash(str(e), 'warning')
-        return redirect(url_for('get_new_advertisement'))
+        return redirect(url_for('main.get_new_advertisement'))
 
-@app.route('/about')
+@bp.route('/about')
 def get_about():
     return render_template('about.html')
 
-@app.route('/signup')
+@bp.route('/signup')
 def get_signup():
     return render_template('signup.html')
 
-@app.route('/signup', methods=['POST'])
+@bp.route('/signup', methods=['POST'])
+@ratelimit.limit('signup', per_ip=(5, 3600))
 def post_signup():
     try:
         user = request.form.to_dict()
@@ -313,62 +614,97 @@ def post_signup():
         if user_db.user_exists(user['username']):
             raise BadRequest("Username già esistente. Scegliere un altro nome utente.")
 
-        user['password'] = generate_password_hash(user['password'])
+        user['password'] = passwords.hash_password(user['password'])     # Raises ServiceUnavailable when too many hashes are pending
         
         if not user_db.add_user(user):  # Returns False if an error occurred
             raise BadRequest("Errore durante la creazione dell'account.")
 
         flash('Account creato con successo. Puoi procedere al login.', 'success')
-        return redirect(url_for('get_login'))
+        return redirect(url_for('main.get_login'))
 
+    except ServiceUnavailable:
+        raise   # Shed load with a real 503, see passwords.py
     except HTTPException as e:
         flash(str(e), 'danger')
-        return redirect(url_for('get_signup'))
+        return redirect(url_for('main.get_signup'))
 
-@app.route('/login')
+@bp.route('/login')
 def get_login():
     return render_template('login.html')
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
+@ratelimit.limit('login', per_ip=(20, 300), per_user=(5, 300), user_field='username')
 def post_login():
     try:
         form_user = request.form.to_dict()
         validate_login(user = form_user)   # Raises an exception if the form is invalid
         
         db_user = user_db.get_user(username = form_user['username'])
+        if not db_user:
+            raise Unauthorized("Username o password non corretti")
 
-        if not db_user or not check_password_hash(db_user['password'], form_user['password']):
+        valid, new_hash = passwords.check_password(db_user['password'], form_user['password'])     # Raises ServiceUnavailable when too many hashes are pending
+        if not valid:
             raise Unauthorized("Username o password non corretti")
 
-        user = User(username=db_user['username'], email=db_user['email'], landlord=db_user['landlord'], name=db_user['name'], password=db_user['password'])
+        # The stored hash was made with older parameters: replace it now that the password is known
+        if new_hash is not None:
+            user_db.update_password(username=db_user['username'], password=new_hash)
+
+        user = User(username=db_user['username'], email=db_user['email'], landlord=db_user['landlord'], name=db_user['name'])
         login_user(user, True)
 
         flash('Login completato con successo', 'success')
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
 
+    except ServiceUnavailable:
+        raise   # Shed load with a real 503, see passwords.py
     except HTTPException as e:
         flash(str(e), 'danger')
-        return redirect(url_for('get_login'))
+        return redirect(url_for('main.get_login'))
 
-@app.route('/personal')
+@bp.route('/personal')
 @login_required
 def get_personal():
     try:
-        user_visits = visits.get_user_visits(username=current_user.username)
+        # The two lists of visits are filtered and paged independently: the landlord requests with the 'requests_' arguments, the user visits with the 'visits_' ones.
+        # Landlords see the requests still waiting for an answer first
+        visits_status = request.args.get('visits_status', 'all')
+        requests_status = request.args.get('requests_status', 'pending')
+
+        if visits_status not in ('all', *visits.STATUSES):
+            raise BadRequest("Errore di formattazione nel campo 'visits_status'")
+        if requests_status not in ('all', *visits.STATUSES):
+            raise BadRequest("Errore di formattazione nel campo 'requests_status'")
+
+        try:
+            user_visits = visits.get_user_visits(username=current_user.username, status=visits_status, page_cursor=request.args.get('visits_cursor'))
+        except ValueError:
+            raise BadRequest("Errore di formattazione nel campo 'visits_cursor'")
+        user_counts = visits.get_user_visit_counts(username=current_user.username)
 
         landlord_ads = []
-        landlord_visits = []
+        landlord_visits = ([], None, None)
+        landlord_counts = None
         if current_user.landlord:
             landlord_ads = ads.get_landlord_ads(username=current_user.username)
-            landlord_visits = visits.get_landlord_visits(username=current_user.username)
-
-        return render_template('personal.html', user_visits=user_visits, landlord_ads=landlord_ads, landlord_visits=landlord_visits)
+            try:
+                landlord_visits = visits.get_landlord_visits(username=current_user.username, status=requests_status, page_cursor=request.args.get('requests_cursor'))
+            except ValueError:
+                raise BadRequest("Errore di formattazione nel campo 'requests_cursor'")
+            landlord_counts = visits.get_landlord_visit_counts(username=current_user.username)
+
+        return render_template('personal.html', user_visits=user_visits, user_counts=user_counts, visits_status=visits_status,
+                               landlord_ads=landlord_ads, landlord_visits=landlord_visits, landlord_counts=landlord_counts, requests_status=requests_status)
+    except HTTPException as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('main.get_personal'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina personale, riprova più tardi', 'danger')
-        return redirect(url_for('get_home'))
+        return redirect(url_for('main.get_home'))
 
-@app.route('/acceptVisit', methods=['POST'])
+@bp.route('/acceptVisit', methods=['POST'])
 @login_required
 def post_accept_visit():
     try:
@@ -385,21 +721,31 @@ def post_accept_visit():
             raise BadRequest("Errore di formattazione nel campo 'visitor'")
 
         # Run query, raise on errors
-        if not visits.accept_visit(landlord_username=current_user.username, advertisement_id=req['advertisement'], date=req['date'], time=req['time'], visitor_username=req['visitor']):
+        decision = {'visitor_username': req['visitor'], 'advertisement_id': req['advertisement'], 'date': req['date'], 'time': req['time'], 'decision': 'accept'}
+        outcome = visits.apply_visit_decisions(landlord_username=current_user.username, decisions=[decision])
+        if outcome is None:
             raise InternalServerError("Errore durante l'accettazione della visita")
 
-        flash('Visita accettata con successo', 'success')
-        return redirect(url_for('get_personal'))
+        results, auto_rejected = outcome
+        if results[0] != 'accepted':
+            raise BadRequest(VISIT_DECISION_ERRORS[results[0]])
+
+        message = 'Visita accettata con successo'
+        if auto_rejected > 0:
+            message += f'. Le altre richieste per la stessa fascia oraria ({auto_rejected}) sono state rifiutate'
+
+        flash(message, 'success')
+        return redirect(url_for('main.get_personal'))
     except HTTPException as e:
         flash(str(e), 'danger')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_personal'))    
+        return redirect(url_for('main.get_personal'))    
 
-@app.route('/rejectVisit', methods=['POST'])
+@bp.route('/rejectVisit', methods=['POST'])
 @login_required
 def post_reject_visit():
     try:
@@ -418,25 +764,93 @@ def post_reject_visit():
             raise BadRequest("Errore di formattazione nel campo 'reason'")
 
         # Run query, raise on errors
-        if not visits.reject_visit(landlord_username=current_user.username, advertisement_id=req['advertisement'], date=req['date'], reject_reason=req['reason'], time=req['time'], visitor_username=req['visitor']):
+        decision = {'visitor_username': req['visitor'], 'advertisement_id': req['advertisement'], 'date': req['date'], 'time': req['time'], 'decision': 'reject', 'reason': req['reason']}
+        outcome = visits.apply_visit_decisions(landlord_username=current_user.username, decisions=[decision])
+        if outcome is None:
             raise InternalServerError("Errore durante il rifiuto della visita")
 
+        results, _ = outcome
+        if results[0] != 'rejected':
+            raise BadRequest(VISIT_DECISION_ERRORS[results[0]])
+
         flash('Visita rifiutata con successo', 'success')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except HTTPException as e:
         flash(str(e), 'danger')
-        return redirect(url_for('get_personal'))
+        return redirect(url_for('main.get_personal'))
     except Exception as e:
         print('ERROR', str(e))
         flash('Errore interno durante il caricamento della pagina', 'danger')
         
-        return redirect(url_for('get_personal'))        
+        return redirect(url_for('main.get_personal'))        
+
+@bp.route('/visitDecisions', methods=['POST'])
+@login_required
+def post_visit_decisions():
+    try:
+        req = request.form.to_dict()
+        selected = request.form.getlist('visit')    # One value per selected request: advertisement|visitor|date|time
+
+        # Check if form is valid
+        if req.get('decision') not in ['accept', 'reject']:
+            raise BadRequest("Errore di formattazione nel campo 'decision'")
+        if len(selected) == 0:
+            raise BadRequest('Seleziona almeno una richiesta di visita')
+        if len(selected) > visits.MAX_DECISIONS:
+            raise BadRequest(f'Puoi gestire al massimo {visits.MAX_DECISIONS} richieste alla volta')
+        if req['decision'] == 'reject' and not re.match(r'.+', req.get('reason', '')):
+            raise BadRequest('Motiva il rifiuto delle visite')
+
+        decisions = []
+        for value in selected:
+            match = re.match(r'^(\d+)\|(\w{1,30})\|(\d{2}\/\d{2}\/\d{4})\|(\d{1,2}-\d{2})$', value)
+            if not match:
+                raise BadRequest("Errore di formattazione nel campo 'visit'")
+
+            advertisement_id, visitor, visit_date, visit_time = match.groups()
+            decisions.append({'visitor_username': visitor, 'advertisement_id': advertisement_id, 'date': visit_date, 'time': visit_time, 'decision': req['decision'], 'reason': req.get('reason')})
+
+        # Run query, raise on errors
+        outcome = visits.apply_visit_decisions(landlord_username=current_user.username, decisions=decisions)
+        if outcome is None:
+            raise InternalServerError('Errore durante la gestione delle visite')
+
+        results, auto_rejected = outcome
+
+        applied = results.count('accepted') + results.count('rejected')
+        if applied > 0:
+            message = f"Visite accettate: {results.count('accepted')}, rifiutate: {results.count('rejected')}"
+            if auto_rejected > 0:
+                message += f'. Le altre richieste per le fasce orarie accettate ({auto_rejected}) sono state rifiutate'
+            flash(message, 'success')
+
+        for result, error in VISIT_DECISION_ERRORS.items():
+            if result in results:
+                flash(f'{error} ({results.count(result)})', 'warning')
+
+        return redirect(url_for('main.get_personal'))
+    except HTTPException as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.get_personal'))
+    except Exception as e:
+        print('ERROR', str(e))
+        flash('Errore interno durante il caricamento della pagina', 'danger')
+
+        return redirect(url_for('main.get_personal'))
 
-@app.route('/logout', methods=['POST'])
+@bp.route('/logout', methods=['POST'])
 @login_required
 def post_logout():
     logout_user()
-    return redirect(url_for('get_home'))
+    return redirect(url_for('main.get_home'))
+
+# Messages for the outcomes of visits.apply_visit_decisions() that leave the visit untouched
+VISIT_DECISION_ERRORS = {
+    'invalid': 'Richiesta di visita non valida',
+    'forbidden': "Non puoi gestire le visite all'annuncio di un altro locatore",
+    'not_pending': 'La richiesta di visita non è più in attesa',
+    'conflict': 'La fascia oraria è già stata assegnata a un altro visitatore',
+}
 
 # VALIDATION FUNCTIONS
 
@@ -0,0 +1,51 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# Shared by the scripts in this directory: they run against a temporary copy of database/database.db, never the real one.
+# Run them from anywhere, e.g. python bench/booking_race.py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)      # The app resolves its directories (images, uploads) relative to the working directory
+
+def copy_database():
+    """
+    Copies the database of the repository to a temporary directory, with SQLite's backup API so that a WAL is copied too
+
+    :returns: the path of the copy
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix='renTO-bench-'), 'database.db')
+
+    source = sqlite3.connect(os.path.join(ROOT, 'database', 'database.db'))
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    return path
+
+def remove_database(path):
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+def create_app(path, **settings):
+    """
+    Creates the app on a database copy, with the migrations applied. Only the connections and the writer thread are started:
+    the image jobs and their sweeper stay off, they would work on the images of the repository
+
+    :param path: path of the database, as returned by copy_database()
+    :param settings: settings overriding the defaults of config.py
+    :returns: the app
+    """
+    import app
+    import db
+    import writer
+
+    flask_app = app.create_app({'DATABASE': path, 'SECRET_KEY': 'bench', 'RATELIMIT_ENABLED': False, 'PREFORK': True, **settings})
+    db.init_worker()
+    writer.init_worker()
+
+    return flask_app
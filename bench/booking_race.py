@@ -0,0 +1,144 @@
+import argparse
+import collections
+import multiprocessing
+import threading
+from datetime import date, datetime, timedelta
+
+import _setup
+
+# Concurrency check of the visit booking rules (migration 0008): many threads, in several processes each with its own writer,
+# hammer the same slot at the same moment. Exits with an error if any rule is broken:
+# 1. the same visitor books one slot from every thread: exactly one 'booked', the rest 'duplicate'
+# 2. many visitors request the slot, then the landlord accepts all of them at once: exactly one 'accepted'
+# 3. everyone books the accepted slot again: all 'taken'
+# After each round the partial unique indexes must hold: one accepted visit per slot, one active visit per visitor and house
+
+ADVERTISEMENT = 1
+LANDLORD = 'mario'      # Owner of ADVERTISEMENT in the sample database
+
+def hammer(path, process, threads, round, barrier, results):
+    app = _setup.create_app(path)
+
+    import visits
+
+    day = datetime.combine(date.today() + timedelta(days=3), datetime.min.time())
+    counts = collections.Counter()
+    lock = threading.Lock()
+    local_barrier = threading.Barrier(threads)
+
+    def book(i):
+        visitor = 'race0' if round == 'same_visitor' else f'race{process}_{i}'
+
+        with app.app_context():
+            local_barrier.wait()
+            if i == 0:
+                barrier.wait()      # Every process starts at the same moment
+            local_barrier.wait()
+
+            if round == 'accept':
+                decision = {'visitor_username': visitor, 'advertisement_id': ADVERTISEMENT, 'date': day.strftime('%d/%m/%Y'), 'time': '12-14', 'decision': 'accept'}
+                outcome = visits.apply_visit_decisions(LANDLORD, [decision])
+                result = outcome[0][0] if outcome is not None else None
+            else:
+                result = visits.insert_visit(visitor, ADVERTISEMENT, day, 1, False)
+
+        with lock:
+            counts[result] += 1
+
+    workers = [threading.Thread(target=book, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    results.put(dict(counts))
+
+def run_round(path, processes, threads, round):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+
+    children = [context.Process(target=hammer, args=(path, process, threads, round, barrier, results)) for process in range(processes)]
+    for child in children:
+        child.start()
+
+    total = collections.Counter()
+    for _ in children:
+        total.update(results.get())
+    for child in children:
+        child.join()
+
+    return dict(total)
+
+def check_indexes(conn):
+    """
+    :returns: the number of rows breaking the booking rules, which must be 0
+    """
+    accepted = conn.execute("""
+        SELECT COUNT(*) FROM (SELECT 1 FROM VISIT WHERE status = 'accepted' GROUP BY ADVERTISEMENT_id, date, time HAVING COUNT(*) > 1)
+    """).fetchone()[0]
+    active = conn.execute("""
+        SELECT COUNT(*) FROM (SELECT 1 FROM VISIT WHERE status IN ('pending', 'accepted') GROUP BY ADVERTISEMENT_id, visitor_username HAVING COUNT(*) > 1)
+    """).fetchone()[0]
+    indexes = {row[1] for row in conn.execute('PRAGMA index_list(VISIT)')}
+
+    assert {'VISIT_slot_accepted', 'VISIT_visitor_active'} <= indexes, 'partial unique indexes missing'
+    return accepted + active
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency check of the visit booking rules")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=10, help='threads per process')
+    args = parser.parse_args()
+
+    import sqlite3
+
+    path = _setup.copy_database()
+    _setup.create_app(path)     # Applies the migrations once, before the processes start
+
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO PERSON VALUES ('race0', 'race0@example.com', 'x', 'Race', FALSE)")
+        conn.executemany("INSERT INTO PERSON VALUES (?, ?, 'x', 'Race', FALSE)", [
+            (f'race{process}_{i}', f'race{process}_{i}@example.com') for process in range(args.processes) for i in range(args.threads)
+        ])
+        conn.commit()
+
+        total = args.processes * args.threads
+        failures = []
+
+        def expect(round, results, expected):
+            print(f'{round:<14} {results}')
+            if results != expected:
+                failures.append(f'{round}: expected {expected}, got {results}')
+
+            broken = check_indexes(conn)
+            if broken:
+                failures.append(f'{round}: {broken} groups of visits break the partial unique indexes')
+
+        # The visitor of round 1 already holds the slot, the others can still request it
+        expect('same_visitor', run_round(path, args.processes, args.threads, 'same_visitor'), {'booked': 1, 'duplicate': total - 1})
+        expect('requests', run_round(path, args.processes, args.threads, 'requests'), {'booked': total})
+
+        results = run_round(path, args.processes, args.threads, 'accept')
+        print(f'{"accept":<14} {results}')
+        if results.get('accepted') != 1 or results.get('accepted', 0) + results.get('not_pending', 0) + results.get('conflict', 0) != total:
+            failures.append(f'accept: expected exactly 1 accepted, got {results}')
+        if check_indexes(conn):
+            failures.append('accept: the partial unique indexes are broken')
+
+        # Visitors whose request was rejected by the acceptance can try again, but the slot is gone
+        expect('after_accept', run_round(path, args.processes, args.threads, 'requests'), {'taken': total})
+
+        print(conn.execute('SELECT status, COUNT(*) FROM VISIT WHERE visitor_username LIKE ? GROUP BY status', ('race%',)).fetchall())
+        conn.close()
+    finally:
+        _setup.remove_database(path)
+
+    if failures:
+        raise SystemExit('FAILED\n' + '\n'.join(failures))
+
+    print('OK')
+
+if __name__ == '__main__':
+    main()
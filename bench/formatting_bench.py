@@ -0,0 +1,103 @@
+import argparse
+import locale
+import random
+import timeit
+
+import _setup
+
+import formatting
+
+# Per-row cost of the listing formatters (formatting.py) against the helpers they replaced, which set the it_IT locale on every call.
+# Hosts without the it_IT locale run the old helpers with the first locale available among FALLBACK_LOCALES: the timing
+# is comparable, but the old output then uses other separators and isn't compared
+
+FALLBACK_LOCALES = ('it_IT.UTF-8', 'it_IT.utf8', 'C.UTF-8', 'en_US.UTF-8', '')
+
+# The old helpers, as they were in ads.py. get_rent() used locale.format(), removed in Python 3.12: format_string() gives the same output
+_locale = 'it_IT.UTF-8'
+
+def old_get_rooms(num):
+    if num > 5:
+        return '5+'
+    else:
+        return str(num)
+
+def old_get_type(house_type):
+    match house_type:
+        case 'detached':
+            return 'Casa indipendente'
+        case 'flat':
+            return 'Appartamento'
+        case 'loft':
+            return 'Loft'
+        case 'villa':
+            return 'Villa'
+        case _:
+            return house_type
+
+def old_get_furniture(furniture, house_type):
+    result = ''
+
+    if furniture == False:
+        result = 'non'
+
+    if house_type == 'detached' or house_type == 'villa':
+        result += ' arredata'
+    else:
+        result += ' arredato'
+
+    return result
+
+def old_get_rent(num):
+    locale.setlocale(locale.LC_ALL, _locale)
+    return locale.format_string('%.2f', num, grouping=True)
+
+def pick_locale():
+    global _locale
+
+    for name in FALLBACK_LOCALES:
+        try:
+            locale.setlocale(locale.LC_ALL, name)
+        except locale.Error:
+            continue
+
+        _locale = name
+        return name
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-row cost of the listing formatters')
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    rows = [(random.randint(1, 6), random.choice(('detached', 'flat', 'loft', 'villa')), random.random() < 0.5, random.choice((random.randint(300, 3000), round(random.uniform(300, 30000), 2))))
+            for _ in range(args.rows)]
+
+    def run_old():
+        for rooms, house_type, furniture, rent in rows:
+            old_get_rooms(rooms), old_get_type(house_type), old_get_furniture(furniture, house_type), old_get_rent(rent)
+
+    def run_new():
+        for rooms, house_type, furniture, rent in rows:
+            formatting.get_rooms(rooms), formatting.get_type(house_type), formatting.get_furniture(furniture, house_type), formatting.get_rent(rent)
+
+    name = pick_locale()
+    if name is None:
+        print('no usable locale, the old helpers are skipped')
+    else:
+        print(f'old helpers with locale {name!r}')
+
+    if name in ('it_IT.UTF-8', 'it_IT.utf8'):
+        mismatches = [row for row in rows if (old_get_rooms(row[0]), old_get_type(row[1]), old_get_furniture(row[2], row[1]), old_get_rent(row[3]))
+                      != (formatting.get_rooms(row[0]), formatting.get_type(row[1]), formatting.get_furniture(row[2], row[1]), formatting.get_rent(row[3]))]
+        print(f'output mismatches: {len(mismatches)}')
+
+    for label, function in (('old', run_old), ('new', run_new)):
+        if label == 'old' and name is None:
+            continue
+
+        seconds = min(timeit.repeat(function, number=1, repeat=3))
+        print(f'{label}: {seconds / args.rows * 1e6:.2f} us/row ({args.rows} rows, 4 helpers per row)')
+
+if __name__ == '__main__':
+    main()
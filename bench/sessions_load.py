@@ -0,0 +1,129 @@
+import argparse
+import collections
+import http.cookiejar
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import _setup
+
+# Load test of the production setup (gunicorn.conf.py) on a database copy: one login, then many requests with its session cookie,
+# spread by gunicorn over all the worker processes. Every request must be authenticated whichever worker serves it, also after
+# a restart of the server. Then a burst of failed logins checks that the workers share the rate limiting counters.
+# Linux and macOS only, like gunicorn
+
+USERNAME = 'mario'          # User of the sample database
+PASSWORD = 'Password2024!'
+LOGIN_LIMIT = 5             # Failed logins let through per username before the 429s, see the limits of the login route
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+def start(path, port, workers, log):
+    env = dict(os.environ, DATABASE=path, RATELIMIT_STORAGE=os.path.join(os.path.dirname(path), 'ratelimit.db'),
+               WEB_CONCURRENCY=str(workers), BIND=f'127.0.0.1:{port}')
+    env.pop('SECRET_KEY', None)     # The key kept in instance/secret_key, as in production without SECRET_KEY
+
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=_setup.ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    for _ in range(150):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/about')
+            return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.kill()
+    raise SystemExit('FAILED: the server did not start')
+
+def stop(server):
+    server.send_signal(signal.SIGTERM)
+    server.wait()
+
+def request(opener, url, data=None):
+    try:
+        return opener.open(url, data=data).status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the sessions and rate limits across gunicorn workers')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    path = _setup.copy_database()
+    log_path = os.path.join(os.path.dirname(path), 'gunicorn.log')
+    base = f'http://127.0.0.1:{args.port}'
+    failures = []
+
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(NoRedirect, urllib.request.HTTPCookieProcessor(jar))
+
+    def personal(_):
+        return request(opener, f'{base}/personal')
+
+    try:
+        with open(log_path, 'w') as log:
+            server = start(path, args.port, args.workers, log)
+
+            try:
+                request(opener, f'{base}/login', urllib.parse.urlencode({'username': USERNAME, 'password': PASSWORD}).encode())
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(args.threads) as executor:
+                    statuses = collections.Counter(executor.map(personal, range(args.requests)))
+                seconds = time.perf_counter() - started
+
+                # Failed logins of another user, from several connections so that they reach different workers
+                def bad_login(_):
+                    return request(urllib.request.build_opener(NoRedirect), f'{base}/login',
+                                   urllib.parse.urlencode({'username': 'luigi', 'password': 'wrong'}).encode())
+
+                with ThreadPoolExecutor(args.threads) as executor:
+                    logins = collections.Counter(executor.map(bad_login, range(3 * LOGIN_LIMIT)))
+            finally:
+                stop(server)
+
+            server = start(path, args.port, args.workers, log)
+            try:
+                restarted = request(opener, f'{base}/personal')
+            finally:
+                stop(server)
+
+        with open(log_path) as log:
+            pids = collections.Counter(pid for status, pid in re.findall(r'"GET /personal[^"]*" (\d+) .*<(\d+)>', log.read()) if status == '200')
+    finally:
+        _setup.remove_database(path)
+
+    print(f'GET /personal with the session: {dict(statuses)}, {args.requests / seconds:.0f} req/s')
+    print(f'200 responses by worker pid: {dict(pids)}')
+    print(f'failed logins: {dict(logins)}')
+    print(f'after a restart: {restarted}')
+
+    if statuses != {200: args.requests}:
+        failures.append('some requests were not authenticated')
+    if len(pids) < min(args.workers, 2):
+        failures.append('the requests were served by a single worker')
+    if logins.get(429, 0) < 2 * LOGIN_LIMIT:
+        failures.append('the workers do not share the rate limiting counters')
+    if restarted != 200:
+        failures.append('the session did not survive a restart')
+
+    if failures:
+        raise SystemExit('FAILED\n' + '\n'.join(failures))
+
+    print('OK')
+
+if __name__ == '__main__':
+    main()
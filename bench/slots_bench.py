@@ -0,0 +1,110 @@
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+import _setup
+
+# Cost of listing the bookable slots of an advertisement with a long history of accepted visits, for the booking page.
+# The old version, as it was in visits.py, read every accepted visit of the advertisement and matched each one against the slots.
+# Both run on a copy of the database where the advertisement has no weekly availability nor exceptions, so that they
+# must return the same slots
+
+ADVERTISEMENT = 1
+
+def old_get_visits_next_week(advertisement_id):
+    import db
+    import visits
+
+    slots = visits.get_time_slots()
+
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    sql = """
+        SELECT date, time
+        FROM VISIT V
+        WHERE ADVERTISEMENT_id = ? AND status = 'accepted'
+    """
+    cursor.execute(sql, (advertisement_id,))
+    rows = cursor.fetchall()
+
+    cursor.close()
+
+    for row in rows:
+        ad = dict(row)
+        date_obj = datetime.strptime(ad['date'], '%Y-%m-%d %H:%M:%S')
+        ad['date'] = date_obj.strftime('%d/%m/%Y')
+
+        for day in slots:
+            if day['date'] == ad['date']:
+                for slot in day['slots']:
+                    if slot['pos'] == ad['time']:
+                        slot['available'] = False
+
+    return slots
+
+def fill(conn, visits):
+    """
+    Gives ADVERTISEMENT one accepted visit per slot over the past days, each with its own visitor, and a few in the booking horizon
+    """
+    conn.execute('DELETE FROM AVAILABILITY WHERE ADVERTISEMENT_id = ?', (ADVERTISEMENT,))
+    conn.execute('DELETE FROM AVAILABILITY_EXCEPTION WHERE ADVERTISEMENT_id = ?', (ADVERTISEMENT,))
+    conn.execute("DELETE FROM VISIT WHERE ADVERTISEMENT_id = ? AND status IN ('pending', 'accepted')", (ADVERTISEMENT,))
+
+    today = datetime.combine(date.today(), datetime.min.time())
+    days = [today - timedelta(days=i // 4 + 1) for i in range(visits)] + [today + timedelta(days=2), today + timedelta(days=5)]
+    rows = [(day.strftime('%Y-%m-%d %H:%M:%S'), i % 4, f'slots{i}') for i, day in enumerate(days)]
+
+    conn.executemany("INSERT INTO PERSON VALUES (?, ?, 'x', 'Slots', FALSE)", [(username, f'{username}@example.com') for _, _, username in rows])
+    conn.executemany("INSERT INTO VISIT(date, time, visitor_username, ADVERTISEMENT_id, virtual, status) VALUES (?, ?, ?, ?, FALSE, 'accepted')",
+                     [(day, slot, username, ADVERTISEMENT) for day, slot, username in rows])
+    conn.commit()
+
+def measure(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        result = function()
+    return (time.perf_counter() - start) / calls * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of listing the bookable slots of an advertisement')
+    parser.add_argument('--visits', type=int, default=5000, help='past accepted visits of the advertisement')
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args()
+
+    import sqlite3
+
+    path = _setup.copy_database()
+
+    try:
+        app = _setup.create_app(path)
+
+        conn = sqlite3.connect(path)
+        fill(conn, args.visits)
+        conn.close()
+
+        import visits
+
+        with app.app_context():
+            old, old_slots = measure(lambda: old_get_visits_next_week(ADVERTISEMENT), args.calls)
+            new, new_slots = measure(lambda: visits.get_visits_next_week(ADVERTISEMENT), args.calls)
+            month, _ = measure(lambda: visits.get_visits_next_week(ADVERTISEMENT, days=28), args.calls)
+    finally:
+        _setup.remove_database(path)
+
+    print(f'{args.visits} past accepted visits, {args.calls} calls each')
+    print(f'old             {old:8.2f} ms')
+    print(f'new, 7 days     {new:8.2f} ms')
+    print(f'new, 28 days    {month:8.2f} ms')
+
+    if old_slots != new_slots:
+        raise SystemExit('FAILED: the old and new versions return different slots')
+
+    taken = sum(not slot['available'] for day in new_slots for slot in day['slots'])
+    if taken != 2:
+        raise SystemExit(f'FAILED: expected 2 taken slots, got {taken}')
+
+    print('OK')
+
+if __name__ == '__main__':
+    main()
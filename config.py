@@ -0,0 +1,50 @@
+import os
+import secrets
+
+# Default settings of the app, loaded by app.create_app(). Most can be set with an environment variable of the same name,
+# and all of them are overridden by the dict passed to create_app()
+
+# Key signing the session and "remember me" cookies. It must be the same in every process serving the app and across restarts,
+# otherwise users are logged out. If not set, a random key is generated on the first start and kept in instance/secret_key
+SECRET_KEY = os.environ.get('SECRET_KEY')
+
+DATABASE = os.environ.get('DATABASE', 'database/database.db')
+
+# Path of a SQLite file sharing the rate limiting counters between processes. Set to an empty string to keep the counters
+# in the memory of each process, which then counts on its own
+RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', 'database/ratelimit.db')
+
+# Number of reverse proxies in front of the app. Their X-Forwarded-For and X-Forwarded-Proto headers are trusted,
+# so that the rate limits see the address of the client rather than the one of the proxy
+PROXY_COUNT = int(os.environ.get('PROXY_COUNT', 0))
+
+# True when the app is created before forking the processes serving it (see gunicorn.conf.py). create_app() then leaves
+# the per-process initialization to app.init_worker(), which the server runs in each worker
+PREFORK = False
+
+def load_secret_key(path):
+    """
+    Reads the secret key kept in a file, creating the file with a new random key if it doesn't exist.
+    Processes starting at the same time all get the key of the first one creating the file
+
+    :param path: path of the file
+    :returns: the key
+    """
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # The key is written in a temporary file then linked to its path, which fails if another process did it first
+        tmp = f'{path}.{os.getpid()}'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as file:
+            file.write(secrets.token_hex(32))
+
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+
+    with open(path) as file:
+        return file.read().strip()
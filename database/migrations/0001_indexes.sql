@@ -0,0 +1,20 @@
+-- Secondary indexes for the lookups done on every advertisement and personal page.
+-- Each index carries the columns read by its query, so SQLite can answer from the index alone
+
+-- has_user_visited() / is_user_waiting_visit()
+CREATE INDEX IF NOT EXISTS VISIT_advertisement_visitor_status ON VISIT(ADVERTISEMENT_id, visitor_username, status);
+
+-- get_visits_next_week()
+CREATE INDEX IF NOT EXISTS VISIT_advertisement_status_date ON VISIT(ADVERTISEMENT_id, status, date, time);
+
+-- get_user_visits()
+CREATE INDEX IF NOT EXISTS VISIT_visitor ON VISIT(visitor_username, ADVERTISEMENT_id, date, time, status, virtual, refusal_reason);
+
+-- Pictures of an advertisement (get_ad_by_id_raw(), get_ad_images(), listing joins)
+CREATE INDEX IF NOT EXISTS PICTURES_advertisement ON PICTURES(ADVERTISEMENT_id, path);
+
+-- get_public_ads()
+CREATE INDEX IF NOT EXISTS ADVERTISEMENT_available ON ADVERTISEMENT(available, id);
+
+-- get_landlord_ads(), get_landlord_visits()
+CREATE INDEX IF NOT EXISTS ADVERTISEMENT_landlord ON ADVERTISEMENT(landlord_username, id, available);
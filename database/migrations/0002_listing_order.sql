@@ -0,0 +1,7 @@
+-- Orderings of the home page. With (sort key, id) in the index, a page is read directly in order, starting from the cursor
+
+-- get_public_ads(sort_price=True)
+CREATE INDEX IF NOT EXISTS ADVERTISEMENT_available_rent ON ADVERTISEMENT(available, rent, id);
+
+-- get_public_ads(sort_price=False)
+CREATE INDEX IF NOT EXISTS ADVERTISEMENT_available_rooms ON ADVERTISEMENT(available, rooms, id);
@@ -0,0 +1,26 @@
+-- Full-text index over the advertisements, used by search_ads(). It is an external content table: the text is only stored in ADVERTISEMENT,
+-- the triggers below keep the index in sync with it
+CREATE VIRTUAL TABLE IF NOT EXISTS ADVERTISEMENT_FTS USING fts5(
+    title,
+    description,
+    adress,
+    content = 'ADVERTISEMENT',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS ADVERTISEMENT_FTS_insert AFTER INSERT ON ADVERTISEMENT BEGIN
+    INSERT INTO ADVERTISEMENT_FTS(rowid, title, description, adress) VALUES (NEW.id, NEW.title, NEW.description, NEW.adress);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ADVERTISEMENT_FTS_delete AFTER DELETE ON ADVERTISEMENT BEGIN
+    INSERT INTO ADVERTISEMENT_FTS(ADVERTISEMENT_FTS, rowid, title, description, adress) VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.adress);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ADVERTISEMENT_FTS_update AFTER UPDATE OF title, description, adress ON ADVERTISEMENT BEGIN
+    INSERT INTO ADVERTISEMENT_FTS(ADVERTISEMENT_FTS, rowid, title, description, adress) VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.adress);
+    INSERT INTO ADVERTISEMENT_FTS(rowid, title, description, adress) VALUES (NEW.id, NEW.title, NEW.description, NEW.adress);
+END;
+
+-- Index the advertisements inserted before this migration
+INSERT INTO ADVERTISEMENT_FTS(ADVERTISEMENT_FTS) VALUES ('rebuild');
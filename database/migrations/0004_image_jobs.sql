@@ -0,0 +1,20 @@
+-- Uploaded images are processed in background (see jobs.py). Each row is an image waiting to be processed, it is deleted once done.
+-- Rows survive a restart: jobs left running by a dead process are picked up again once their lease expires
+CREATE TABLE IF NOT EXISTS IMAGE_JOB (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,             -- Name of the processed image, as stored in PICTURES
+    upload TEXT NOT NULL,           -- Path of the raw uploaded file
+    status TEXT NOT NULL CHECK(status IN ('pending', 'running', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created DATETIME NOT NULL,
+    started DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS IMAGE_JOB_status ON IMAGE_JOB(status, id);
+
+-- Pictures whose processing hasn't finished yet. Listings only show ready pictures, and a placeholder when there are none
+ALTER TABLE PICTURES ADD COLUMN ready BOOLEAN NOT NULL DEFAULT TRUE;
+
+DROP INDEX IF EXISTS PICTURES_advertisement;
+CREATE INDEX IF NOT EXISTS PICTURES_advertisement_ready ON PICTURES(ADVERTISEMENT_id, ready, path);
@@ -0,0 +1,21 @@
+-- Images are named after their content (see image_handler.store_upload()), so the same image can belong to several advertisements.
+-- The primary key of PICTURES becomes (path, ADVERTISEMENT_id): the rows with a given path are the references to that image file,
+-- the file is deleted when the last one goes away. SQLite can't change a primary key in place, the table is rebuilt
+CREATE TABLE PICTURES_NEW (
+    path TEXT NOT NULL,
+    ADVERTISEMENT_id INTEGER NOT NULL,
+    ready BOOLEAN NOT NULL DEFAULT TRUE,
+    PRIMARY KEY (path, ADVERTISEMENT_id),
+    FOREIGN KEY (ADVERTISEMENT_id) REFERENCES ADVERTISEMENT(id)
+);
+
+INSERT INTO PICTURES_NEW(path, ADVERTISEMENT_id, ready) SELECT path, ADVERTISEMENT_id, ready FROM PICTURES;
+
+DROP TABLE PICTURES;
+
+ALTER TABLE PICTURES_NEW RENAME TO PICTURES;
+
+CREATE INDEX IF NOT EXISTS PICTURES_advertisement_ready ON PICTURES(ADVERTISEMENT_id, ready, path);
+
+-- Uploads of an image already being processed don't enqueue another job
+CREATE INDEX IF NOT EXISTS IMAGE_JOB_path ON IMAGE_JOB(path, status);
@@ -0,0 +1,18 @@
+-- Weekly availability of the landlords for the visits to an advertisement. Each row stores the offered time slots of a weekday
+-- as a bitmask: bit i set means slot i (see visits.Slot) can be booked. Weekdays without a row offer every slot
+CREATE TABLE IF NOT EXISTS AVAILABILITY (
+    ADVERTISEMENT_id INTEGER NOT NULL,
+    weekday INTEGER NOT NULL CHECK(weekday BETWEEN 0 AND 6),   -- 0 is Monday
+    slots INTEGER NOT NULL CHECK(slots BETWEEN 0 AND 15),
+    PRIMARY KEY (ADVERTISEMENT_id, weekday),
+    FOREIGN KEY (ADVERTISEMENT_id) REFERENCES ADVERTISEMENT(id)
+) WITHOUT ROWID;
+
+-- Single dates overriding the weekly availability, e.g. holidays (no slots) or extra openings
+CREATE TABLE IF NOT EXISTS AVAILABILITY_EXCEPTION (
+    ADVERTISEMENT_id INTEGER NOT NULL,
+    date DATE NOT NULL,             -- YYYY-MM-DD
+    slots INTEGER NOT NULL CHECK(slots BETWEEN 0 AND 15),
+    PRIMARY KEY (ADVERTISEMENT_id, date),
+    FOREIGN KEY (ADVERTISEMENT_id) REFERENCES ADVERTISEMENT(id)
+) WITHOUT ROWID;
@@ -0,0 +1,5 @@
+-- Personal page: the visits of a user and the requests to a landlord are listed most recent first, a page at a time,
+-- optionally filtered by status. These indexes return them already sorted, so a page reads only its own rows
+DROP INDEX IF EXISTS VISIT_visitor;
+CREATE INDEX IF NOT EXISTS VISIT_visitor_date ON VISIT(visitor_username, date, time);
+CREATE INDEX IF NOT EXISTS VISIT_visitor_status_date ON VISIT(visitor_username, status, date, time);
@@ -0,0 +1,25 @@
+-- Booking rules enforced by the database, so that concurrent requests can't break them:
+-- a slot of an advertisement is accepted for at most one visitor, and a visitor has at most one pending or accepted visit per advertisement.
+-- Rows already breaking them are resolved first: accepted visits win over pending ones, then the oldest row is kept
+
+UPDATE VISIT
+SET status = 'rejected', refusal_reason = 'La fascia oraria è stata assegnata a un altro visitatore'
+WHERE status = 'accepted' AND rowid NOT IN (
+    SELECT MIN(rowid) FROM VISIT WHERE status = 'accepted' GROUP BY ADVERTISEMENT_id, date, time
+);
+
+UPDATE VISIT
+SET status = 'rejected', refusal_reason = 'Richiesta duplicata'
+WHERE status = 'pending' AND EXISTS (
+    SELECT 1 FROM VISIT V
+    WHERE V.ADVERTISEMENT_id = VISIT.ADVERTISEMENT_id AND V.visitor_username = VISIT.visitor_username AND V.status = 'accepted'
+);
+
+UPDATE VISIT
+SET status = 'rejected', refusal_reason = 'Richiesta duplicata'
+WHERE status IN ('pending', 'accepted') AND rowid NOT IN (
+    SELECT MIN(rowid) FROM VISIT WHERE status IN ('pending', 'accepted') GROUP BY ADVERTISEMENT_id, visitor_username
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS VISIT_slot_accepted ON VISIT(ADVERTISEMENT_id, date, time) WHERE status = 'accepted';
+CREATE UNIQUE INDEX IF NOT EXISTS VISIT_visitor_active ON VISIT(ADVERTISEMENT_id, visitor_username) WHERE status IN ('pending', 'accepted');
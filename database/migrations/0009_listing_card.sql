@@ -0,0 +1,99 @@
+-- Explicit order of the pictures of an advertisement: the one with the lowest position is the cover shown in the listings.
+-- Existing pictures keep the order they were inserted in
+ALTER TABLE PICTURES ADD COLUMN position INTEGER NOT NULL DEFAULT 0;
+
+UPDATE PICTURES
+SET position = (SELECT COUNT(*) FROM PICTURES P WHERE P.ADVERTISEMENT_id = PICTURES.ADVERTISEMENT_id AND P.rowid < PICTURES.rowid);
+
+DROP INDEX IF EXISTS PICTURES_advertisement_ready;
+CREATE INDEX IF NOT EXISTS PICTURES_advertisement_position ON PICTURES(ADVERTISEMENT_id, ready, position, path);
+
+-- Everything a listing card shows, one row per advertisement, with the labels already in Italian (same output as formatting.py).
+-- The listings read it with a single indexed scan, without joins nor formatting. The triggers below keep it in sync
+CREATE TABLE IF NOT EXISTS LISTING_CARD (
+    ADVERTISEMENT_id INTEGER PRIMARY KEY,
+    landlord_username TEXT NOT NULL,
+    landlord_name TEXT NOT NULL,
+    title TEXT NOT NULL,
+    adress TEXT NOT NULL,
+    description TEXT NOT NULL,
+    rooms INTEGER NOT NULL,         -- Sort keys
+    rent REAL NOT NULL,
+    rooms_label TEXT NOT NULL,      -- e.g. '5+'
+    type_label TEXT NOT NULL,       -- e.g. 'Casa indipendente'
+    furniture_label TEXT NOT NULL,  -- e.g. 'non arredata'
+    rent_label TEXT NOT NULL,       -- e.g. '1.234,50'
+    image TEXT,                     -- Cover: the first ready picture by position. NULL while none is ready
+    has_pictures BOOLEAN NOT NULL,  -- Advertisements without pictures, ready or not, aren't listed
+    available BOOLEAN NOT NULL
+);
+
+-- Rows of LISTING_CARD as computed from the source tables. The triggers copy a row from here whenever its sources change
+CREATE VIEW IF NOT EXISTS LISTING_CARD_SOURCE AS
+SELECT A.id AS ADVERTISEMENT_id, A.landlord_username, P.name AS landlord_name, A.title, A.adress, A.description, A.rooms, A.rent,
+    CASE WHEN A.rooms > 5 THEN '5+' ELSE CAST(A.rooms AS TEXT) END AS rooms_label,
+    CASE A.type
+        WHEN 'detached' THEN 'Casa indipendente'
+        WHEN 'flat' THEN 'Appartamento'
+        WHEN 'loft' THEN 'Loft'
+        WHEN 'villa' THEN 'Villa'
+        ELSE A.type
+    END AS type_label,
+    CASE WHEN A.furniture THEN '' ELSE 'non' END || CASE WHEN A.type IN ('detached', 'villa') THEN ' arredata' ELSE ' arredato' END AS furniture_label,
+    -- Rounded to cents, thousands separated by '.', decimals by ','
+    replace(printf('%,d', CAST(round(A.rent * 100) AS INTEGER) / 100), ',', '.') || ',' || printf('%02d', CAST(round(A.rent * 100) AS INTEGER) % 100) AS rent_label,
+    (SELECT PI.path FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id AND PI.ready ORDER BY PI.position LIMIT 1) AS image,
+    EXISTS (SELECT 1 FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id) AS has_pictures,
+    A.available
+FROM ADVERTISEMENT A
+INNER JOIN PERSON P ON P.username = A.landlord_username;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_ad_insert AFTER INSERT ON ADVERTISEMENT BEGIN
+    INSERT INTO LISTING_CARD SELECT * FROM LISTING_CARD_SOURCE WHERE ADVERTISEMENT_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_ad_update AFTER UPDATE ON ADVERTISEMENT BEGIN
+    DELETE FROM LISTING_CARD WHERE ADVERTISEMENT_id = OLD.id;
+    INSERT INTO LISTING_CARD SELECT * FROM LISTING_CARD_SOURCE WHERE ADVERTISEMENT_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_ad_delete AFTER DELETE ON ADVERTISEMENT BEGIN
+    DELETE FROM LISTING_CARD WHERE ADVERTISEMENT_id = OLD.id;
+END;
+
+-- The cover and has_pictures only depend on the pictures of the advertisement
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_picture_insert AFTER INSERT ON PICTURES BEGIN
+    UPDATE LISTING_CARD
+    SET image = (SELECT image FROM LISTING_CARD_SOURCE WHERE ADVERTISEMENT_id = NEW.ADVERTISEMENT_id), has_pictures = TRUE
+    WHERE ADVERTISEMENT_id = NEW.ADVERTISEMENT_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_picture_update AFTER UPDATE ON PICTURES BEGIN
+    UPDATE LISTING_CARD
+    SET (image, has_pictures) = (SELECT image, has_pictures FROM LISTING_CARD_SOURCE WHERE ADVERTISEMENT_id = LISTING_CARD.ADVERTISEMENT_id)
+    WHERE ADVERTISEMENT_id IN (OLD.ADVERTISEMENT_id, NEW.ADVERTISEMENT_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_picture_delete AFTER DELETE ON PICTURES BEGIN
+    UPDATE LISTING_CARD
+    SET (image, has_pictures) = (SELECT image, has_pictures FROM LISTING_CARD_SOURCE WHERE ADVERTISEMENT_id = OLD.ADVERTISEMENT_id)
+    WHERE ADVERTISEMENT_id = OLD.ADVERTISEMENT_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_CARD_person_update AFTER UPDATE OF name ON PERSON BEGIN
+    UPDATE LISTING_CARD SET landlord_name = NEW.name WHERE landlord_username = NEW.username;
+END;
+
+INSERT OR REPLACE INTO LISTING_CARD SELECT * FROM LISTING_CARD_SOURCE;
+
+-- get_public_ads(), one index per ordering. Only the listed advertisements are indexed
+CREATE INDEX IF NOT EXISTS LISTING_CARD_rent ON LISTING_CARD(rent, ADVERTISEMENT_id) WHERE available AND has_pictures;
+CREATE INDEX IF NOT EXISTS LISTING_CARD_rooms ON LISTING_CARD(rooms, ADVERTISEMENT_id) WHERE available AND has_pictures;
+
+-- get_landlord_ads()
+CREATE INDEX IF NOT EXISTS LISTING_CARD_landlord ON LISTING_CARD(landlord_username, ADVERTISEMENT_id);
+
+-- The listings don't read ADVERTISEMENT anymore
+DROP INDEX IF EXISTS ADVERTISEMENT_available;
+DROP INDEX IF EXISTS ADVERTISEMENT_available_rent;
+DROP INDEX IF EXISTS ADVERTISEMENT_available_rooms;
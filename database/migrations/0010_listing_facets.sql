@@ -0,0 +1,76 @@
+-- Raw filter values of the advertisement in its card, read by the facets below and by the listing index (listing_index.py)
+ALTER TABLE LISTING_CARD ADD COLUMN type TEXT NOT NULL DEFAULT '';
+ALTER TABLE LISTING_CARD ADD COLUMN furniture BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE LISTING_CARD ADD COLUMN rent_band INTEGER NOT NULL DEFAULT 0;
+
+-- Same as in migration 0009, plus the new columns (the triggers copy the rows by position)
+DROP VIEW IF EXISTS LISTING_CARD_SOURCE;
+CREATE VIEW LISTING_CARD_SOURCE AS
+SELECT A.id AS ADVERTISEMENT_id, A.landlord_username, P.name AS landlord_name, A.title, A.adress, A.description, A.rooms, A.rent,
+    CASE WHEN A.rooms > 5 THEN '5+' ELSE CAST(A.rooms AS TEXT) END AS rooms_label,
+    CASE A.type
+        WHEN 'detached' THEN 'Casa indipendente'
+        WHEN 'flat' THEN 'Appartamento'
+        WHEN 'loft' THEN 'Loft'
+        WHEN 'villa' THEN 'Villa'
+        ELSE A.type
+    END AS type_label,
+    CASE WHEN A.furniture THEN '' ELSE 'non' END || CASE WHEN A.type IN ('detached', 'villa') THEN ' arredata' ELSE ' arredato' END AS furniture_label,
+    -- Rounded to cents, thousands separated by '.', decimals by ','
+    replace(printf('%,d', CAST(round(A.rent * 100) AS INTEGER) / 100), ',', '.') || ',' || printf('%02d', CAST(round(A.rent * 100) AS INTEGER) % 100) AS rent_label,
+    (SELECT PI.path FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id AND PI.ready ORDER BY PI.position LIMIT 1) AS image,
+    EXISTS (SELECT 1 FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id) AS has_pictures,
+    A.available,
+    A.type,
+    A.furniture,
+    -- Position in ads.RENT_BANDS, changes must be made in both places
+    CASE
+        WHEN A.rent < 500 THEN 0
+        WHEN A.rent < 800 THEN 1
+        WHEN A.rent < 1200 THEN 2
+        WHEN A.rent < 2000 THEN 3
+        ELSE 4
+    END AS rent_band
+FROM ADVERTISEMENT A
+INNER JOIN PERSON P ON P.username = A.landlord_username;
+
+UPDATE LISTING_CARD
+SET (type, furniture, rent_band) = (SELECT S.type, S.furniture, S.rent_band FROM LISTING_CARD_SOURCE S WHERE S.ADVERTISEMENT_id = LISTING_CARD.ADVERTISEMENT_id);
+
+-- Number of listed advertisements (available, with pictures) for each combination of the filters of the home page, at most a few hundred rows.
+-- The facet counts are computed from here in a single pass, whatever the number of advertisements. The triggers below keep it in sync
+CREATE TABLE IF NOT EXISTS LISTING_FACET (
+    type TEXT NOT NULL,
+    furniture BOOLEAN NOT NULL,
+    rooms INTEGER NOT NULL,
+    rent_band INTEGER NOT NULL,
+    listed INTEGER NOT NULL,
+    PRIMARY KEY (type, furniture, rooms, rent_band)
+) WITHOUT ROWID;
+
+INSERT INTO LISTING_FACET(type, furniture, rooms, rent_band, listed)
+SELECT type, furniture, rooms, rent_band, COUNT(*)
+FROM LISTING_CARD
+WHERE available AND has_pictures
+GROUP BY type, furniture, rooms, rent_band;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_FACET_card_insert AFTER INSERT ON LISTING_CARD WHEN NEW.available AND NEW.has_pictures BEGIN
+    INSERT INTO LISTING_FACET(type, furniture, rooms, rent_band, listed) VALUES (NEW.type, NEW.furniture, NEW.rooms, NEW.rent_band, 1)
+    ON CONFLICT DO UPDATE SET listed = listed + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS LISTING_FACET_card_delete AFTER DELETE ON LISTING_CARD WHEN OLD.available AND OLD.has_pictures BEGIN
+    UPDATE LISTING_FACET SET listed = listed - 1
+    WHERE type = OLD.type AND furniture = OLD.furniture AND rooms = OLD.rooms AND rent_band = OLD.rent_band;
+END;
+
+-- The advertisement triggers replace the whole card, the pictures ones update has_pictures in place
+CREATE TRIGGER IF NOT EXISTS LISTING_FACET_card_update AFTER UPDATE OF available, has_pictures, type, furniture, rooms, rent_band ON LISTING_CARD BEGIN
+    UPDATE LISTING_FACET SET listed = listed - 1
+    WHERE OLD.available AND OLD.has_pictures AND type = OLD.type AND furniture = OLD.furniture AND rooms = OLD.rooms AND rent_band = OLD.rent_band;
+
+    INSERT INTO LISTING_FACET(type, furniture, rooms, rent_band, listed)
+    SELECT NEW.type, NEW.furniture, NEW.rooms, NEW.rent_band, 1
+    WHERE NEW.available AND NEW.has_pictures
+    ON CONFLICT DO UPDATE SET listed = listed + 1;
+END;
@@ -0,0 +1,38 @@
+-- Same as in migration 0010, except for the labels of rents too large for the integer arithmetic (the triggers copy the rows by position)
+DROP VIEW IF EXISTS LISTING_CARD_SOURCE;
+CREATE VIEW LISTING_CARD_SOURCE AS
+SELECT A.id AS ADVERTISEMENT_id, A.landlord_username, P.name AS landlord_name, A.title, A.adress, A.description, A.rooms, A.rent,
+    CASE WHEN A.rooms > 5 THEN '5+' ELSE CAST(A.rooms AS TEXT) END AS rooms_label,
+    CASE A.type
+        WHEN 'detached' THEN 'Casa indipendente'
+        WHEN 'flat' THEN 'Appartamento'
+        WHEN 'loft' THEN 'Loft'
+        WHEN 'villa' THEN 'Villa'
+        ELSE A.type
+    END AS type_label,
+    CASE WHEN A.furniture THEN '' ELSE 'non' END || CASE WHEN A.type IN ('detached', 'villa') THEN ' arredata' ELSE ' arredato' END AS furniture_label,
+    -- Rounded to cents, thousands separated by '.', decimals by ','. Rents too large to be counted in cents exactly by a 64 bit integer
+    -- (only possible before ads.MAX_RENT) are shown without thousands separators instead of saturating
+    CASE WHEN A.rent < 1e13
+        THEN replace(printf('%,d', CAST(round(A.rent * 100) AS INTEGER) / 100), ',', '.') || ',' || printf('%02d', CAST(round(A.rent * 100) AS INTEGER) % 100)
+        ELSE replace(printf('%.2f', A.rent), '.', ',')
+    END AS rent_label,
+    (SELECT PI.path FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id AND PI.ready ORDER BY PI.position LIMIT 1) AS image,
+    EXISTS (SELECT 1 FROM PICTURES PI WHERE PI.ADVERTISEMENT_id = A.id) AS has_pictures,
+    A.available,
+    A.type,
+    A.furniture,
+    -- Position in ads.RENT_BANDS, changes must be made in both places
+    CASE
+        WHEN A.rent < 500 THEN 0
+        WHEN A.rent < 800 THEN 1
+        WHEN A.rent < 1200 THEN 2
+        WHEN A.rent < 2000 THEN 3
+        ELSE 4
+    END AS rent_band
+FROM ADVERTISEMENT A
+INNER JOIN PERSON P ON P.username = A.landlord_username;
+
+UPDATE LISTING_CARD
+SET rent_label = (SELECT S.rent_label FROM LISTING_CARD_SOURCE S WHERE S.ADVERTISEMENT_id = LISTING_CARD.ADVERTISEMENT_id)
+WHERE rent >= 1e13;
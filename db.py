@@ -0,0 +1,84 @@
+import sqlite3
+import queue
+from flask import g
+
+DATABASE = 'database/database.db'
+
+POOL_SIZE = 8               # Idle connections kept around between requests
+STATEMENT_CACHE = 128       # Prepared statements cached by each connection
+BUSY_TIMEOUT = 5000         # Milliseconds a statement waits on a locked database before failing
+MMAP_SIZE = 64 * 1024**2    # Bytes of the database file memory mapped by each connection
+
+_database = DATABASE
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def connect(path=None, readonly=False):
+    """
+    Opens a new connection to the database and applies the per-connection settings.
+    Connections are not bound to the thread that opened them, so they can be handed back to the pool and reused by other requests
+
+    :param path: path of the SQLite database file, the configured one if None
+    :param readonly: if True, any statement writing to the database fails. Writes go through the writer thread, see writer.py
+    :returns: the configured connection
+    """
+    conn = sqlite3.connect(path or _database, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+
+    conn.execute('PRAGMA journal_mode = WAL')   # Readers don't block the writer and vice versa. Persistent, but cheap to re-assert
+    conn.execute('PRAGMA synchronous = NORMAL') # Safe with WAL, avoids an fsync on every commit
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+
+    if readonly:
+        conn.execute('PRAGMA query_only = ON')
+
+    return conn
+
+def get_db():
+    """
+    Returns the read-only connection bound to the current request. The first call of each request borrows one from the pool
+    (or opens a new one), the following ones return the same connection
+
+    :returns: the request connection
+    """
+    if 'db' not in g:
+        try:
+            g.db = _pool.get_nowait()
+        except queue.Empty:
+            g.db = connect(readonly=True)
+
+    return g.db
+
+def close_db(e=None):
+    """
+    Hands the request connection back to the pool. Any transaction left open by the request is rolled back first.
+    Registered as an app context teardown function by init_app()
+    """
+    conn = g.pop('db', None)
+
+    if conn is None:
+        return
+
+    try:
+        conn.rollback()
+        _pool.put_nowait(conn)
+    except (sqlite3.Error, queue.Full):
+        conn.close()
+
+def init_worker():
+    """
+    Empties the pool of the current process. Called in each worker after a fork: SQLite connections must not be used
+    by a process other than the one that opened them, so the ones inherited from the parent are left alone
+    """
+    global _pool
+
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def init_app(app):
+    """
+    Registers the connection teardown on a Flask app and reads its DATABASE setting
+    """
+    global _database
+
+    _database = app.config.get('DATABASE', DATABASE)
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,87 @@
+# Human readable (Italian) versions of the DB attributes of an advertisement.
+# Everything is precomputed into lookup tables: these helpers don't depend on the locales installed on the host nor change any process-wide state.
+# The listings read the same labels precomputed in SQL (LISTING_CARD_SOURCE in migration 0009): changes must be made in both places
+
+# Swaps the separators of Python's format ("1,234.50") into the Italian ones ("1.234,50")
+_ITALIAN_SEPARATORS = str.maketrans(',.', '.,')
+
+ROOMS = {num: str(num) for num in range(1, 6)}
+
+TYPES = {
+    'detached': 'Casa indipendente',
+    'flat': 'Appartamento',
+    'loft': 'Loft',
+    'villa': 'Villa',
+}
+
+FEMININE_TYPES = ('detached', 'villa')  # Casa and villa are feminine nouns, the furniture adjective has to agree
+
+FURNITURE = {
+    (furniture, house_type): ('' if furniture else 'non') + (' arredata' if house_type in FEMININE_TYPES else ' arredato')
+    for furniture in (True, False)
+    for house_type in TYPES
+}
+
+def get_rooms(num):
+    """
+    Pretty prints the number of rooms in a house. Returns '5+' if the house has more than 5 rooms
+
+    :param num: the number of rooms
+    :returns: a string representation of the number of rooms
+    """
+    rooms = ROOMS.get(num)
+    if rooms is not None:
+        return rooms
+
+    return '5+' if num > 5 else str(num)
+
+def get_type(house_type):
+    """
+    Translates the "type" DB row format into plain Italian
+
+    :param house_type: house type in the DB format
+    :returns: a string representation of the house type
+    """
+    return TYPES.get(house_type, house_type)    # Fall back to the DB format, this should never happen
+
+def get_furniture(furniture, house_type):
+    """
+    :param furniture: furniture boolean attribute, from the DB
+    :param house_type: the type of house in the DB format
+    :returns: a string representation of the furniture status
+    """
+    result = FURNITURE.get((bool(furniture), house_type))
+    if result is not None:
+        return result
+
+    return ('' if furniture else 'non') + ' arredato'   # Unknown house type, same output as the known masculine ones
+
+def get_rent(num):
+    """
+    :param num: rent attribute, from the DB
+    :returns: a string representation of the rent parameter with the Italian number formatting (point as a thousand separator, comma as a decimal separator)
+    """
+    return f'{num:,.2f}'.translate(_ITALIAN_SEPARATORS)
+
+def get_rent_band(rent_min, rent_max):
+    """
+    :param rent_min: lower bound of the band in euros, None if unbounded
+    :param rent_max: upper bound of the band in euros, None if unbounded
+    :returns: a string representation of the band, e.g. '500 - 800 €'
+    """
+    def get_euros(num):
+        return f'{num:,}'.translate(_ITALIAN_SEPARATORS)
+
+    if rent_min is None:
+        return f'Fino a {get_euros(rent_max)} €'
+    if rent_max is None:
+        return f'Oltre {get_euros(rent_min)} €'
+
+    return f'{get_euros(rent_min)} - {get_euros(rent_max)} €'
+
+def get_date(value):
+    """
+    :param value: a date from the DB, 'YYYY-MM-DD' optionally followed by the time
+    :returns: the date in the Italian format, DD/MM/YYYY
+    """
+    return f'{value[8:10]}/{value[5:7]}/{value[:4]}'
@@ -0,0 +1,26 @@
+import os
+import multiprocessing
+
+# Production server configuration: gunicorn -c gunicorn.conf.py
+# Settings can be changed with the environment variables below, or with gunicorn's command line options
+
+# The app is created once in the master process (migrations included), then the workers are forked from it.
+# Connections, threads and process pools are started in each worker by post_fork()
+wsgi_app = "app:create_app({'PREFORK': True})"
+preload_app = True
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+
+# Each worker also runs its own image and password hashing processes (see jobs.py and passwords.py), so one worker per core is enough
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 8))
+timeout = 30
+
+accesslog = '-'
+access_log_format = '%(h)s "%(r)s" %(s)s %(b)s %(M)sms %(p)s'
+
+def post_fork(server, worker):
+    import app
+
+    app.init_worker(worker.app.wsgi())
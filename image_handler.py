@@ -1,6 +1,10 @@
 from PIL import Image, ImageOps
-import uuid
+import click
+import hashlib
 import os
+import tempfile
+from flask import url_for, request, Request
+from flask.cli import AppGroup
 
 class ImageException(Exception):
     """
@@ -12,49 +16,312 @@ class ImageException(Exception):
         self.file = file
         super().__init__()
 
+IMAGES_DIR = 'static/images'
+IMAGES_CACHE_AGE = 365 * 24 * 3600  # Images are named after their content and never change, browsers can keep them forever
+UPLOADS_DIR = 'uploads'       # Raw uploads waiting to be processed, not served
+
 # Desired file sizes for a 16:9 aspect ratio
 WIDTH = 1280
 HEIGHT = 720
 
-def save_image(image_form):
+# Upload budget. Images over it are rejected before being decoded: a decoded image takes width * height * 3 bytes of memory
+MAX_IMAGE_BYTES = 15 * 1024**2
+MAX_IMAGE_PIXELS = 40 * 10**6
+MAX_IMAGES = 5                      # Images per advertisement
+
+UPLOAD_MEMORY_SIZE = 64 * 1024      # Uploaded files bigger than this are spooled to disk while the request is parsed
+MAX_FORM_MEMORY_SIZE = 1024**2      # Non file fields of a form
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS  # Pillow's own decompression bomb guard, for images opened elsewhere
+
+# Widths of the smaller copies saved next to each image, picked by the browser through srcset (cards are 18rem wide)
+VARIANT_WIDTHS = (320, 640)
+_VARIANT_SUFFIXES = tuple(str(width) for width in VARIANT_WIDTHS)
+WEBP_QUALITY = 80
+
+class UploadRequest(Request):
+    """
+    Request class keeping the memory used by form parsing bounded: uploaded files are spooled to a temporary file on disk
+    as soon as they exceed UPLOAD_MEMORY_SIZE, the other fields are capped at MAX_FORM_MEMORY_SIZE
+    """
+    max_form_memory_size = MAX_FORM_MEMORY_SIZE
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_MEMORY_SIZE, mode='rb+')
+
+def store_upload(image_form):
+    """
+    Saves an uploaded image as is, to be processed later by process_image().
+    Only the image header is read, to reject files that aren't images or that exceed the size budget.
+    The processed image is named after the hash of the upload: the same file uploaded twice gets the same name,
+    and isn't processed again if the image already exists
+
+    :param image_form: the uploaded file
+    :returns: a (filename, upload) tuple: the name of the processed image and the path of the raw file, None if the image already exists
+    :raise ImageException: exception raised when the file can't be saved or isn't an image
+    """
     try:
-        img = Image.open(image_form)
+        # Copy the upload to disk, hashing it on the way
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        digest = hashlib.sha256()
+
+        with tempfile.NamedTemporaryFile(dir=UPLOADS_DIR, delete=False) as tmp:
+            for chunk in iter(lambda: image_form.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
 
+        try:
+            image_format = check_upload(tmp.name)
+
+            # The processed image has the same extension as the original, it must be one Pillow can save to. The job would fail every attempt otherwise
+            file_extension = get_extension(image_form.filename, image_format)
+            new_filename = f'{digest.hexdigest()[:32]}.{file_extension}'
+
+            if os.path.isfile(f'{IMAGES_DIR}/{new_filename}'):
+                os.remove(tmp.name)
+                os.utime(f'{IMAGES_DIR}/{new_filename}')   # Keeps the garbage collector off it until the new reference is committed
+                return new_filename, None
+
+            upload = f'{UPLOADS_DIR}/{new_filename}'
+            os.replace(tmp.name, upload)
+
+            return new_filename, upload
+        except Exception:
+            if os.path.isfile(tmp.name):
+                os.remove(tmp.name)
+            raise
+    except Exception as e:
+        print("ERROR", e)
+        raise ImageException(image_form.filename)
+
+def store_uploads(files):
+    """
+    Saves a set of uploaded images with store_upload(). If one of them fails, the ones already saved are deleted
+
+    :param files: the uploaded files
+    :returns: a list of (filename, upload) tuples
+    :raise ImageException: exception raised when a file can't be saved or isn't an image
+    """
+    uploads = []
+
+    try:
+        for file in files:
+            uploads.append(store_upload(image_form=file))
+    except ImageException:
+        delete_uploads(uploads)
+        raise
+
+    return uploads
+
+def check_upload(upload):
+    """
+    Checks an uploaded file against the size budget, without decoding it
+
+    :param upload: path of the raw uploaded file
+    :returns: the format of the image detected by Pillow, e.g. 'JPEG'
+    :raise Exception: exception raised when the file isn't an image or exceeds the budget
+    """
+    if os.path.getsize(upload) > MAX_IMAGE_BYTES:
+        raise Exception(f'{upload} exceeds {MAX_IMAGE_BYTES} bytes')
+
+    with Image.open(upload) as img:    # Only parses the header
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise Exception(f'{upload} exceeds {MAX_IMAGE_PIXELS} pixels')
+
+        return img.format
+
+def get_extension(filename, image_format):
+    """
+    Picks the extension of a processed image: the one of the uploaded file if Pillow can save to it,
+    otherwise one of the format detected in the file (e.g. an upload named 'foto' holding a JPEG gets 'jpeg')
+
+    :param filename: name of the uploaded file
+    :param image_format: format of the upload, as returned by check_upload()
+    :returns: the extension, lowercase and without the dot
+    :raise Exception: exception raised when Pillow can save neither to the extension nor to the format
+    """
+    extensions = Image.registered_extensions()     # '.jpg' -> 'JPEG', for every format Pillow knows
+    saved = [extension for extension, extension_format in extensions.items() if extension_format in Image.SAVE]
+
+    extension = '.' + filename.rsplit('.', 1)[-1].lower() if '.' in filename else None
+    if extension in saved:
+        return extension[1:]
+
+    candidates = [extension for extension in saved if extensions[extension] == image_format]
+    if not candidates:
+        raise Exception(f'Cannot save {filename} ({image_format}) to any extension')
+
+    preferred = f'.{str(image_format).lower()}'    # e.g. '.png' rather than '.apng'
+    return (preferred if preferred in candidates else candidates[0])[1:]
+
+def process_image(upload, filename):
+    """
+    Resizes an uploaded image to WIDTH x HEIGHT and saves it, together with its variants. Runs in the worker processes of the job queue.
+    Images are decoded close to their final size: the memory used doesn't depend on the resolution of the upload
+
+    :param upload: path of the raw uploaded file
+    :param filename: name of the processed image
+    """
+    check_upload(upload)    # Jobs are durable, the file could have been enqueued before the budget was lowered
+
+    with Image.open(upload) as img:
         # Calculate aspect ratio, scale the image accordingly
         original_aspect_ratio = img.width / float(img.height)
         new_aspect_ratio = WIDTH / float(HEIGHT)
 
         if original_aspect_ratio > new_aspect_ratio:    # Wider than desired aspect ratio
             new_width = WIDTH
-            new_height = int(round(new_width / original_aspect_ratio))
+            new_height = max(1, int(round(new_width / original_aspect_ratio)))
         else:                                           # Taller than desired aspect ratio
             new_height = HEIGHT
-            new_width = int(round(new_height * original_aspect_ratio))
+            new_width = max(1, int(round(new_height * original_aspect_ratio)))
 
         new_img = Image.new('RGB', (WIDTH, HEIGHT), (255, 255, 255))
 
+        # JPEGs can be decoded directly at 1/2, 1/4 or 1/8 of their size: pick the smallest scale still larger than the target
+        img.draft('RGB', (new_width, new_height))
+
+        # Other formats are decoded at full size, but shrunk by an integer factor (cheap box filter) before the LANCZOS resize
+        factor = min(img.width // new_width, img.height // new_height)
+        if factor >= 2:
+            img = img.reduce(factor)
+
         # Center the original image on the new one. Resize the original image and paste it
         position = ((WIDTH - new_width) //   2, (HEIGHT - new_height) //   2)
         resized_img = img.resize((new_width, new_height), Image.LANCZOS)
         new_img.paste(resized_img, position)
 
-        # Save a new image with the same extension as the original and a UUID for its name
-        file_extension = image_form.filename.split('.')[-1]
-        new_filename = f'{uuid.uuid4()}.{file_extension}'
-        new_img.save(f'static/images/{new_filename}')
+    # The main file goes last: once it exists the image is complete (see store_upload())
+    save_variants(new_img, filename)
+    new_img.save(f'{IMAGES_DIR}/{filename}')
 
-        return new_filename
-    except Exception as e:
-        print("ERROR", e)
-        raise ImageException(image_form.filename)
+def save_variants(img, filename):
+    """
+    Saves the smaller copies of a processed image and a WebP version of each size, full size included
+
+    :param img: the processed image, WIDTH x HEIGHT
+    :param filename: name of the processed image file
+    """
+    stem, extension = filename.rsplit('.', 1)
+
+    img.save(f'{IMAGES_DIR}/{stem}.webp', quality=WEBP_QUALITY)
+
+    for width in VARIANT_WIDTHS:
+        variant = img.resize((width, width * HEIGHT // WIDTH), Image.LANCZOS)
+        variant.save(f'{IMAGES_DIR}/{stem}-{width}.{extension}')
+        variant.save(f'{IMAGES_DIR}/{stem}-{width}.webp', quality=WEBP_QUALITY)
+
+def get_variant_names(filename):
+    """
+    :param filename: name of a processed image file
+    :returns: a list of (width, name, webp name) tuples for all the sizes of the image, from the smallest to the full size one
+    """
+    stem, extension = filename.rsplit('.', 1)
+
+    variants = [(width, f'{stem}-{width}.{extension}', f'{stem}-{width}.webp') for width in VARIANT_WIDTHS]
+    variants.append((WIDTH, filename, f'{stem}.webp'))
+
+    return variants
+
+def get_srcsets(filename):
+    """
+    Builds the srcset attributes of an image. Images saved before the variants were introduced only have the full size file:
+    for them no srcset is returned, so the page falls back to the plain src
+
+    :param filename: name of a processed image file
+    :returns: a dict with the 'srcset' of the original format and the 'webp' one, both None if the variants don't exist
+    """
+    variants = get_variant_names(filename)
+
+    if not all(os.path.isfile(f'{IMAGES_DIR}/{name}') and os.path.isfile(f'{IMAGES_DIR}/{webp}') for _, name, webp in variants):
+        return {'srcset': None, 'webp': None}
+
+    return {
+        'srcset': ', '.join(f"{url_for('static', filename='images/' + name)} {width}w" for width, name, _ in variants),
+        'webp': ', '.join(f"{url_for('static', filename='images/' + webp)} {width}w" for width, _, webp in variants),
+    }
+
+def get_image_stem(filename):
+    """
+    :param filename: name of a file in IMAGES_DIR
+    :returns: the name shared by all the files of an image (main file, smaller and WebP copies), without size suffix and extension
+    """
+    stem = filename.rsplit('.', 1)[0]
+    base, _, suffix = stem.rpartition('-')
+
+    return base if base and suffix in _VARIANT_SUFFIXES else stem
+
+def list_images():
+    """
+    Groups the files in IMAGES_DIR by image
 
-def delete_images(path_list):
-    for image_path in path_list:
+    :returns: a dict mapping the stem of each image (see get_image_stem()) to the list of its files, sorted by stem
+    """
+    images = {}
+
+    for filename in os.listdir(IMAGES_DIR):
+        if not filename.startswith('.'):
+            images.setdefault(get_image_stem(filename), []).append(filename)
+
+    return dict(sorted(images.items()))
+
+def delete_uploads(uploads):
+    """
+    Deletes the raw files of uploads that won't be processed
+
+    :param uploads: a list of (filename, upload) tuples, as returned by store_upload()
+    """
+    for _, upload in uploads:
         try:
-            full_path = f'static/images/{image_path}'
-            if os.path.isfile(full_path):
-                os.remove(full_path)
-            else:
-                print(f"File not found: {full_path}")
+            if upload is not None and os.path.isfile(upload):
+                os.remove(upload)
         except Exception as e:
             print('ERROR', str(e))
+
+# FLASK CLI
+
+cli = AppGroup('images', help='Gestione delle immagini degli annunci')
+
+@cli.command('variants')
+def variants_command():
+    """
+    Generates the missing smaller and WebP copies of the saved images
+    """
+    for filename in sorted(os.listdir(IMAGES_DIR)):
+        stem, extension = os.path.splitext(filename)
+
+        # Skip the variants themselves
+        if extension == '.webp' or get_image_stem(filename) != stem:
+            continue
+
+        if all(os.path.isfile(f'{IMAGES_DIR}/{name}') and os.path.isfile(f'{IMAGES_DIR}/{webp}') for _, name, webp in get_variant_names(filename)):
+            continue
+
+        try:
+            with Image.open(f'{IMAGES_DIR}/{filename}') as img:
+                save_variants(img.convert('RGB'), filename)
+            click.echo(f'Generate le varianti di {filename}')
+        except Exception as e:
+            click.echo(f'Errore durante la generazione delle varianti di {filename}: {e}')
+
+def init_app(app):
+    """
+    Registers the "flask images" commands and the srcset template helper on a Flask app, and caps the size of the requests
+    """
+    app.request_class = UploadRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGES * MAX_IMAGE_BYTES + MAX_FORM_MEMORY_SIZE
+    app.after_request(set_images_cache)
+    app.cli.add_command(cli)
+    app.jinja_env.globals['image_srcsets'] = get_srcsets
+
+def set_images_cache(response):
+    """
+    Lets browsers and proxies cache the images without revalidating them
+    """
+    if request.path.startswith(f'/{IMAGES_DIR}/') and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGES_CACHE_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+
+    return response
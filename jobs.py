@@ -0,0 +1,332 @@
+import os
+import time
+import threading
+import queue
+import multiprocessing
+import click
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import db
+import page_cache
+import image_handler
+import writer
+
+# Background processing of the uploaded images. The upload routes only store the raw files and insert a row in IMAGE_JOB,
+# a dispatcher thread claims the pending rows and hands them to a pool of worker processes, so decoding and resizing never block a request.
+# Jobs are claimed atomically in the database: any number of processes can run a dispatcher on the same table
+
+WORKERS = 2             # Worker processes decoding images
+POLL_INTERVAL = 5       # Seconds between checks for jobs enqueued by other processes
+LEASE = 300             # Seconds after which a running job is considered abandoned (e.g. its process died) and is run again
+MAX_ATTEMPTS = 3        # Jobs failing this many times are marked as failed and left alone
+
+# The dispatcher also deletes the images no advertisement references anymore (failed uploads, replaced images, crashes),
+# going through IMAGES_DIR a batch at a time
+SWEEP_INTERVAL = 60     # Seconds between two batches
+SWEEP_BATCH = 200       # Images checked per batch
+GRACE = 3600            # Files modified in the last GRACE seconds are never deleted: their reference may not be committed yet
+
+_workers = WORKERS
+_wakeup = threading.Event()
+_done = queue.Queue()   # (job id, path, upload, error) tuples of the jobs completed by the workers
+_dispatcher = None
+_sweep_pending = []     # (stem, files) tuples of the images left to check in the current pass of the sweeper
+
+def insert_jobs(cursor, pictures):
+    """
+    Enqueues the processing of a set of uploaded pictures. Meant to be run in the same transaction inserting the pictures in PICTURES
+
+    :param cursor: cursor of the transaction
+    :param pictures: a list of (filename, upload) tuples, as returned by image_handler.store_upload().
+        Images already processed (no upload) or already being processed are skipped
+    """
+    now = datetime.now()
+    jobs = [(filename, upload, now, filename) for filename, upload in pictures if upload is not None]
+
+    sql = """
+        INSERT INTO IMAGE_JOB(path, upload, status, created)
+        SELECT ?, ?, 'pending', ?
+        WHERE NOT EXISTS (SELECT 1 FROM IMAGE_JOB WHERE path = ? AND status IN ('pending', 'running'))
+    """
+    cursor.executemany(sql, jobs)
+
+def wake():
+    """
+    Tells the dispatcher of this process that new jobs were committed
+    """
+    _wakeup.set()
+
+def start():
+    """
+    Starts the dispatcher thread of this process, if not already running
+    """
+    global _dispatcher
+
+    if _dispatcher is not None and _dispatcher.is_alive():
+        return
+
+    _dispatcher = threading.Thread(target=_dispatch, name='image-jobs', daemon=True)
+    _dispatcher.start()
+
+def _dispatch():
+    pool = _new_pool()
+    conn = db.connect(readonly=True)    # For the polls and the sweeper, the jobs are claimed and finished through the writer thread
+    running = 0
+    next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    while True:
+        try:
+            while not _done.empty():
+                finish_job(*_done.get())
+                running -= 1
+
+            # Most polls find nothing to do: they are answered by the read-only connection, without a turn of the writer thread
+            claimed = writer.execute(claim_jobs, limit=_workers - running) if running < _workers and has_jobs(conn) else []
+            for job in claimed:
+                running += 1
+
+                try:
+                    future = pool.submit(image_handler.process_image, job['upload'], job['path'])
+                except BrokenProcessPool as e:
+                    # A worker process died (e.g. killed decoding a huge image): the jobs it was running fail through their futures,
+                    # this one is failed here. All of them count as an attempt, and the pool is replaced for the following ones
+                    print('ERROR', str(e))
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = _new_pool()
+
+                    _done.put((job['id'], job['path'], job['upload'], str(e)))
+                    _wakeup.set()
+                    continue
+
+                future.add_done_callback(lambda future, job=job: _on_done(job, future))
+
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + SWEEP_INTERVAL
+                sweep(conn)
+        except Exception as e:
+            print('ERROR', str(e))
+
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+def _new_pool():
+    # Spawned rather than forked workers: forking a process running other threads can deadlock the child
+    return ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+
+def _on_done(job, future):
+    # Runs in a thread of the pool: hand the result to the dispatcher
+    error = future.exception()
+    _done.put((job['id'], job['path'], job['upload'], None if error is None else str(error) or repr(error)))
+    _wakeup.set()
+
+def has_jobs(conn):
+    """
+    Checks if there are jobs to claim, pending or running with an expired lease, reading the IMAGE_JOB_status index
+
+    :param conn: a read-only connection
+    :returns: True if claim_jobs() would claim at least one job
+    """
+    sql = """
+        SELECT 1
+        FROM IMAGE_JOB
+        WHERE status = 'pending' OR (status = 'running' AND started < ?)
+        LIMIT 1;
+    """
+    return conn.execute(sql, (datetime.now() - timedelta(seconds=LEASE),)).fetchone() is not None
+
+def claim_jobs(conn, limit):
+    """
+    Marks up to limit jobs as running and returns them. Pending jobs come first, followed by running ones whose lease expired.
+    A writer operation, see writer.execute()
+
+    :returns: a list of jobs
+    """
+    if limit <= 0:
+        return []
+
+    now = datetime.now()
+
+    sql = """
+        UPDATE IMAGE_JOB
+        SET status = 'running', started = ?, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id
+            FROM IMAGE_JOB
+            WHERE status = 'pending' OR (status = 'running' AND started < ?)
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id, path, upload;
+    """
+    return [dict(row) for row in conn.execute(sql, (now, now - timedelta(seconds=LEASE), limit))]
+
+def finish_job(id, path, upload, error):
+    """
+    Records the outcome of a job. Processed pictures are marked as ready and their raw upload deleted,
+    failed ones are retried up to MAX_ATTEMPTS times, then their pictures are removed from the advertisements
+    """
+    if error is not None:
+        print('ERROR', f'processing {path}:', error)
+
+        # The same file uploaded again while an earlier job of the image was finishing: that job deleted the upload
+        # shared by both, after saving the image. Nothing is left to do
+        if os.path.isfile(f'{image_handler.IMAGES_DIR}/{path}'):
+            error = None
+
+    try:
+        failed = writer.execute(_record_job, id, path, error)
+    except Exception as e:
+        print('ERROR', str(e))
+        return
+
+    if error is None or failed:
+        page_cache.invalidate()     # The listings can now show the picture, or don't wait for it anymore
+
+    if error is None and os.path.isfile(upload):
+        os.remove(upload)
+
+def _record_job(conn, id, path, error):
+    # Runs in the writer thread, see writer.execute(). Returns True if the job failed for good
+    if error is None:
+        conn.execute('UPDATE PICTURES SET ready = TRUE WHERE path = ?', (path,))
+        conn.execute('DELETE FROM IMAGE_JOB WHERE id = ?', (id,))
+
+        return False
+
+    sql = """
+        UPDATE IMAGE_JOB
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?
+        WHERE id = ?
+        RETURNING status
+    """
+    rows = conn.execute(sql, (MAX_ATTEMPTS, error, id)).fetchall()
+    if not rows or rows[0]['status'] != 'failed':
+        return False
+
+    # The picture would never be ready: it is dropped from its advertisements rather than left pending forever.
+    # The job stays, with its error, and keeps the sweeper off the upload
+    conn.execute('DELETE FROM PICTURES WHERE path = ? AND NOT ready', (path,))
+
+    return True
+
+def sweep(conn):
+    """
+    Checks the next SWEEP_BATCH images for references, deleting the orphaned ones. Each pass over IMAGES_DIR starts
+    from a fresh listing of the directory, and also cleans UPLOADS_DIR
+
+    :returns: the stems of the deleted images
+    """
+    global _sweep_pending
+
+    if not _sweep_pending:
+        _sweep_pending = list(image_handler.list_images().items())
+        sweep_uploads(conn)
+
+    batch = dict(_sweep_pending[:SWEEP_BATCH])
+    del _sweep_pending[:SWEEP_BATCH]
+
+    return sweep_images(conn, batch)
+
+def sweep_images(conn, images, grace=GRACE):
+    """
+    Deletes the images no picture or job references, variants included
+
+    :param conn: database connection
+    :param images: a dict mapping image stems to their files, a slice of image_handler.list_images()
+    :param grace: files modified in the last grace seconds are kept
+    :returns: the stems of the deleted images
+    """
+    if not images:
+        return []
+
+    # The images are sorted: a range scan on the path indexes finds all the references of the batch
+    low, high = min(images), max(images) + '\U0010ffff'
+
+    sql = """
+        SELECT path FROM PICTURES WHERE path >= ? AND path < ?
+        UNION
+        SELECT path FROM IMAGE_JOB WHERE path >= ? AND path < ?
+    """
+    referenced = {image_handler.get_image_stem(row['path']) for row in conn.execute(sql, (low, high, low, high))}
+
+    deleted = []
+    oldest = time.time() - grace
+
+    for stem, files in images.items():
+        if stem in referenced:
+            continue
+
+        try:
+            paths = [f'{image_handler.IMAGES_DIR}/{name}' for name in files]
+            if any(os.path.getmtime(path) > oldest for path in paths):
+                continue
+
+            for path in paths:
+                os.remove(path)
+            deleted.append(stem)
+        except Exception as e:
+            print('ERROR', str(e))
+
+    return deleted
+
+def sweep_uploads(conn, grace=GRACE):
+    """
+    Deletes the raw uploads with no job, left behind by failed requests or interrupted saves
+
+    :param conn: database connection
+    :param grace: files modified in the last grace seconds are kept
+    :returns: the names of the deleted files
+    """
+    if not os.path.isdir(image_handler.UPLOADS_DIR):
+        return []
+
+    referenced = {row['upload'] for row in conn.execute('SELECT upload FROM IMAGE_JOB')}
+
+    deleted = []
+    oldest = time.time() - grace
+
+    for name in os.listdir(image_handler.UPLOADS_DIR):
+        upload = f'{image_handler.UPLOADS_DIR}/{name}'
+
+        try:
+            if upload not in referenced and os.path.getmtime(upload) <= oldest:
+                os.remove(upload)
+                deleted.append(name)
+        except Exception as e:
+            print('ERROR', str(e))
+
+    return deleted
+
+# FLASK CLI
+
+@image_handler.cli.command('gc')
+@click.option('--grace', default=GRACE, show_default=True, help='Secondi per cui i file appena modificati vengono mantenuti')
+def gc_command(grace):
+    """
+    Deletes all the images and raw uploads no advertisement references
+    """
+    conn = db.connect(readonly=True)
+
+    try:
+        images = list(image_handler.list_images().items())
+        deleted = []
+
+        for start in range(0, len(images), SWEEP_BATCH):
+            deleted += sweep_images(conn, dict(images[start:start + SWEEP_BATCH]), grace)
+
+        uploads = sweep_uploads(conn, grace)
+    finally:
+        conn.close()
+
+    click.echo(f'Eliminate {len(deleted)} immagini e {len(uploads)} caricamenti non utilizzati')
+
+def init_app(app):
+    """
+    Configures the job dispatcher for a Flask app, from its IMAGE_WORKERS setting. The dispatcher is started by start(),
+    in each process serving the app
+    """
+    global _workers
+
+    _workers = app.config.get('IMAGE_WORKERS', WORKERS)
@@ -0,0 +1,309 @@
+import array
+import heapq
+import threading
+import time
+
+import db
+
+try:
+    import numpy
+except ImportError:     # Optional: without it the same queries run in pure Python, fine for a few thousand advertisements
+    numpy = None
+
+# In-memory index of the listed advertisements (available, with pictures), used by the filtered home pages: filters not matching
+# the ordering would make the database scan most of LISTING_CARD. The columns are stored in compact arrays, 19 bytes per advertisement,
+# which NumPy filters in place. Queries only return the ids of a page, the cards themselves are read from LISTING_CARD.
+# Changes made by this process are applied right away by update(), the ones made by other processes show up
+# when the index is rebuilt, every REBUILD_INTERVAL seconds. Until then, advertisements no longer listed are dropped
+# from the index as soon as a query returns them (see ads.get_public_ads())
+
+REBUILD_INTERVAL = 60   # Seconds an index is used for before being rebuilt from the database
+TYPES = ('detached', 'flat', 'loft', 'villa')   # House types are stored as their position in this tuple
+
+# Sort keys and ids are packed in a single 64 bit integer, (key << 32) | id, so that (key, id) orderings and keyset cursors
+# are a single integer comparison. Ids must fit in 32 bits, rents in cents in 31
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+MAX_CENTS = (1 << 31) - 1
+
+class ListingIndex:
+    """
+    Column-wise index of advertisements. Not thread safe, see query() and update() for the shared one
+    """
+    def __init__(self):
+        self.ids = array.array('q')
+        self.cents = array.array('q')       # Rent in cents
+        self.rooms = array.array('b')
+        self.types = array.array('b')       # Position in TYPES, -1 for unknown types
+        self.furniture = array.array('b')
+        self.positions = {}                 # id -> position in the arrays
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set(self, id, rent, rooms, house_type, furniture):
+        """
+        Adds an advertisement to the index, or replaces it. Advertisements whose values don't fit the arrays are left out
+        (removed if already present), so that a single one can't break the whole index
+
+        :param rent: the rent, in euros
+        :param house_type: the type in the DB format
+        :returns: True if the advertisement is in the index, False if it was left out
+        """
+        try:
+            cents = round(rent * 100)
+        except (TypeError, ValueError, OverflowError):  # NULL, NaN or infinite rent
+            cents = None
+
+        if cents is None or not 0 <= cents <= MAX_CENTS or not 0 <= id <= ID_MASK or not -128 <= rooms <= 127:
+            print('ERROR', f'Advertisement {id} left out of the listing index: values out of range')
+            self.remove(id)
+
+            return False
+
+        values = (id, cents, rooms, TYPES.index(house_type) if house_type in TYPES else -1, bool(furniture))
+        position = self.positions.get(id)
+
+        if position is None:
+            self.positions[id] = len(self.ids)
+            for column, value in zip(self.columns(), values):
+                column.append(value)
+        else:
+            for column, value in zip(self.columns(), values):
+                column[position] = value
+
+        return True
+
+    def remove(self, id):
+        """
+        Removes an advertisement from the index, if present. The last advertisement takes its place in the arrays
+        """
+        position = self.positions.pop(id, None)
+        if position is None:
+            return
+
+        last = len(self.ids) - 1
+        if position != last:
+            for column in self.columns():
+                column[position] = column[last]
+            self.positions[self.ids[position]] = position
+
+        for column in self.columns():
+            column.pop()
+
+    def columns(self):
+        return (self.ids, self.cents, self.rooms, self.types, self.furniture)
+
+    def query(self, sort, descending, limit, after=None, rent_min=None, rent_max=None, rooms=None, house_type=None, furniture=None):
+        """
+        Filters and sorts the advertisements, and returns the first ones
+
+        :param sort: 'price' or 'rooms'. Ties are broken by id, in the same direction
+        :param descending: whether the advertisements are sorted in descending order
+        :param limit: the maximum number of ids returned
+        :param after: a (sort key, id) tuple, only the advertisements following it in the ordering are returned. None to start from the first one
+        :param rent_min: minimum rent in euros, inclusive. None, like all the following filters, to disable it
+        :param rent_max: maximum rent in euros, inclusive
+        :param rooms: exact number of rooms
+        :param house_type: house type in the DB format
+        :param furniture: True for furnished houses only, False for unfurnished ones
+        :returns: the ids, in order
+        :raise ValueError: exception raised when after isn't a valid (sort key, id) tuple
+        """
+        bounds = (
+            None if rent_min is None else round(rent_min * 100),
+            None if rent_max is None else round(rent_max * 100),
+            rooms,
+            None if house_type is None else (TYPES.index(house_type) if house_type in TYPES else -2),    # -2 matches nothing
+            None if furniture is None else bool(furniture),
+        )
+
+        last = None
+        if after is not None:
+            key, id = after
+            if not isinstance(key, (int, float)) or not isinstance(id, int) or not 0 <= id <= ID_MASK:
+                raise ValueError('Malformed cursor')
+
+            try:
+                last = ((round(key * 100) if sort == 'price' else int(key)) << ID_BITS) | id
+            except (ValueError, OverflowError):     # NaN or infinite key
+                raise ValueError('Malformed cursor')
+
+            last = min(max(last, -2 ** 63), 2 ** 63 - 1)    # Keys out of range come before or after everything, and keep fitting NumPy's int64
+
+        if numpy is not None:
+            return self.query_numpy(sort, descending, limit, last, *bounds)
+
+        return self.query_python(sort, descending, limit, last, *bounds)
+
+    def query_numpy(self, sort, descending, limit, last, cents_min, cents_max, rooms, house_type, furniture):
+        # Zero-copy views over the arrays: they must not outlive the call, arrays exporting a buffer can't grow
+        ids = numpy.frombuffer(self.ids, dtype=numpy.int64)
+        cents = numpy.frombuffer(self.cents, dtype=numpy.int64)
+        room_counts = numpy.frombuffer(self.rooms, dtype=numpy.int8)
+
+        conditions = []
+        if cents_min is not None:
+            conditions.append(cents >= cents_min)
+        if cents_max is not None:
+            conditions.append(cents <= cents_max)
+        if rooms is not None:
+            conditions.append(room_counts == rooms)
+        if house_type is not None:
+            conditions.append(numpy.frombuffer(self.types, dtype=numpy.int8) == house_type)
+        if furniture is not None:
+            conditions.append(numpy.frombuffer(self.furniture, dtype=numpy.int8) == furniture)
+
+        # The sort keys are only packed for the matching advertisements
+        sort_column = cents if sort == 'price' else room_counts
+        if conditions:
+            positions = numpy.flatnonzero(numpy.logical_and.reduce(conditions))    # Several times faster than indexing with the mask
+            ids, sort_column = ids.take(positions), sort_column.take(positions)
+
+        keys = (sort_column.astype(numpy.int64) << ID_BITS) | ids
+        if last is not None:
+            keys = keys.take(numpy.flatnonzero((keys < last) if descending else (keys > last)))
+
+        if descending:
+            keys = -keys
+
+        # Top-k selection: only the first limit keys are sorted
+        if limit < len(keys):
+            keys = numpy.partition(keys, limit - 1)[:limit]
+        keys = numpy.sort(keys)
+
+        if descending:
+            keys = -keys
+
+        return (keys & ID_MASK).tolist()
+
+    def query_python(self, sort, descending, limit, last, cents_min, cents_max, rooms, house_type, furniture):
+        sort_column = self.cents if sort == 'price' else self.rooms
+        keys = []
+
+        for i in range(len(self.ids)):
+            if cents_min is not None and self.cents[i] < cents_min:
+                continue
+            if cents_max is not None and self.cents[i] > cents_max:
+                continue
+            if rooms is not None and self.rooms[i] != rooms:
+                continue
+            if house_type is not None and self.types[i] != house_type:
+                continue
+            if furniture is not None and self.furniture[i] != furniture:
+                continue
+
+            key = (sort_column[i] << ID_BITS) | self.ids[i]
+            if last is not None and (key >= last if descending else key <= last):
+                continue
+
+            keys.append(key)
+
+        keys = heapq.nlargest(limit, keys) if descending else heapq.nsmallest(limit, keys)
+
+        return [key & ID_MASK for key in keys]
+
+_lock = threading.Lock()
+_index = None
+_built = 0              # time.monotonic() of the last build
+_updates = None         # While a rebuild runs: the rows applied by update() meanwhile, by id. The new index may have been read before them
+
+def query(*args, **kwargs):
+    """
+    Queries the index of the listed advertisements. Same parameters as ListingIndex.query().
+    The first query builds the index. Once it is older than REBUILD_INTERVAL, one query rebuilds it while the others keep using the old one
+
+    :returns: the ids, in order
+    """
+    global _index, _built, _updates
+
+    with _lock:
+        if _index is None:
+            _index = build()
+            _built = time.monotonic()
+
+        if time.monotonic() - _built <= REBUILD_INTERVAL:
+            return _index.query(*args, **kwargs)
+
+        _built = time.monotonic()   # Claims the rebuild
+        _updates = {}
+
+    try:
+        index = build()
+    except Exception:
+        with _lock:
+            _updates = None
+        raise
+
+    with _lock:
+        for advertisement_id, row in _updates.items():
+            apply(index, advertisement_id, row)
+
+        _index = index
+        _updates = None
+
+        return _index.query(*args, **kwargs)
+
+def update(advertisement_id):
+    """
+    Reads an advertisement again from the database. Called by this process after committing changes to it,
+    and for the advertisements the index returned but are no longer listed
+    """
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT rent, rooms, type, furniture, available AND has_pictures AS listed FROM LISTING_CARD WHERE ADVERTISEMENT_id = ?', (advertisement_id,))
+    row = cursor.fetchone()
+
+    cursor.close()
+
+    with _lock:
+        if _index is None:
+            return      # Built from scratch by the next query
+
+        if _updates is not None:
+            _updates[advertisement_id] = row    # Applied again to the index being built
+
+        apply(_index, advertisement_id, row)
+
+def apply(index, advertisement_id, row):
+    """
+    :param row: the row of the advertisement read by update(), None if it doesn't exist anymore
+    """
+    if row is not None and row['listed']:
+        index.set(advertisement_id, row['rent'], row['rooms'], row['type'], row['furniture'])
+    else:
+        index.remove(advertisement_id)
+
+def build():
+    """
+    Reads the listed advertisements from the database
+
+    :returns: a new ListingIndex
+    """
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT ADVERTISEMENT_id, rent, rooms, type, furniture
+        FROM LISTING_CARD
+        WHERE available AND has_pictures;
+    """)
+
+    index = ListingIndex()
+    for row in cursor:
+        index.set(*row)
+
+    cursor.close()
+
+    return index
+
+def init_worker():
+    """
+    Forgets the index of the parent process. Called in each worker after a fork, the index is built again by the first query
+    """
+    global _lock, _index, _updates
+
+    _lock = threading.Lock()
+    _index = None
+    _updates = None
@@ -0,0 +1,120 @@
+import os
+import re
+import sqlite3
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+
+import db
+
+MIGRATIONS_DIR = 'database/migrations'
+
+# Migration files are named NNNN_description.sql, they are applied in ascending order of NNNN
+MIGRATION_REGEX = r'^(\d{4})_(\w+)\.sql$'
+
+def get_migrations(directory=MIGRATIONS_DIR):
+    """
+    Lists the migration scripts shipped with the application
+
+    :returns: a list of (version, name, path) tuples, sorted by version
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = re.match(MIGRATION_REGEX, filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+
+    return sorted(migrations)
+
+def upgrade(path=None, directory=MIGRATIONS_DIR):
+    """
+    Applies all the migrations that haven't been applied to the database yet. Each migration runs in its own transaction,
+    together with the insertion of its version in the SCHEMA_VERSION table: a failing migration leaves the database untouched
+
+    :param path: path of the SQLite database file, the configured one if None
+    :param directory: directory containing the migration scripts
+    :returns: a list of the (version, name) of the applied migrations
+    """
+    conn = db.connect(path)
+    conn.isolation_level = None     # Transactions are handled manually
+
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied DATETIME NOT NULL
+            )
+        """)
+
+        applied = []
+        for version, name, file in get_migrations(directory):
+            # The write lock is taken before checking the version, so concurrent upgrades (e.g. several workers starting up) can't apply a migration twice
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM SCHEMA_VERSION WHERE version = ?', (version,)).fetchone() is not None:
+                    conn.execute('ROLLBACK')
+                    continue
+
+                with open(file, encoding='utf-8') as f:
+                    for statement in split_statements(f.read()):
+                        conn.execute(statement)
+
+                conn.execute('INSERT INTO SCHEMA_VERSION(version, name, applied) VALUES(?, ?, ?)', (version, name, datetime.now()))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+            applied.append((version, name))
+
+        return applied
+    finally:
+        conn.close()
+
+def split_statements(script):
+    """
+    Splits an SQL script into single statements. Statements containing semicolons, like trigger bodies, are kept whole
+
+    :param script: the SQL script
+    :returns: a list of statements
+    """
+    statements = []
+    current = ''
+
+    for line in script.splitlines(keepends=True):
+        if not current and (line.strip() == '' or line.strip().startswith('--')):
+            continue
+
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+
+    if current.strip():
+        raise Exception('Incomplete statement in migration script')
+
+    return statements
+
+# FLASK CLI
+
+cli = AppGroup('db', help='Gestione del database')
+
+@cli.command('upgrade')
+def upgrade_command():
+    """
+    Applies the pending migrations to the database
+    """
+    applied = upgrade()
+
+    if len(applied) == 0:
+        click.echo('Il database è già aggiornato')
+
+    for version, name in applied:
+        click.echo(f'Applicata la migrazione {version:04d}_{name}')
+
+def init_app(app):
+    """
+    Registers the "flask db" commands on a Flask app
+    """
+    app.cli.add_command(cli)
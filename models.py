@@ -1,13 +1,27 @@
-from flask_login import UserMixin
+class User:
+    """
+    The logged in user, as seen by Flask-Login. Built on every authenticated request, so it only holds the profile
+    fields the pages need: the password hash never leaves user_db
+    """
+    __slots__ = ('id', 'username', 'email', 'name', 'landlord')
 
-class User(UserMixin):
-    def __init__(self, username, email, password, name, landlord):
+    # Attributes required by Flask-Login. Every user is active, anonymous users are represented by Flask-Login's AnonymousUserMixin
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, username, email, name, landlord):
         self.id = username
         self.username = username
         self.email = email
-        self.password = password
         self.name = name
         self.landlord = landlord
-        
+
     def get_id(self):
-        return self.id
\ No newline at end of file
+        return self.id
+
+    def __eq__(self, other):
+        return isinstance(other, User) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+
+# Server side cache of rendered pages. Entries are dropped all at once by invalidate(), called whenever the cached data changes.
+# The TTL bounds how stale a page can get when the change happens in another process, which can't invalidate this one's cache
+
+TTL = 60                # Seconds an entry is served for
+MAX_ENTRIES = 512       # Once reached, the oldest entries are dropped first
+BUILD_TIMEOUT = 10      # Seconds a request waits for another one to render the same page, before trying itself
+
+_lock = threading.Lock()
+_entries = {}           # key -> (expires, body, etag). Dicts keep insertion order, the first key is the oldest entry
+_building = {}          # key -> threading.Event set once the request rendering the page is done
+_generation = 0         # Incremented by invalidate(), pages rendered before an invalidation are not stored
+
+def get_or_render(key, render):
+    """
+    Returns a cached page, rendering it if missing. Only one request at a time renders a given page:
+    concurrent requests for it wait for the result instead of rendering it again (single flight)
+
+    :param key: hashable key identifying the page
+    :param render: function with no parameters returning the page body as a string. Exceptions are propagated to the caller
+    :returns: a (body, etag) tuple
+    """
+    while True:
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1], entry[2]
+
+            event = _building.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                _building[key] = event
+                generation = _generation
+
+        if leader:
+            break
+
+        event.wait(BUILD_TIMEOUT)   # Then look again, the page is either cached or the rendering failed and someone else has to retry
+
+    try:
+        body = render()
+        etag = hashlib.sha256(body.encode()).hexdigest()
+
+        with _lock:
+            if generation == _generation:
+                _entries.pop(key, None)
+                _entries[key] = (time.monotonic() + TTL, body, etag)
+
+                while len(_entries) > MAX_ENTRIES:
+                    del _entries[next(iter(_entries))]
+
+        return body, etag
+    finally:
+        with _lock:
+            del _building[key]
+        event.set()
+
+def invalidate():
+    """
+    Drops all the cached pages. Pages being rendered while this is called are returned to their request but not cached
+    """
+    global _generation
+
+    with _lock:
+        _generation += 1
+        _entries.clear()
@@ -0,0 +1,90 @@
+import base64
+import json
+
+# Keyset pagination: instead of an OFFSET, each page link carries the sort key and id of the last (or first) row shown.
+# The next page is then fetched with a range condition on (sort key, id), which an index can answer without scanning the skipped rows
+
+NEXT = 'n'
+PREV = 'p'
+
+def encode_cursor(sort, key, id, direction=NEXT):
+    """
+    Builds an opaque cursor pointing after (or before) a row
+
+    :param sort: name of the ordering the cursor belongs to, used to reject cursors coming from a different ordering
+    :param key: value of the sort key of the row
+    :param id: id of the row, breaks ties between rows with the same sort key
+    :param direction: NEXT to fetch the rows following the given one, PREV to fetch the ones preceding it
+    :returns: a url-safe string
+    """
+    payload = json.dumps([sort, key, id, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort, key_size=None):
+    """
+    Parses a cursor built by encode_cursor(). The values are checked to be bindable to a query: numbers, or strings in composite keys
+
+    :param cursor: the cursor string
+    :param sort: the ordering the cursor is expected to belong to
+    :param key_size: None if the sort key is a single number, else the number of values of the composite key (a list)
+    :returns: a (key, id, direction) tuple
+    :raise ValueError: exception raised when the cursor is malformed or belongs to another ordering
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, key, id, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Malformed cursor')
+
+    if cursor_sort != sort or direction not in (NEXT, PREV):
+        raise ValueError('Cursor not matching the current ordering')
+
+    if key_size is None:
+        valid_key = is_number(key)
+    else:
+        valid_key = isinstance(key, list) and len(key) == key_size and all(isinstance(value, str) or is_number(value) for value in key)
+
+    if not valid_key or not is_int64(id):
+        raise ValueError('Malformed cursor')
+
+    return key, id, direction
+
+def is_int64(value):
+    """
+    :returns: True if value is an int fitting SQLite's 64 bit integers. Bools aren't ints here
+    """
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+def is_number(value):
+    return is_int64(value) or type(value) is float
+
+def paginate(rows, page_size, direction, has_cursor, make_cursor):
+    """
+    Trims a page fetched with one extra row and computes the links to the adjacent pages.
+    Rows fetched with a PREV cursor are expected in reverse order, they are flipped back
+
+    :param rows: the rows fetched by the query, up to page_size + 1
+    :param page_size: the number of rows in a page
+    :param direction: the direction of the cursor used to fetch the page
+    :param has_cursor: whether the page was fetched with a cursor, i.e. it isn't the first page
+    :param make_cursor: function building a cursor from a row and a direction
+    :returns: a (rows, next_cursor, prev_cursor) tuple, cursors are None when there is no adjacent page
+    """
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if direction == PREV:
+        rows.reverse()
+        has_next = True         # The page was reached going backwards, so there is at least the page we came from
+        has_prev = has_more
+    else:
+        has_next = has_more
+        has_prev = has_cursor
+
+    if len(rows) == 0:
+        return rows, None, None
+
+    next_cursor = make_cursor(rows[-1], NEXT) if has_next else None
+    prev_cursor = make_cursor(rows[0], PREV) if has_prev else None
+
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing is deliberately slow (scrypt takes ~100 ms of CPU per hash). It runs in a small pool of worker processes,
+# so a burst of logins can't hold the request threads and the GIL. Requests beyond MAX_PENDING are refused with a 503
+# rather than queued: the site keeps serving pages while logins are being shed
+
+# Hash method, in werkzeug's full "name:parameters" form: stored hashes with a different prefix are upgraded on the next login
+METHOD = 'scrypt:32768:8:1'
+WORKERS = 2             # Worker processes computing hashes
+MAX_PENDING = 8         # Hashes queued or running at the same time, across all the request threads
+TIMEOUT = 10            # Seconds a request waits for its hash
+RETRY_AFTER = 5         # Seconds suggested to the client when a request is refused
+
+_method = METHOD
+_workers = WORKERS
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_pool = None
+_pool_lock = threading.Lock()
+
+def hash_password(password):
+    """
+    Hashes a new password with the configured method
+
+    :returns: the hash, to be stored in the database
+    :raise ServiceUnavailable: exception raised when too many hashes are pending
+    """
+    return _run(generate_password_hash, password, _method)
+
+def check_password(pwhash, password):
+    """
+    Checks a password against its stored hash. If the hash was made with other parameters than the configured ones,
+    the password is hashed again in the same round trip to the workers
+
+    :returns: a (valid, new_hash) tuple. new_hash is None unless the password is valid and its hash should be replaced
+    :raise ServiceUnavailable: exception raised when too many hashes are pending
+    """
+    return _run(_check_and_rehash, pwhash, password, _method)
+
+def needs_rehash(pwhash, method=None):
+    """
+    :returns: True if a stored hash wasn't made with the configured method and parameters
+    """
+    return pwhash.split('$', 1)[0] != (method or _method)
+
+def _check_and_rehash(pwhash, password, method):
+    # Runs in a worker process
+    if not check_password_hash(pwhash, password):
+        return False, None
+
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method)
+
+    return True, None
+
+def _run(function, *args):
+    # A worker process dying (e.g. killed for lack of memory) breaks the whole pool: it is replaced, and the hash tried once more
+    for _ in range(2):
+        pool = _get_pool()
+
+        try:
+            return _submit(pool, function, *args)
+        except BrokenProcessPool as e:
+            print('ERROR', str(e))
+            _discard_pool(pool)
+
+    raise ServiceUnavailable('Troppe richieste di accesso in corso, riprova tra qualche secondo', retry_after=RETRY_AFTER)
+
+def _submit(pool, function, *args):
+    if not _pending.acquire(blocking=False):
+        raise ServiceUnavailable('Troppe richieste di accesso in corso, riprova tra qualche secondo', retry_after=RETRY_AFTER)
+
+    try:
+        future = pool.submit(function, *args)
+    except Exception:
+        _pending.release()
+        raise
+
+    # The slot is given back when the hash is done, even if the request stopped waiting for it
+    future.add_done_callback(lambda future: _pending.release())
+
+    try:
+        return future.result(timeout=TIMEOUT)
+    except TimeoutError:
+        raise ServiceUnavailable('Troppe richieste di accesso in corso, riprova tra qualche secondo', retry_after=RETRY_AFTER)
+
+def _get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked workers: forking a process running other threads can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+
+        return _pool
+
+def _discard_pool(pool):
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:   # Not replaced yet by another request thread
+            _pool = None
+
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def init_worker():
+    """
+    Forgets the pool of the parent process. Called in each worker after a fork, the pool is started again on the first hash
+    """
+    global _pool, _pool_lock
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+def init_app(app):
+    """
+    Configures password hashing for a Flask app, from its PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS and PASSWORD_HASH_QUEUE settings.
+    The worker processes are started on the first hash
+    """
+    global _method, _workers, _pending
+
+    _method = app.config.get('PASSWORD_HASH_METHOD', METHOD)
+    _workers = app.config.get('PASSWORD_HASH_WORKERS', WORKERS)
+    _pending = threading.BoundedSemaphore(app.config.get('PASSWORD_HASH_QUEUE', MAX_PENDING))
@@ -0,0 +1,169 @@
+import functools
+import sqlite3
+import threading
+import time
+from flask import request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+# Token bucket rate limiting for the expensive routes (password hashing, bookings). Every client key (IP address, username)
+# has a bucket of `capacity` tokens refilled at `capacity / period` tokens per second, each request takes one.
+# Buckets are kept in the SQLite file at RATELIMIT_STORAGE, shared by all the worker processes of the app.
+# With an empty RATELIMIT_STORAGE they live in the memory of each process
+
+MAX_KEYS = 10000        # Buckets kept in memory. Once reached, the least recently used ones are dropped (a dropped bucket is a full one)
+CLEANUP_EVERY = 1000    # Requests between two removals of the full buckets from the SQLite store
+
+class MemoryStore:
+    """
+    Buckets of a single process, in a bounded LRU dict
+    """
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = {}       # key -> (tokens, updated). Dicts keep insertion order, the first key is the least recently used one
+
+    def take(self, key, capacity, rate, now):
+        """
+        Takes a token from a bucket
+
+        :param capacity: size of the bucket
+        :param rate: tokens added per second
+        :param now: current time, in seconds
+        :returns: the number of tokens missing for the request to be allowed, 0 if it was allowed
+        """
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                missing = 0
+            else:
+                missing = 1 - tokens
+
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                del self.buckets[next(iter(self.buckets))]
+
+            return missing
+
+class SQLiteStore:
+    """
+    Buckets shared by all the processes using the same SQLite file. Each token is taken with a single atomic statement
+    """
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.requests = 0
+
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('PRAGMA busy_timeout = 5000')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS BUCKET (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                full REAL NOT NULL     -- When the bucket is full again, from then on the row can be deleted
+            )
+        """)
+
+    def take(self, key, capacity, rate, now):
+        """
+        Same as MemoryStore.take()
+        """
+        # A missing bucket is full. An existing one is refilled, and only updated if it has a token to give
+        sql = """
+            INSERT INTO BUCKET(key, tokens, updated, full) VALUES (:key, :capacity - 1, :now, :now + 1 / :rate)
+            ON CONFLICT(key) DO UPDATE
+            SET tokens = MIN(:capacity, tokens + (:now - updated) * :rate) - 1,
+                updated = :now,
+                full = :now + (:capacity - MIN(:capacity, tokens + (:now - updated) * :rate) + 1) / :rate
+            WHERE MIN(:capacity, tokens + (:now - updated) * :rate) >= 1
+            RETURNING tokens;
+        """
+        params = {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+
+        with self.lock:
+            allowed = self.conn.execute(sql, params).fetchone() is not None
+
+            if allowed:
+                missing = 0
+            else:
+                tokens, updated = self.conn.execute('SELECT tokens, updated FROM BUCKET WHERE key = ?', (key,)).fetchone()
+                missing = 1 - min(capacity, tokens + (now - updated) * rate)
+
+            self.requests += 1
+            if self.requests % CLEANUP_EVERY == 0:
+                self.conn.execute('DELETE FROM BUCKET WHERE full < ?', (now,))
+
+        return missing
+
+_store = MemoryStore()
+_storage = None
+_enabled = True
+
+def limit(name, per_ip=None, per_user=None, user_field=None):
+    """
+    Decorator applying a rate limit to a route. Requests over the limit are refused with a 429 before the route runs
+
+    :param name: name of the limit, buckets aren't shared between limits with different names
+    :param per_ip: (requests, seconds) budget of each client IP address, None for no limit
+    :param per_user: (requests, seconds) budget of each user, None for no limit
+    :param user_field: form field holding the username (e.g. on the login form). If None the logged in user is used
+    """
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            if _enabled:
+                keys = []
+
+                if per_ip is not None:
+                    keys.append((f'{name}:ip:{request.remote_addr}', per_ip))
+
+                if per_user is not None:
+                    username = request.form.get(user_field) if user_field is not None else (current_user.username if current_user.is_authenticated else None)
+                    if username:
+                        keys.append((f'{name}:user:{username.lower()}', per_user))
+
+                check(keys)
+
+            return route(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def check(keys):
+    """
+    Takes a token from each bucket
+
+    :param keys: a list of (key, (requests, seconds)) tuples
+    :raise TooManyRequests: exception raised when one of the buckets is empty
+    """
+    now = time.time()
+    wait = 0
+
+    for key, (capacity, period) in keys:
+        rate = capacity / period
+        wait = max(wait, _store.take(key, capacity, rate, now) / rate)
+
+    if wait > 0:
+        raise TooManyRequests('Troppe richieste, riprova più tardi', retry_after=max(1, round(wait)))
+
+def init_worker():
+    """
+    Opens the store of the current process. Called in each worker after a fork: the SQLite connection can't be shared with the parent
+    """
+    global _store
+
+    _store = SQLiteStore(_storage) if _storage else MemoryStore()
+
+def init_app(app):
+    """
+    Configures rate limiting for a Flask app, from its RATELIMIT_ENABLED and RATELIMIT_STORAGE settings.
+    The store is opened by init_worker()
+    """
+    global _storage, _enabled
+
+    _enabled = app.config.get('RATELIMIT_ENABLED', True)
+    _storage = app.config.get('RATELIMIT_STORAGE')
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The tests run the app on a copy of database/database.db, with the migrations applied. Only the connections and the writer thread
+# are started: the image jobs, their sweeper and the password hashing pool stay off. Run them from the repository root: python -m pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+import app as app_module
+import db
+import listing_index
+import page_cache
+import writer
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)     # The app resolves its directories (images, uploads) relative to the working directory
+
+    path = str(tmp_path / 'database.db')
+    source = sqlite3.connect(os.path.join(ROOT, 'database', 'database.db'))
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    flask_app = app_module.create_app({'DATABASE': path, 'SECRET_KEY': 'test', 'RATELIMIT_ENABLED': False, 'PREFORK': True, 'TESTING': True})
+    db.init_worker()
+    writer.init_worker()
+    listing_index.init_worker()
+    page_cache.invalidate()     # Pages of the previous test's database
+
+    yield flask_app
+
+@pytest.fixture
+def conn(app):
+    """
+    A connection to the database of the app, to prepare and check the rows directly
+    """
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.row_factory = sqlite3.Row
+
+    yield conn
+
+    conn.close()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def login(client, username):
+    """
+    Logs a user of the sample database in, without going through the password check
+    """
+    with client.session_transaction() as session:
+        session['_user_id'] = username
+        session['_fresh'] = True
+
+def get_flashes(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import get_flashes, login
+
+@pytest.fixture
+def exception(conn):
+    conn.execute("INSERT INTO AVAILABILITY_EXCEPTION(ADVERTISEMENT_id, date, slots) VALUES (1, '2099-01-01', 0)")
+    conn.commit()
+
+def count_exceptions(conn):
+    return conn.execute('SELECT COUNT(*) FROM AVAILABILITY_EXCEPTION WHERE ADVERTISEMENT_id = 1').fetchone()[0]
+
+def test_delete_exception(client, conn, exception):
+    login(client, 'mario')      # Owner of advertisement 1
+
+    response = client.post('/advertisement/1/availability/exception/delete', data={'date': '2099-01-01'})
+
+    assert response.status_code == 302
+    assert get_flashes(client) == [('success', 'Disponibilità aggiornata con successo')]
+    assert count_exceptions(conn) == 0
+
+def test_delete_exception_other_landlord(client, conn, exception):
+    login(client, 'luigi_verdi')
+
+    client.post('/advertisement/1/availability/exception/delete', data={'date': '2099-01-01'})
+
+    assert get_flashes(client) == [('warning', "403 Forbidden: Non puoi modificare l'annuncio di un altro locatore")]
+    assert count_exceptions(conn) == 1
+
+def test_delete_exception_missing_advertisement(client):
+    login(client, 'mario')
+
+    client.post('/advertisement/99999/availability/exception/delete', data={'date': '2099-01-01'})
+
+    assert get_flashes(client) == [('warning', '404 Not Found: Nessun annuncio corrispondente trovato')]
+
+def test_delete_exception_unexpected_error(client, exception, monkeypatch):
+    import visits
+
+    def fail(**kwargs):
+        raise RuntimeError('unexpected')
+
+    monkeypatch.setattr(visits, 'delete_availability_exception', fail)
+    login(client, 'mario')
+
+    client.post('/advertisement/1/availability/exception/delete', data={'date': '2099-01-01'})
+
+    assert get_flashes(client) == [('danger', 'Errore interno durante il caricamento della pagina')]
@@ -0,0 +1,72 @@
+import image_handler
+import jobs
+
+def add_job(conn, path, attempts):
+    conn.execute("INSERT INTO PICTURES(path, ADVERTISEMENT_id, ready, position) VALUES (?, 1, FALSE, 9)", (path,))
+    id = conn.execute("INSERT INTO IMAGE_JOB(path, upload, status, attempts, created) VALUES (?, ?, 'running', ?, '2024-01-01 00:00:00')",
+                      (path, f'uploads/{path}', attempts)).lastrowid
+    conn.commit()
+
+    return id
+
+def test_finish_job(app, conn, tmp_path):
+    upload = tmp_path / 'upload.jpg'
+    upload.write_bytes(b'raw')
+    id = add_job(conn, 'done.jpg', 1)
+
+    with app.app_context():
+        jobs.finish_job(id, 'done.jpg', str(upload), None)
+
+    assert conn.execute("SELECT ready FROM PICTURES WHERE path = 'done.jpg'").fetchone()['ready'] == 1
+    assert conn.execute('SELECT 1 FROM IMAGE_JOB WHERE id = ?', (id,)).fetchone() is None
+    assert not upload.exists()
+
+def test_finish_job_retried(app, conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(image_handler, 'IMAGES_DIR', str(tmp_path))
+    id = add_job(conn, 'retried.jpg', 1)
+
+    with app.app_context():
+        jobs.finish_job(id, 'retried.jpg', str(tmp_path / 'missing.jpg'), 'broken')
+
+    assert conn.execute('SELECT status FROM IMAGE_JOB WHERE id = ?', (id,)).fetchone()['status'] == 'pending'
+    assert conn.execute("SELECT ready FROM PICTURES WHERE path = 'retried.jpg'").fetchone()['ready'] == 0
+
+def test_finish_job_upload_removed_by_earlier_job(app, conn, tmp_path, monkeypatch):
+    # The same file uploaded twice: the first job saved the image and deleted the upload the second one was meant to process
+    monkeypatch.setattr(image_handler, 'IMAGES_DIR', str(tmp_path))
+    (tmp_path / 'shared.jpg').write_bytes(b'processed')
+    id = add_job(conn, 'shared.jpg', jobs.MAX_ATTEMPTS)
+
+    with app.app_context():
+        jobs.finish_job(id, 'shared.jpg', str(tmp_path / 'missing.jpg'), 'No such file')
+
+    assert conn.execute("SELECT ready FROM PICTURES WHERE path = 'shared.jpg'").fetchone()['ready'] == 1
+    assert conn.execute('SELECT 1 FROM IMAGE_JOB WHERE id = ?', (id,)).fetchone() is None
+
+def test_finish_job_failed(app, conn, tmp_path, monkeypatch):
+    monkeypatch.setattr(image_handler, 'IMAGES_DIR', str(tmp_path))
+    id = add_job(conn, 'failed.jpg', jobs.MAX_ATTEMPTS)
+
+    with app.app_context():
+        jobs.finish_job(id, 'failed.jpg', str(tmp_path / 'missing.jpg'), 'broken')
+
+    job = conn.execute('SELECT status, error FROM IMAGE_JOB WHERE id = ?', (id,)).fetchone()
+    assert (job['status'], job['error']) == ('failed', 'broken')
+    assert conn.execute("SELECT 1 FROM PICTURES WHERE path = 'failed.jpg'").fetchone() is None     # Not left pending forever
+
+def test_has_jobs(app, conn):
+    import db
+
+    read = db.connect(app.config['DATABASE'], readonly=True)
+    assert not jobs.has_jobs(read)
+
+    id = add_job(conn, 'leased.jpg', 1)
+    conn.execute("UPDATE IMAGE_JOB SET started = datetime('now', 'localtime') WHERE id = ?", (id,))
+    conn.commit()
+    assert not jobs.has_jobs(read)      # Running, lease not expired
+
+    conn.execute("UPDATE IMAGE_JOB SET status = 'pending' WHERE id = ?", (id,))
+    conn.commit()
+    assert jobs.has_jobs(read)
+
+    read.close()
@@ -0,0 +1,38 @@
+import page_cache
+
+def test_get_or_render():
+    page_cache.invalidate()
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f'page {len(renders)}'
+
+    assert page_cache.get_or_render('key', render)[0] == 'page 1'
+    assert page_cache.get_or_render('key', render)[0] == 'page 1'
+
+    page_cache.invalidate()
+    body, etag = page_cache.get_or_render('key', render)
+    assert body == 'page 2' and etag != page_cache.get_or_render('other', render)[1]
+
+def test_invalidate_while_rendering():
+    page_cache.invalidate()
+
+    def render():
+        page_cache.invalidate()     # e.g. a job finishing while the page is rendered
+        return 'stale'
+
+    assert page_cache.get_or_render('key', render)[0] == 'stale'
+    assert page_cache.get_or_render('key', lambda: 'fresh')[0] == 'fresh'
+
+def test_finish_job_invalidates(app, conn):
+    import jobs
+
+    page_cache.get_or_render('home', lambda: 'without the picture')
+    id = conn.execute("INSERT INTO IMAGE_JOB(path, upload, status, attempts, created) VALUES ('p.jpg', 'uploads/p.jpg', 'running', 1, '2024-01-01')").lastrowid
+    conn.commit()
+
+    with app.app_context():
+        jobs.finish_job(id, 'p.jpg', 'uploads/missing.jpg', None)
+
+    assert page_cache.get_or_render('home', lambda: 'with the picture')[0] == 'with the picture'
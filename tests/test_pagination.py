@@ -0,0 +1,76 @@
+import pytest
+
+import pagination
+import visits
+from conftest import get_flashes
+
+@pytest.mark.parametrize('key, id', [
+    (850.0, 3),
+    (850, 3),
+    (-2 ** 63, 2 ** 63 - 1),
+])
+def test_decode_cursor_valid(key, id):
+    cursor = pagination.encode_cursor('price', key, id, pagination.PREV)
+
+    assert pagination.decode_cursor(cursor, 'price') == (key, id, pagination.PREV)
+
+@pytest.mark.parametrize('key, id', [
+    ([850], 3),
+    ({'rent': 850}, 3),
+    ('850', 3),
+    (True, 3),
+    (None, 3),
+    (2 ** 63, 3),
+    (850, [3]),
+    (850, {'id': 3}),
+    (850, 3.0),
+    (850, True),
+    (850, 2 ** 64),
+])
+def test_decode_cursor_malformed(key, id):
+    cursor = pagination.encode_cursor('price', key, id)
+
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, 'price')
+
+def test_decode_cursor_composite_key():
+    cursor = pagination.encode_cursor('user-all', ['2024-02-14 00:00:00', 3], 5)
+
+    assert pagination.decode_cursor(cursor, 'user-all', key_size=2) == (['2024-02-14 00:00:00', 3], 5, pagination.NEXT)
+
+    for key in (['2024-02-14 00:00:00'], '2024-02-14 00:00:00', ['2024-02-14 00:00:00', [3]], ['2024-02-14 00:00:00', 3, 1]):
+        with pytest.raises(ValueError):
+            pagination.decode_cursor(pagination.encode_cursor('user-all', key, 5), 'user-all', key_size=2)
+
+def test_decode_cursor_other_ordering():
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(pagination.encode_cursor('rooms', 3, 1), 'price')
+
+@pytest.mark.parametrize('filters', ['', '&type=flat'])
+@pytest.mark.parametrize('key, id', [([850], 3), ({'rent': 850}, 3), (850, [3]), (850, True)])
+def test_home_malformed_cursor(client, filters, key, id):
+    response = client.get(f"/?cursor={pagination.encode_cursor('price', key, id)}{filters}")
+
+    assert response.status_code == 302
+    assert get_flashes(client) == [('warning', "400 Bad Request: Errore di formattazione nel campo 'cursor'")]
+
+def test_home_pages(client):
+    response = client.get('/?page_size=2')
+    assert response.status_code == 200
+
+    cursor = pagination.encode_cursor('price', 850.0, 2)
+    assert client.get(f'/?page_size=2&cursor={cursor}').status_code == 200
+
+@pytest.mark.parametrize('key, id', [(['2024-02-14 00:00:00', '3'], 5), ([20240214, 3], 5), (['2024-02-14 00:00:00', 3], '5'), (['2024-02-14 00:00:00', True], 5)])
+def test_visits_malformed_cursor(app, key, id):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            visits.get_user_visits('albertone', page_cursor=pagination.encode_cursor('user-all', key, id))
+
+def test_visits_pages(app):
+    with app.app_context():
+        rows, next_cursor, prev_cursor = visits.get_user_visits('albertone', page_size=1)
+        assert len(rows) == 1 and next_cursor is not None and prev_cursor is None
+
+        rows, next_cursor, prev_cursor = visits.get_user_visits('albertone', page_size=1, page_cursor=next_cursor)
+        assert len(rows) == 1 and next_cursor is None and prev_cursor is not None
@@ -0,0 +1,36 @@
+import pytest
+from werkzeug.exceptions import TooManyRequests
+
+import ratelimit
+
+@pytest.mark.parametrize('make_store', [ratelimit.MemoryStore, lambda: ratelimit.SQLiteStore(':memory:')])
+def test_store_take(make_store):
+    store = make_store()
+
+    assert [store.take('key', 2, 1, 100) for _ in range(3)] == [0, 0, 1]  # A full bucket of 2 tokens, then empty
+    assert store.take('other', 2, 1, 100) == 0                            # Buckets are independent
+    assert store.take('key', 2, 1, 100.5) == pytest.approx(0.5)           # Half a token refilled
+    assert store.take('key', 2, 1, 101) == 0
+
+def test_sqlite_store_shared(tmp_path):
+    first, second = ratelimit.SQLiteStore(str(tmp_path / 'ratelimit.db')), ratelimit.SQLiteStore(str(tmp_path / 'ratelimit.db'))
+
+    assert first.take('key', 1, 1, 100) == 0
+    assert second.take('key', 1, 1, 100) == 1
+
+def test_memory_store_bounded():
+    store = ratelimit.MemoryStore(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        store.take(key, 1, 1, 100)
+
+    assert list(store.buckets) == ['b', 'c']
+    assert store.take('a', 1, 1, 100) == 0     # A dropped bucket is a full one
+
+def test_check(monkeypatch):
+    monkeypatch.setattr(ratelimit, '_store', ratelimit.MemoryStore())
+
+    ratelimit.check([('login:ip:1', (1, 60))])
+    with pytest.raises(TooManyRequests) as error:
+        ratelimit.check([('login:ip:1', (1, 60))])
+
+    assert dict(error.value.get_headers())['Retry-After'] == '60'
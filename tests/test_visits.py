@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import visits
+
+def visit_day(days):
+    return datetime.combine(date.today() + timedelta(days=days), datetime.min.time())
+
+def test_insert_visit_outcomes(app):
+    day = visit_day(3)
+
+    with app.app_context():
+        assert visits.insert_visit('luigi_verdi', 1, day, 1, False) == 'booked'
+        assert visits.insert_visit('luigi_verdi', 1, day, 2, False) == 'duplicate'     # One active visit per visitor and house
+        assert visits.insert_visit('domenico_97', 1, day, 1, False) == 'booked'
+
+        decision = {'visitor_username': 'luigi_verdi', 'advertisement_id': 1, 'date': day.strftime('%d/%m/%Y'), 'time': '12-14', 'decision': 'accept'}
+        assert visits.apply_visit_decisions('mario', [decision]) == (['accepted'], 1)  # The other request for the slot is rejected
+
+        assert visits.insert_visit('domenico_97', 1, day, 1, False) == 'taken'
+
+def test_apply_visit_decisions_results(app):
+    day = visit_day(3)
+
+    def decision(visitor, time='12-14', action='accept'):
+        return {'visitor_username': visitor, 'advertisement_id': 1, 'date': day.strftime('%d/%m/%Y'), 'time': time, 'decision': action, 'reason': ''}
+
+    with app.app_context():
+        visits.insert_visit('luigi_verdi', 1, day, 1, False)
+        visits.insert_visit('domenico_97', 1, day, 1, False)
+
+        assert visits.apply_visit_decisions('luigi_verdi', [decision('luigi_verdi')]) == (['forbidden'], 0)
+
+        results, auto_rejected = visits.apply_visit_decisions('mario', [
+            decision('luigi_verdi'),
+            decision('domenico_97'),            # Same slot, already accepted earlier in the batch
+            decision('albertone', time='25-26'),
+            decision('albertone', action='maybe'),
+        ])
+        assert results == ['accepted', 'conflict', 'invalid', 'invalid']
+
+def test_is_slot_free_horizon(app):
+    with app.app_context():
+        assert visits.is_slot_free(1, date.today() + timedelta(days=1), 0)
+        assert not visits.is_slot_free(1, date.today(), 0)
+        assert not visits.is_slot_free(1, date.today() + timedelta(days=visits.VISIT_DAYS + 1), 0)
+        assert not visits.is_slot_free(1, date.today() + timedelta(days=1), len(visits.Slot))
+
+@pytest.mark.parametrize('days', [3, visits.VISIT_DAYS, 28])
+def test_offered_slots_can_be_booked(app, days):
+    # Every slot offered by the booking page is accepted by the check of the booking, for any horizon
+    with app.app_context():
+        offered = visits.get_visits_next_week(1, days=days)
+        assert len(offered) == days
+
+        for i, day in enumerate(offered):
+            for slot in day['slots']:
+                assert visits.is_slot_free(1, date.today() + timedelta(days=i + 1), slot['pos'], days=days) == slot['available']
+
+        assert not visits.is_slot_free(1, date.today() + timedelta(days=days + 1), 0, days=days)
+
+def test_get_time_slots_default():
+    slots = visits.get_time_slots(days=2)
+
+    assert len(slots) == 2
+    assert all(slot['available'] for day in slots for slot in day['slots'])
+    assert visits.get_time_slots(days=2, free={(date.today() + timedelta(days=1)).isoformat(): 0})[0]['slots'][0]['available'] is False
+    assert visits.get_time_slots(days=2) == slots
@@ -1,30 +1,54 @@
-import sqlite3
+import threading
+import time
+
+import db
+import writer
+
+# In-process cache of the user profiles, read by the Flask-Login user loader on every authenticated request.
+# Entries are dropped when the user changes through this module; the TTL bounds how stale a profile can get
+# when the change happens in another process
+USER_CACHE_TTL = 60         # Seconds an entry is served for
+USER_CACHE_SIZE = 1024      # Once reached, the least recently used entries are dropped first
+
+_cache_lock = threading.Lock()
+_cache = {}                 # username -> (expires, profile). Dicts keep insertion order, the first key is the least recently used entry
 
 def add_user(user):
     try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         sql = 'INSERT INTO PERSON(username, email, password, name, landlord) VALUES(?, ?, ?, ?, ?)'
 
-        cursor.execute(sql, (user['username'], user['email'], user['password'], user['name'], True if user['client_type'] == 'landlord' else False))
-        conn.commit()
+        writer.execute_sql(sql, (user['username'], user['email'], user['password'], user['name'], True if user['client_type'] == 'landlord' else False))
+
+        invalidate_user(user['username'])
 
         return True
     except Exception as e:
         print('ERROR', str(e))
-        conn.rollback()
         
         return False
-    finally:
-        cursor.close()
-        conn.close()
+
+def update_password(username, password):
+    """
+    Replaces the password hash of a user
+
+    :param password: the new hash
+    """
+    try:
+        sql = 'UPDATE PERSON SET password = ? WHERE username = ?'
+
+        writer.execute_sql(sql, (password, username))
+
+        invalidate_user(username)
+
+        return True
+    except Exception as e:
+        print('ERROR', str(e))
+
+        return False
 
 def get_user(username):
     try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
+        conn = db.get_db()
         cursor = conn.cursor()
 
         sql = 'SELECT username, email, password, name, landlord FROM PERSON WHERE username = ?'
@@ -38,7 +62,41 @@ def get_user(username):
         return None
     finally:
         cursor.close()
-        conn.close()
+
+def get_profile(username):
+    """
+    Fetches the profile of a user (everything but the password hash), from the cache when possible
+
+    :returns: a dict with the username, email, name and landlord attributes, or None if the user doesn't exist
+    """
+    now = time.monotonic()
+
+    with _cache_lock:
+        entry = _cache.pop(username, None)
+        if entry is not None and entry[0] > now:
+            _cache[username] = entry    # Move to the most recently used end
+            return entry[1]
+
+    user = get_user(username)
+    if user is None:
+        return None     # Missing users aren't cached, signing up would have to invalidate them
+
+    profile = {'username': user['username'], 'email': user['email'], 'name': user['name'], 'landlord': user['landlord']}
+
+    with _cache_lock:
+        _cache[username] = (now + USER_CACHE_TTL, profile)
+
+        while len(_cache) > USER_CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+
+    return profile
+
+def invalidate_user(username):
+    """
+    Drops a user from the profile cache. To be called whenever the user is changed
+    """
+    with _cache_lock:
+        _cache.pop(username, None)
 
 def user_exists(username):
     """
@@ -47,8 +105,7 @@ def user_exists(username):
     :returns: True if a username is contained in the database, False otherwise
     """
     try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
+        conn = db.get_db()
         cursor = conn.cursor()
 
         sql = 'SELECT 1 FROM PERSON WHERE username = ?'
@@ -64,5 +121,4 @@ def user_exists(username):
         print("ERROR", e)
         return False
     finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        cursor.close()
\ No newline at end of file
@@ -2,7 +2,18 @@ import sqlite3
 from datetime import date, datetime, timedelta
 from enum import Enum
 
-import ads
+import db
+import formatting
+import pagination
+import writer
+
+VISIT_DAYS = 7      # Visits can be booked from tomorrow up to this many days ahead
+PAGE_SIZE = 20      # Visits per page on the personal page
+MAX_DECISIONS = 100 # Visits accepted or rejected in a single batch
+
+STATUSES = ('pending', 'accepted', 'rejected')
+
+SLOT_TAKEN_REASON = 'La fascia oraria è stata assegnata a un altro visitatore'     # Reason of the requests rejected because their slot was accepted for someone else
 
 class Slot(Enum):
     FIRST = '9-12'
@@ -37,306 +48,540 @@ class Slot(Enum):
             case _:
                 raise Exception('Unexpected time slot formatting')
 
-def get_visits_next_week(advertisement_id):
+SLOT_NAMES = [slot.value for slot in Slot]
+
+# The slots offered on a day are stored as a bitmask: bit i is set if slot i can be booked
+ALL_SLOTS = (1 << len(Slot)) - 1
+
+WEEKDAYS = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
+
+def get_visits_next_week(advertisement_id, days=VISIT_DAYS):
     """
-    Fetches the list of accepted visits scheduled for a certain property in the next week
+    Fetches the time slots of a certain property in the next days
 
-    :returns: A list of time slots containing the available time slots (unavailable slots have already scheduled visits)
+    :param days: number of days, starting from tomorrow
+    :returns: A list of time slots containing the available time slots (unavailable slots aren't offered by the landlord or have already scheduled visits)
     """
-    slots = get_time_slots()
+    first_day = date.today() + timedelta(days=1)
 
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    return get_time_slots(days=days, free=get_free_slots(advertisement_id, first_day, days))
+
+def get_free_slots(advertisement_id, first_day, days):
+    """
+    Computes the slots that can be booked in a range of days: the ones offered by the weekly availability or its exceptions,
+    minus the ones with an accepted visit. Only the exceptions and visits in the range are read, through the primary key
+    and the (ADVERTISEMENT_id, status, date, time) index: past visits don't slow it down
+
+    :param first_day: first day of the range, a date
+    :param days: number of days in the range
+    :returns: a dict mapping each day of the range (YYYY-MM-DD) to the bitmask of its free slots
+    """
+    first, last = first_day.isoformat(), (first_day + timedelta(days=days)).isoformat()
+
+    conn = db.get_db()
     cursor = conn.cursor()
 
+    weekly = get_weekly_slots(cursor, advertisement_id)
+
+    free = {}
+    for i in range(days):
+        day = first_day + timedelta(days=i)
+        free[day.isoformat()] = weekly[day.weekday()]
+
+    sql = """
+        SELECT date, slots
+        FROM AVAILABILITY_EXCEPTION
+        WHERE ADVERTISEMENT_id = ? AND date >= ? AND date < ?
+    """
+    cursor.execute(sql, (advertisement_id, first, last))
+    for row in cursor:
+        free[row['date']] = row['slots']
+
+    # Dates are stored as 'YYYY-MM-DD HH:MM:SS' strings, which sort like the dates they represent
     sql = """
         SELECT date, time
         FROM VISIT V
-        WHERE ADVERTISEMENT_id = ? AND status = 'accepted'
+        WHERE ADVERTISEMENT_id = ? AND status = 'accepted' AND date >= ? AND date < ?
     """
-    cursor.execute(sql, (advertisement_id,))
-    rows = cursor.fetchall()
+    cursor.execute(sql, (advertisement_id, first, last))
+    for row in cursor:
+        free[row['date'][:10]] &= ~(1 << row['time'])
 
     cursor.close()
-    conn.close()
 
-    for row in rows:
-        ad = dict(row)
-        date_obj = datetime.strptime(ad['date'], '%Y-%m-%d %H:%M:%S')
-        ad['date'] = date_obj.strftime('%d/%m/%Y')
+    return free
+
+def is_slot_free(advertisement_id, day, time, days=VISIT_DAYS):
+    """
+    Checks if a time slot can be booked: it has to be within the booking horizon, offered by the landlord and without accepted visits
+
+    :param day: the day of the visit, a date
+    :param time: position of the slot
+    :param days: the booking horizon, in days starting from tomorrow. The same passed to get_visits_next_week() for the slots offered
+    :returns: True if the slot can be booked, False otherwise
+    """
+    tomorrow = date.today() + timedelta(days=1)
+    if not tomorrow <= day < tomorrow + timedelta(days=days) or not 0 <= time < len(Slot):
+        return False
 
-        for day in slots:
-            if day['date'] == ad['date']:
-                for slot in day['slots']:
-                    if slot['pos'] == ad['time']:
-                        slot['available'] = False
+    free = get_free_slots(advertisement_id, day, 1)
 
-    return slots
+    return free[day.isoformat()] >> time & 1 == 1
 
-def has_user_visited(username, advertisement_id):
+def get_availability(advertisement_id):
     """
-    Checks if a user has already visited a house
+    Fetches the weekly availability of a property and its upcoming exceptions
 
-    :returns: True if the user has already visited the house, False otherwise
+    :returns: a (weekly, exceptions) tuple. weekly is a list of 7 bitmasks of the offered slots, Monday first.
+        exceptions is a list of {date: string, iso: string, slots: int} dicts, sorted by date
     """
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    conn = db.get_db()
     cursor = conn.cursor()
 
+    weekly = get_weekly_slots(cursor, advertisement_id)
+
     sql = """
-        SELECT COUNT (*) as visits
-        FROM VISIT
-        WHERE ADVERTISEMENT_id = ? AND visitor_username = ? AND status = 'accepted';
+        SELECT date, slots
+        FROM AVAILABILITY_EXCEPTION
+        WHERE ADVERTISEMENT_id = ? AND date > ?
+        ORDER BY date
     """
-    cursor.execute(sql, (advertisement_id, username))
-    res = cursor.fetchone()
+    cursor.execute(sql, (advertisement_id, date.today().isoformat()))
+    exceptions = [{'date': formatting.get_date(row['date']), 'iso': row['date'], 'slots': row['slots']} for row in cursor]
 
     cursor.close()
-    conn.close()
 
-    res = dict(res)
-    if res['visits'] > 0:
+    return weekly, exceptions
+
+def set_availability(landlord_username, advertisement_id, weekly):
+    """
+    Replaces the weekly availability of a property
+
+    :param weekly: a list of 7 bitmasks of the offered slots, Monday first
+    """
+    try:
+        writer.execute(_set_availability, landlord_username, advertisement_id, weekly)
+
         return True
+    except Exception as e:
+        print('ERROR', str(e))
 
-    return False
+        return False
 
-def is_user_waiting_visit(username, advertisement_id):
+def _set_availability(conn, landlord_username, advertisement_id, weekly):
+    # Runs in the writer thread, see writer.execute()
+    sql = """
+        INSERT INTO AVAILABILITY(ADVERTISEMENT_id, weekday, slots)
+        SELECT ?, ?, ?
+        WHERE EXISTS (SELECT 1 FROM ADVERTISEMENT WHERE id = ? AND landlord_username = ?)
+        ON CONFLICT(ADVERTISEMENT_id, weekday) DO UPDATE SET slots = excluded.slots;
     """
-    Checks if a user has booked a house and is awaiting a confirmation
 
-    :returns: True if the user has has a pending visit, False otherwise
+    conn.executemany(sql, [(advertisement_id, weekday, slots, advertisement_id, landlord_username) for weekday, slots in enumerate(weekly)])
+
+def set_availability_exception(landlord_username, advertisement_id, day, slots):
     """
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    Overrides the weekly availability of a property on a single date
 
-    sql = """
-        SELECT COUNT (*) as visits
-        FROM VISIT
-        WHERE ADVERTISEMENT_id = ? AND visitor_username = ? AND status = 'pending';
+    :param day: the date, YYYY-MM-DD
+    :param slots: bitmask of the slots offered on that date
     """
-    cursor.execute(sql, (advertisement_id, username))
-    res = cursor.fetchone()
+    try:
+        sql = """
+            INSERT INTO AVAILABILITY_EXCEPTION(ADVERTISEMENT_id, date, slots)
+            SELECT ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM ADVERTISEMENT WHERE id = ? AND landlord_username = ?)
+            ON CONFLICT(ADVERTISEMENT_id, date) DO UPDATE SET slots = excluded.slots;
+        """
 
-    cursor.close()
-    conn.close()
+        writer.execute_sql(sql, (advertisement_id, day, slots, advertisement_id, landlord_username))
 
-    res = dict(res)
-    if res['visits'] > 0:
         return True
+    except Exception as e:
+        print('ERROR', str(e))
 
-    return False
+        return False
 
-def insert_visit(username, advertisement_id, date, time, virtual):
-    try:
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+def delete_availability_exception(landlord_username, advertisement_id, day):
+    """
+    Removes the exception of a property on a date, the weekly availability applies again
 
-        sql = 'INSERT INTO VISIT(date, time, visitor_username, ADVERTISEMENT_id, virtual, status) VALUES(?, ?, ?, ?, ?, ?)'
+    :param day: the date, YYYY-MM-DD
+    """
+    try:
+        sql = """
+            DELETE FROM AVAILABILITY_EXCEPTION
+            WHERE EXISTS (
+                SELECT 1
+                FROM ADVERTISEMENT
+                WHERE ADVERTISEMENT.id = AVAILABILITY_EXCEPTION.ADVERTISEMENT_id
+                AND ADVERTISEMENT.landlord_username = ?
+            )
+            AND ADVERTISEMENT_id = ?
+            AND date = ?;
+        """
 
-        cursor.execute(sql, (date, time, username, advertisement_id, virtual, 'pending'))
-        conn.commit()
+        writer.execute_sql(sql, (landlord_username, advertisement_id, day))
 
         return True
     except Exception as e:
         print('ERROR', str(e))
-        conn.rollback()
-        
+
         return False
-    finally:
-        cursor.close()
-        conn.close()
 
-def get_user_visits(username):
+def insert_visit(username, advertisement_id, date, time, virtual):
     """
-    Fetches the list of visits booked by a user and basic information on the relevant properties
+    Books a visit, atomically: the checks and the insert run in the writer thread, under the database write lock, and the
+    partial unique indexes on VISIT reject anything slipping through. A slot previously rejected for the same user can be requested again
 
-    :returns: A list of visit reservations
+    :returns: 'booked' on success, 'taken' if the slot was accepted for another visitor, 'duplicate' if the user already has
+        a pending or accepted visit to the house, None if the visit couldn't be saved
     """
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
+    try:
+        return writer.execute(_insert_visit, username, advertisement_id, date, time, virtual)
+    except sqlite3.IntegrityError:
+        return 'duplicate'  # VISIT_visitor_active: another request of the user to the same house
+    except Exception as e:
+        print('ERROR', str(e))
+        
+        return None
+
+def _insert_visit(conn, username, advertisement_id, date, time, virtual):
+    # Runs in the writer thread, see writer.execute()
     cursor = conn.cursor()
 
     sql = """
-        SELECT V.date, V.time, V.virtual, V.status, V.refusal_reason, 
+        SELECT 1
+        FROM VISIT
+        WHERE ADVERTISEMENT_id = ? AND date = ? AND time = ? AND status = 'accepted';
+    """
+    cursor.execute(sql, (advertisement_id, date, time))
+    if cursor.fetchone() is not None:
+        return 'taken'
+
+    sql = """
+        INSERT INTO VISIT(date, time, visitor_username, ADVERTISEMENT_id, virtual, status) VALUES(?, ?, ?, ?, ?, 'pending')
+        ON CONFLICT(date, time, visitor_username, ADVERTISEMENT_id) DO UPDATE
+        SET status = 'pending', virtual = excluded.virtual, refusal_reason = NULL
+        WHERE VISIT.status = 'rejected';
+    """
+    cursor.execute(sql, (date, time, username, advertisement_id, virtual))
+    if cursor.rowcount == 0:    # The same slot is already pending or accepted for the user
+        return 'duplicate'
+
+    return 'booked'
+
+def get_user_visits(username, status='all', page_size=PAGE_SIZE, page_cursor=None):
+    """
+    Fetches a page of the visits booked by a user and basic information on the relevant properties, most recent first
+
+    :param status: one of STATUSES to only list the visits in that state, 'all' to list every visit
+    :param page_size: the number of visits in the page
+    :param page_cursor: an opaque cursor, as returned by a previous call with the same status. If None the first page is returned
+    :returns: a (visits, next_cursor, prev_cursor) tuple. The cursors are None if there is no next/previous page
+    :raise ValueError: exception raised when the cursor is not valid
+    """
+    sql = """
+        SELECT V.rowid as id, V.date, V.time, V.virtual, V.status, V.refusal_reason, 
             A.id as ad_id, A.title as ad_title, A.adress as ad_adress, A.type as ad_type, A.furniture as ad_furniture, A.rooms as ad_rooms, 
 			PE.name as landlord_name
         FROM VISIT V
         INNER JOIN ADVERTISEMENT A ON A.id = V.ADVERTISEMENT_id
 		INNER JOIN PERSON PE ON A.landlord_username = PE.username
-        WHERE V.visitor_username = ?;
+        WHERE V.visitor_username = ?
     """
-    cursor.execute(sql, (username,))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    results = []
-    for row in rows:
-        res = dict(row)
-        date_obj = datetime.strptime(res['date'], '%Y-%m-%d %H:%M:%S')
-        res['date'] = date_obj.strftime('%d/%m/%Y')
-        res['time'] = Slot.parse_db(res['time'])
-        res['virtual'] = res['virtual'] == True
-        res['ad_rooms'] = ads.get_rooms(res['ad_rooms'])
-        res['ad_furniture'] = ads.get_furniture(res['ad_furniture'], res['ad_type'])
-        res['ad_type'] = ads.get_type(res['ad_type'])
-
-        results.append(res)
-
-    results.reverse()   # Reverse to make the most recent visits appear fist
-    return results
+    return get_visits_page(sql, [username], f'user-{status}', status, page_size, page_cursor)
 
-def get_landlord_visits(username):
+def get_landlord_visits(username, status='pending', page_size=PAGE_SIZE, page_cursor=None):
     """
-    Fetches the list of visits booked to all properties belonging to a landlord and basic information on the relevant properties
+    Fetches a page of the visits booked to all properties belonging to a landlord and basic information on the relevant properties, most recent first
 
-    :returns: A list of visit reservations
+    :param status: one of STATUSES to only list the visits in that state, 'all' to list every visit
+    :param page_size: the number of visits in the page
+    :param page_cursor: an opaque cursor, as returned by a previous call with the same status. If None the first page is returned
+    :returns: a (visits, next_cursor, prev_cursor) tuple. The cursors are None if there is no next/previous page
+    :raise ValueError: exception raised when the cursor is not valid
     """
-    conn = sqlite3.connect('database/database.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     sql = """
-        SELECT V.date, V.time, V.virtual, V.status, V.refusal_reason, 
+        SELECT V.rowid as id, V.date, V.time, V.virtual, V.status, V.refusal_reason, 
             A.id as ad_id, A.title as ad_title, A.adress as ad_adress, A.type as ad_type, A.furniture as ad_furniture, A.rooms as ad_rooms, 
 			PE.name as visitor_name, PE.username as visitor_username
         FROM VISIT V
         INNER JOIN ADVERTISEMENT A ON A.id = V.ADVERTISEMENT_id
 		INNER JOIN PERSON PE ON V.visitor_username = PE.username
-        WHERE A.landlord_username = ?;
+        WHERE A.landlord_username = ?
     """
-    cursor.execute(sql, (username,))
-    rows = cursor.fetchall()
+    return get_visits_page(sql, [username], f'landlord-{status}', status, page_size, page_cursor)
 
-    cursor.close()
-    conn.close()
-
-    results = []
-    for row in rows:
-        res = dict(row)
-        date_obj = datetime.strptime(res['date'], '%Y-%m-%d %H:%M:%S')
-        res['date'] = date_obj.strftime('%d/%m/%Y')
-        res['time'] = Slot.parse_db(res['time'])
-        res['virtual'] = res['virtual'] == True
-        res['ad_rooms'] = ads.get_rooms(res['ad_rooms'])
-        res['ad_furniture'] = ads.get_furniture(res['ad_furniture'], res['ad_type'])
-        res['ad_type'] = ads.get_type(res['ad_type'])
+def get_user_visit_counts(username):
+    """
+    Counts the visits booked by a user
 
-        results.append(res)
-    
-    results.reverse()   # Reverse to make the most recent visits appear fist
-    return results
+    :returns: a dict mapping each of STATUSES and 'all' to the number of visits
+    """
+    sql = """
+        SELECT status, COUNT(*) as visits
+        FROM VISIT
+        WHERE visitor_username = ?
+        GROUP BY status;
+    """
+    return get_visit_counts(sql, username)
 
-def accept_visit(landlord_username, visitor_username, advertisement_id, date, time):
-    try:
-        # Parse date and times
-        date_obj = datetime.strptime(date, '%d/%m/%Y')
-        date_parsed = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-        time_parsed = Slot.parse_str(time)
+def get_landlord_visit_counts(username):
+    """
+    Counts the visits booked to all properties belonging to a landlord
 
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    :returns: a dict mapping each of STATUSES and 'all' to the number of visits
+    """
+    sql = """
+        SELECT V.status, COUNT(*) as visits
+        FROM VISIT V
+        INNER JOIN ADVERTISEMENT A ON A.id = V.ADVERTISEMENT_id
+        WHERE A.landlord_username = ?
+        GROUP BY V.status;
+    """
+    return get_visit_counts(sql, username)
 
-        sql = """
-            UPDATE VISIT
-            SET status = 'accepted'
-            WHERE EXISTS (
-                SELECT 1
-                FROM ADVERTISEMENT
-                WHERE ADVERTISEMENT.id = VISIT.ADVERTISEMENT_id
-                AND ADVERTISEMENT.landlord_username = ?
-            )
-            AND ADVERTISEMENT_id = ?
-            AND visitor_username = ?
-            AND date = ?
-            AND time = ?
-            AND status = 'pending';
-        """
+def apply_visit_decisions(landlord_username, decisions):
+    """
+    Accepts or rejects a batch of pending visits in a single transaction. Accepting a visit rejects the other pending requests
+    for the same slot, as the landlord can only show the house to one visitor at a time
+
+    :param decisions: a list of dicts with the following structure:
+        {visitor_username: string, advertisement_id: int, date: string (DD/MM/YYYY), time: string (e.g. '9-12'), decision: 'accept' | 'reject', reason: string}.
+        The reason is only used for rejections
+    :returns: a (results, auto_rejected) tuple, or None if the transaction failed. results has a string for each decision, in the same order:
+        'accepted' or 'rejected' when applied, 'invalid' when malformed, 'forbidden' when the house belongs to another landlord,
+        'not_pending' when there is no such pending visit (e.g. already handled), 'conflict' when the slot is already taken by an accepted visit.
+        auto_rejected is the number of other requests rejected because their slot was accepted
+    """
+    results = [None] * len(decisions)
+    keys = [None] * len(decisions)     # (advertisement id, visitor, date, time) of each valid decision, in the DB format
 
-        cursor.execute(sql, (landlord_username, advertisement_id, visitor_username, date_parsed, time_parsed))
-        conn.commit()
+    for i, item in enumerate(decisions):
+        try:
+            if item['decision'] not in ('accept', 'reject'):
+                raise ValueError(f"Unexpected decision {item['decision']}")
 
-        return True
+            date_parsed = datetime.strptime(item['date'], '%d/%m/%Y').strftime('%Y-%m-%d %H:%M:%S')
+            keys[i] = (int(item['advertisement_id']), item['visitor_username'], date_parsed, Slot.parse_str(item['time']))
+        except Exception:
+            results[i] = 'invalid'
+
+    valid = [i for i in range(len(decisions)) if results[i] is None]
+    if len(valid) == 0:
+        return results, 0
+
+    try:
+        applied, auto_rejected = writer.execute(_apply_visit_decisions, landlord_username, decisions, keys, valid)
     except Exception as e:
         print('ERROR', str(e))
-        conn.rollback()
-        
-        return False
-    finally:
-        cursor.close()
-        conn.close()
 
-def reject_visit(landlord_username, visitor_username, advertisement_id, date, time, reject_reason):
-    try:
-        # Parse date and times
-        date_obj = datetime.strptime(date, '%d/%m/%Y')
-        date_parsed = date_obj.strftime('%Y-%m-%d %H:%M:%S')
-        time_parsed = Slot.parse_str(time)
+        return None
 
-        conn = sqlite3.connect('database/database.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    for i, result in applied.items():
+        results[i] = result
 
-        sql = """
-            UPDATE VISIT
-            SET status = 'rejected', refusal_reason = ?
-            WHERE EXISTS (
-                SELECT 1
-                FROM ADVERTISEMENT
-                WHERE ADVERTISEMENT.id = VISIT.ADVERTISEMENT_id
-                AND ADVERTISEMENT.landlord_username = ?
-            )
-            AND ADVERTISEMENT_id = ?
-            AND visitor_username = ?
-            AND date = ?
-            AND time = ?
-            AND status = 'pending';
-        """
+    return results, auto_rejected
 
-        cursor.execute(sql, (reject_reason, landlord_username, advertisement_id, visitor_username, date_parsed, time_parsed))
-        conn.commit()
+def _apply_visit_decisions(conn, landlord_username, decisions, keys, valid):
+    # Runs in the writer thread, see writer.execute(). The checks below run under the write lock, so they still hold when the updates are applied
+    cursor = conn.cursor()
+    applied = {}    # index of the decision -> its result
 
-        return True
-    except Exception as e:
-        print('ERROR', str(e))
-        conn.rollback()
+    # Ownership is checked once per advertisement
+    ad_ids = sorted({keys[i][0] for i in valid})
+    cursor.execute(f"SELECT id FROM ADVERTISEMENT WHERE landlord_username = ? AND id IN ({', '.join('?' * len(ad_ids))})", (landlord_username, *ad_ids))
+    owned = {row['id'] for row in cursor}
 
-        return False
-    finally:
-        cursor.close()
-        conn.close()
+    # Pending visits among the requested ones, and slots already taken
+    cursor.execute(f"""
+        SELECT ADVERTISEMENT_id, visitor_username, date, time
+        FROM VISIT
+        WHERE status = 'pending' AND (ADVERTISEMENT_id, visitor_username, date, time) IN (VALUES {', '.join(['(?, ?, ?, ?)'] * len(valid))})
+    """, [value for i in valid for value in keys[i]])
+    pending = {tuple(row) for row in cursor}
+
+    slots = sorted({(keys[i][0], keys[i][2], keys[i][3]) for i in valid})
+    cursor.execute(f"""
+        SELECT ADVERTISEMENT_id, date, time
+        FROM VISIT
+        WHERE status = 'accepted' AND (ADVERTISEMENT_id, date, time) IN (VALUES {', '.join(['(?, ?, ?)'] * len(slots))})
+    """, [value for slot in slots for value in slot])
+    taken = {tuple(row) for row in cursor}
+
+    accepted, rejected = [], []
+    for i in valid:
+        ad_id, visitor, visit_date, visit_time = keys[i]
+        slot = (ad_id, visit_date, visit_time)
+
+        if ad_id not in owned:
+            applied[i] = 'forbidden'
+        elif keys[i] not in pending:
+            applied[i] = 'not_pending'
+        elif decisions[i]['decision'] == 'reject':
+            rejected.append((decisions[i].get('reason'), *keys[i]))
+            applied[i] = 'rejected'
+        elif slot in taken:
+            applied[i] = 'conflict'     # Accepted earlier, or by a previous decision of this batch
+        else:
+            accepted.append(keys[i])
+            taken.add(slot)
+            applied[i] = 'accepted'
+
+    sql = """
+        UPDATE VISIT
+        SET status = 'accepted'
+        WHERE ADVERTISEMENT_id = ? AND visitor_username = ? AND date = ? AND time = ? AND status = 'pending';
+    """
+    cursor.executemany(sql, accepted)
+
+    sql = """
+        UPDATE VISIT
+        SET status = 'rejected', refusal_reason = ?
+        WHERE ADVERTISEMENT_id = ? AND visitor_username = ? AND date = ? AND time = ? AND status = 'pending';
+    """
+    cursor.executemany(sql, rejected)
+
+    # The other requests for the accepted slots can't be satisfied anymore
+    sql = """
+        UPDATE VISIT
+        SET status = 'rejected', refusal_reason = ?
+        WHERE ADVERTISEMENT_id = ? AND date = ? AND time = ? AND status = 'pending';
+    """
+    cursor.executemany(sql, [(SLOT_TAKEN_REASON, ad_id, visit_date, visit_time) for ad_id, _, visit_date, visit_time in accepted])
+    auto_rejected = max(cursor.rowcount, 0)
+
+    return applied, auto_rejected
 
 # HELPER FUNCTIONS
 
-def get_time_slots():
+def get_visits_page(sql, params, sort, status, page_size, page_cursor):
     """
-    Returns a list of dictionaries for all the time slots in the next 7 days
+    Runs one of the visit listing queries, adding the status filter and the keyset pagination on (date, time, rowid), descending
 
-    :returns: a dict with the following structure: {date: string, slots: {time: string, available: boolean, pos: int}[]}
-    """ 
-    tomorrow = date.today() + timedelta(days=1)
+    :param sql: the query, up to its WHERE clause. It must select the rowid of the visit as 'id'
+    :param params: the parameters of the query
+    :param sort: name of the listing, cursors of other listings are rejected
+    :returns: a (visits, next_cursor, prev_cursor) tuple
+    :raise ValueError: exception raised when the cursor is not valid
+    """
+    params = list(params)
+    descending = True
+    direction = pagination.NEXT
+
+    if status != 'all':
+        sql += ' AND V.status = ?'
+        params.append(status)
+
+    if page_cursor is not None:
+        key, id, direction = pagination.decode_cursor(page_cursor, sort, key_size=2)
+
+        # The key is the [date, time] pair of a visit
+        if not isinstance(key[0], str) or not pagination.is_int64(key[1]):
+            raise ValueError('Malformed cursor')
+
+        if direction == pagination.PREV:
+            descending = False      # Walk backwards from the cursor, the page is flipped back by paginate()
+
+        sql += f' AND (V.date, V.time, V.rowid) {"<" if descending else ">"} (?, ?, ?)'
+        params += [*key, id]
+
+    order = 'DESC' if descending else 'ASC'
+    sql += f' ORDER BY V.date {order}, V.time {order}, V.rowid {order} LIMIT ?'
+    params.append(page_size + 1)    # One extra row tells whether there is a following page
+
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    cursor.execute(sql, params)
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    cursor.close()
+
+    def make_cursor(visit, direction):
+        return pagination.encode_cursor(sort, [visit['date'], visit['time']], visit['id'], direction)
+
+    rows, next_cursor, prev_cursor = pagination.paginate(rows, page_size, direction, has_cursor=page_cursor is not None, make_cursor=make_cursor)
 
-    next_seven_days = []
-    for i in range(7):
-        next_day = tomorrow + timedelta(days=i)
-        next_day = next_day.strftime('%d/%m/%Y')
+    for res in rows:
+        res['date'] = formatting.get_date(res['date'])
+        res['time'] = SLOT_NAMES[res['time']]
+        res['virtual'] = res['virtual'] == True
+        res['ad_rooms'] = formatting.get_rooms(res['ad_rooms'])
+        res['ad_furniture'] = formatting.get_furniture(res['ad_furniture'], res['ad_type'])
+        res['ad_type'] = formatting.get_type(res['ad_type'])
+
+    return rows, next_cursor, prev_cursor
+
+def get_visit_counts(sql, username):
+    """
+    Runs one of the visit counting queries, grouped by status
 
-        day_dict = {
-            'date': next_day,
-            'slots': []
-        }
+    :returns: a dict mapping each of STATUSES and 'all' to the number of visits
+    """
+    conn = db.get_db()
+    cursor = conn.cursor()
+
+    counts = dict.fromkeys(STATUSES, 0)
+
+    cursor.execute(sql, (username,))
+    for row in cursor:
+        counts[row['status']] = row['visits']
+
+    cursor.close()
+
+    counts['all'] = sum(counts.values())
+
+    return counts
+
+def get_weekly_slots(cursor, advertisement_id):
+    """
+    :returns: a list of 7 bitmasks of the slots offered on each weekday, Monday first
+    """
+    weekly = [ALL_SLOTS] * 7
+
+    cursor.execute('SELECT weekday, slots FROM AVAILABILITY WHERE ADVERTISEMENT_id = ?', (advertisement_id,))
+    for row in cursor:
+        weekly[row['weekday']] = row['slots']
+
+    return weekly
+
+def parse_slots(positions):
+    """
+    :param positions: iterable of slot positions, as strings (e.g. the values of a group of checkboxes)
+    :returns: the bitmask of the slots
+    :raise ValueError: raised when a position isn't a valid slot
+    """
+    mask = 0
+    for pos in positions:
+        pos = int(pos)
+        if not 0 <= pos < len(Slot):
+            raise ValueError(f'Unexpected time slot {pos}')
+        mask |= 1 << pos
+
+    return mask
+
+def get_time_slots(days=VISIT_DAYS, free=None):
+    """
+    Returns a list of dictionaries for all the time slots in the next days
+
+    :param days: number of days, starting from tomorrow
+    :param free: dict mapping days (YYYY-MM-DD) to the bitmask of their free slots, as returned by get_free_slots(). Missing days have all slots free
+    :returns: a dict with the following structure: {date: string, slots: {time: string, available: boolean, pos: int}[]}
+    """
+    if free is None:
+        free = {}
+
+    tomorrow = date.today() + timedelta(days=1)
 
-        for j, slot in enumerate(Slot, start=0):
-            day_dict['slots'].append({
-                'time': slot.value,
-                'available': True,
-                'pos': j
-            })
+    next_days = []
+    for i in range(days):
+        iso_day = (tomorrow + timedelta(days=i)).isoformat()
 
-        next_seven_days.append(day_dict)
+        next_days.append({
+            'date': formatting.get_date(iso_day),
+            'slots': [{'time': name, 'available': free.get(iso_day, ALL_SLOTS) >> pos & 1 == 1, 'pos': pos} for pos, name in enumerate(SLOT_NAMES)]
+        })
 
-    return next_seven_days
\ No newline at end of file
+    return next_days
\ No newline at end of file
@@ -0,0 +1,138 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import db
+
+# All the writes of a process go through a single thread owning the only writable connection. Callers queue their writes
+# as operations and wait for the result. The thread runs the operations queued at the same time in one transaction (group commit),
+# each one in its own savepoint, so a failing operation doesn't undo the others. With a single writer the threads of a process
+# never fight over the database lock, and a whole batch costs one commit
+
+MAX_BATCH = 64          # Operations committed together at most
+TIMEOUT = 10            # Seconds a caller waits for its operation. The operation is still committed if it runs later
+
+_queue = queue.SimpleQueue()    # (future, operation, args, kwargs) tuples of the operations waiting for the writer
+_thread = None
+_lock = threading.Lock()
+
+def execute(operation, *args, **kwargs):
+    """
+    Runs a write operation in the writer thread and waits for its outcome
+
+    :param operation: function taking the writer connection as its first argument, followed by args and kwargs.
+        It runs inside a transaction and must not commit nor roll back: its changes are committed with the rest of the batch,
+        or undone if it raises an exception
+    :returns: the value returned by the operation, once committed
+    :raise Exception: the exception raised by the operation, or by the transaction around it
+    """
+    return submit(operation, *args, **kwargs).result(TIMEOUT)
+
+def submit(operation, *args, **kwargs):
+    """
+    Queues a write operation without waiting for it, see execute()
+
+    :returns: a Future resolved once the operation is committed
+    """
+    future = Future()
+    _queue.put((future, operation, args, kwargs))
+    start()
+
+    return future
+
+def execute_sql(sql, params=()):
+    """
+    Runs a single statement in the writer thread and waits for it
+
+    :returns: the number of rows changed by the statement
+    """
+    return execute(_execute_sql, sql, params)
+
+def _execute_sql(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+def start():
+    """
+    Starts the writer thread of this process, if not already running
+    """
+    global _thread
+
+    if _thread is not None and _thread.is_alive():
+        return
+
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_write, name='db-writer', daemon=True)
+            _thread.start()
+
+def _write():
+    conn = db.connect()
+    conn.isolation_level = None     # Transactions are handled manually
+
+    while True:
+        # Block for the first operation, then take whatever else queued up meanwhile
+        batch = [_queue.get()]
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        run_batch(conn, [item for item in batch if item[0].set_running_or_notify_cancel()])
+
+def run_batch(conn, batch):
+    """
+    Runs a batch of operations in a single transaction and resolves their futures. Each operation runs in a savepoint:
+    one raising an exception is rolled back alone. If the transaction itself fails, every operation fails with its error
+
+    :param conn: the writer connection, in autocommit mode
+    :param batch: a list of (future, operation, args, kwargs) tuples
+    """
+    if not batch:
+        return
+
+    outcomes = []   # (future, result, exception) tuples
+
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+
+        for future, operation, args, kwargs in batch:
+            conn.execute('SAVEPOINT operation')
+
+            try:
+                result = operation(conn, *args, **kwargs)
+            except Exception as e:
+                conn.execute('ROLLBACK TO operation')
+                outcomes.append((future, None, e))
+            else:
+                outcomes.append((future, result, None))
+
+            conn.execute('RELEASE operation')
+
+        conn.execute('COMMIT')
+    except Exception as e:
+        print('ERROR', str(e))
+
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+
+        for future, _, _, _ in batch:
+            future.set_exception(e)
+
+        return
+
+    for future, result, exception in outcomes:
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+def init_worker():
+    """
+    Forgets the writer of the parent process. Called in each worker after a fork, the writer is started again on the first write
+    """
+    global _queue, _thread, _lock
+
+    _queue = queue.SimpleQueue()
+    _thread = None
+    _lock = threading.Lock()